@@ -1,5 +1,6 @@
 # config.py
 import os
+import socket
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 from runpy import run_path
@@ -56,6 +57,91 @@ CEREBRAS_MODEL   = os.getenv("CEREBRAS_MODEL", "qwen-3-235b-a22b-instruct-2507")
 GEMINI_API_KEY   = os.getenv("GEMINI_API_KEY", "").strip()
 GEMINI_MODEL     = os.getenv("GEMINI_MODEL", "gemini-2.5-flash").strip()
 
+# Клиенты провайдеров (utils/providers): пустой base_url — адрес SDK по умолчанию
+# (можно направить на scripts/provider_stub.py для замеров)
+CEREBRAS_BASE_URL = os.getenv("CEREBRAS_BASE_URL", "").strip()
+GEMINI_BASE_URL   = os.getenv("GEMINI_BASE_URL", "").strip()
+# thread — синхронный SDK в пуле потоков; async — нативные async-клиенты в event loop
+LLM_TRANSPORT     = os.getenv("LLM_TRANSPORT", "thread").strip().lower()
+LLM_POOL_SIZE     = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_KEEPALIVE_SEC = float(os.getenv("LLM_KEEPALIVE_SEC", "60"))
+# Локальные модели (services/llm_service, services/ai_service): файл модели и папка с ним
+MODEL_NAME         = os.getenv("MODEL_NAME", "orca-mini-3b-gguf2-q4_0.gguf")
+MODELS_DIR         = os.getenv("MODELS_DIR", "models")
+# Локальный llama.cpp (services/llm_pool): число процессов-воркеров (0 — одна модель в процессе бота),
+# потоков на воркер (0 — ядра поровну), очередь на воркер, потолок одной генерации в воркере, с
+# (0 — без потолка), закреплять ли воркер за своими ядрами
+LLM_WORKERS        = int(os.getenv("LLM_WORKERS", "0"))
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", "0"))
+LLM_WORKER_QUEUE   = int(os.getenv("LLM_WORKER_QUEUE", "4"))
+LLM_WORKER_MAX_SEC = float(os.getenv("LLM_WORKER_MAX_SEC", "120"))
+LLM_PIN_CORES      = os.getenv("LLM_PIN_CORES", "1") == "1"
+# снимки KV-кэша чатов (services/llm_state): общий бюджет памяти, МБ (0 — не хранить)
+LLM_STATE_CACHE_MB = int(os.getenv("LLM_STATE_CACHE_MB", "512"))
+# непрерывный батчинг (services/llm_batcher): окно сбора, мс; последовательностей в батче; n_batch
+LLM_BATCHING        = os.getenv("LLM_BATCHING", "0") == "1"
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "20"))
+LLM_BATCH_MAX_SEQS  = int(os.getenv("LLM_BATCH_MAX_SEQS", "8"))
+LLM_BATCH_TOKENS    = int(os.getenv("LLM_BATCH_TOKENS", "512"))
+# Потоковый ответ ИИ: заглушка + edit_message_text не чаще раза в STREAM_EDIT_SEC
+STREAM_REPLIES    = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_SEC   = float(os.getenv("STREAM_EDIT_SEC", "1.0"))
+STREAM_TIMEOUT    = float(os.getenv("STREAM_TIMEOUT", "25"))
+# Бюджет генерации (utils/budget): max_len символов -> max tokens у провайдера
+LLM_LONG_MAX_TOKENS     = int(os.getenv("LLM_LONG_MAX_TOKENS", "2000"))   # «подробно» и прежний общий потолок
+LLM_CHARS_PER_TOKEN     = float(os.getenv("LLM_CHARS_PER_TOKEN", "3.0"))  # грубо для кириллицы
+GEMINI_THINKING_RESERVE = int(os.getenv("GEMINI_THINKING_RESERVE", "1024"))  # 2.5-модели тратят лимит и на «размышления»
+# Кэш ответов ИИ (utils/reply_cache): размер L1, TTL, сколько последних сообщений в ключе
+REPLY_CACHE_ENABLED     = os.getenv("REPLY_CACHE_ENABLED", "1") == "1"
+REPLY_CACHE_SIZE        = int(os.getenv("REPLY_CACHE_SIZE", "2000"))
+REPLY_CACHE_TTL         = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+REPLY_CACHE_TURNS       = int(os.getenv("REPLY_CACHE_TURNS", "3"))
+# Семантический кэш по qa_logs (services/semantic_cache, нужен scikit-learn)
+SEMANTIC_CACHE_ENABLED   = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+# Хедж запросов к ИИ (utils/hedge): через сколько секунд звать второй движок
+HEDGE_REQUESTS      = os.getenv("HEDGE_REQUESTS", "0") == "1"
+HEDGE_PERCENTILE    = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_DELAY     = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_MAX_DELAY     = float(os.getenv("HEDGE_MAX_DELAY", "8.0"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "4.0"))  # пока мало замеров
+# Адаптивные дедлайны (utils/deadlines): перцентиль задержек × множитель, зажатый в [MIN, MAX], сек
+DEADLINE_PERCENTILE   = float(os.getenv("DEADLINE_PERCENTILE", "0.95"))
+DEADLINE_FACTOR       = float(os.getenv("DEADLINE_FACTOR", "1.5"))
+DEADLINE_MIN_SEC      = float(os.getenv("DEADLINE_MIN_SEC", "6"))
+DEADLINE_MAX_SEC      = float(os.getenv("DEADLINE_MAX_SEC", "25"))
+DEADLINE_DEFAULT_SEC  = float(os.getenv("DEADLINE_DEFAULT_SEC", "25"))  # пока мало замеров
+TOOL_DEADLINE_MIN_SEC = float(os.getenv("TOOL_DEADLINE_MIN_SEC", "2"))   # погода/праздники/поиск
+TOOL_DEADLINE_MAX_SEC = float(os.getenv("TOOL_DEADLINE_MAX_SEC", "10"))
+# Circuit breaker провайдеров ИИ (utils/breaker)
+BREAKER_WINDOW_SEC        = float(os.getenv("BREAKER_WINDOW_SEC", "60"))
+BREAKER_MIN_CALLS         = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE        = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN_SEC      = float(os.getenv("BREAKER_COOLDOWN_SEC", "30"))
+BREAKER_MAX_COOLDOWN_SEC  = float(os.getenv("BREAKER_MAX_COOLDOWN_SEC", "300"))
+BREAKER_SLOW_SEC          = float(os.getenv("BREAKER_SLOW_SEC", "20"))  # дольше — считаем ошибкой
+BREAKER_PROBE_TIMEOUT_SEC = float(os.getenv("BREAKER_PROBE_TIMEOUT_SEC", "60"))  # пробный вызов без итога — пускаем новый
+
+# Склейка сообщений чата перед ИИ (utils/coalesce): пауза тишины и потолок ожидания, сек
+COALESCE_WINDOW_SEC   = float(os.getenv("COALESCE_WINDOW_SEC", "0.4"))
+COALESCE_MAX_WAIT_SEC = float(os.getenv("COALESCE_MAX_WAIT_SEC", "2"))
+
+# Пулы потоков для блокирующих SDK (utils/executors): "имя=потоки:очередь,..." поверх значений по умолчанию
+EXECUTOR_SIZES = os.getenv("EXECUTOR_SIZES", "")
+
+# Память диалогов (utils/memory): общий бюджет символов на процесс и TTL простоя чата, сек
+MEMORY_MAX_TOTAL_CHARS = int(os.getenv("MEMORY_MAX_TOTAL_CHARS", "20000000"))
+MEMORY_IDLE_TTL        = float(os.getenv("MEMORY_IDLE_TTL", "21600"))
+# write-behind в SQLite (таблица chat_memory): включено ли и как часто сбрасывать, сек
+MEMORY_PERSIST         = os.getenv("MEMORY_PERSIST", "1") == "1"
+MEMORY_FLUSH_SEC       = float(os.getenv("MEMORY_FLUSH_SEC", "5"))
+# Сжатие старых ходов в краткое содержание (utils/summarizer), по умолчанию выключено
+SUMMARY_ENABLED        = os.getenv("SUMMARY_ENABLED", "0") == "1"
+SUMMARY_ENGINE         = os.getenv("SUMMARY_ENGINE", "cerebras").strip().lower()
+SUMMARY_TRIGGER_CHARS  = int(os.getenv("SUMMARY_TRIGGER_CHARS", "3000"))
+SUMMARY_KEEP_MSGS      = int(os.getenv("SUMMARY_KEEP_MSGS", "6"))
+SUMMARY_MAX_CHARS      = int(os.getenv("SUMMARY_MAX_CHARS", "1200"))
+
 # Webhook / Render
 WEBHOOK_BASE   = os.getenv("WEBHOOK_BASE", "").rstrip("/")
 WEBHOOK_PATH   = os.getenv("WEBHOOK_PATH", "/webhook")
@@ -65,5 +151,27 @@ DISABLE_BOT    = os.getenv("DISABLE_BOT", "0") == "1"
 DISABLE_LOOP   = os.getenv("DISABLE_LOOP", "1") == "1"
 PORT           = int(os.getenv("PORT", "10000"))
 
+# Напоминания: как часто перечитывать отложенные заметки из БД (изменения других процессов)
+REMINDER_RESYNC_SEC = float(os.getenv("REMINDER_RESYNC_SEC", "600"))
+# Несколько реплик: аренда напоминания на время отправки; WORKER_ID должен быть уникален
+REMINDER_LEASE_SEC  = float(os.getenv("REMINDER_LEASE_SEC", "120"))
+WORKER_ID           = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Исходящие сообщения: лимиты Telegram (~30 msg/s на бота, ~1 msg/s на чат)
+SEND_GLOBAL_RPS  = float(os.getenv("SEND_GLOBAL_RPS", "28"))
+SEND_CHAT_RPS    = float(os.getenv("SEND_CHAT_RPS", "1"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
 # DB
 DB_PATH = os.getenv("DB_PATH", "db.sqlite3")
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+DB_CACHE_KB     = int(os.getenv("DB_CACHE_KB", "8192"))     # PRAGMA cache_size (KiB)
+DB_MMAP_MB      = int(os.getenv("DB_MMAP_MB", "64"))        # PRAGMA mmap_size (MiB)
+DB_STMT_CACHE   = int(os.getenv("DB_STMT_CACHE", "128"))    # кэш подготовленных выражений
+
+# Кэш chat_settings (язык/движок): размер LRU и TTL записи, сек (0 — без TTL)
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+SETTINGS_CACHE_TTL  = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+# Другие реплики (базовые URL через запятую): после /lang и /ai им уходит POST /cache/invalidate
+SETTINGS_PEERS      = [u.strip().rstrip("/") for u in os.getenv("SETTINGS_PEERS", "").split(",") if u.strip()]
@@ -15,6 +15,7 @@ logger = logging.getLogger(__name__)
 
 # expects services/retriever_tfidf.py to expose search(query, top_k) -> list[dict] or list[tuple]
 from services import retriever_tfidf
+from utils import executors
 
 class ChatController:
     def __init__(self, llm_service=None, retriever_threshold: float = 0.35, llm_timeout: int = 18):
@@ -35,7 +36,7 @@ class ChatController:
 
         # 1) Try retriever (fast)
         try:
-            results = await asyncio.to_thread(retriever_tfidf.search, text, 3)
+            results = await executors.run("retriever", retriever_tfidf.search, text, 3)
             if results:
                 top = results[0]
                 # support both dict and tuple results
@@ -87,7 +88,7 @@ class ChatController:
         # offer useful local reply or user-friendly message
         try:
             # try one more local retrieval short snippet
-            results = await asyncio.to_thread(retriever_tfidf.search, text, 1)
+            results = await executors.run("retriever", retriever_tfidf.search, text, 1)
             if results:
                 top = results[0]
                 if isinstance(top, dict):
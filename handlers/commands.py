@@ -57,19 +57,16 @@ async def cmd_start(message: types.Message):
 
     # показать ожидающие заметки
     user_id = message.from_user.id
-    items = notes_store.list_pending(user_id, chat_id, limit=20)
-    if items:
-        from .notes import note_kbd as _nk
-        for it in items:
-            await message.answer(
-                f"📝 Заметка #{it['id']}:\n{it['text']}\n\nУже выполнено?",
-                reply_markup=_nk(it["id"])
-            )
+    from .notes import render_notes_page
+    text, kb = render_notes_page(user_id, chat_id, lang, "p")
+    if text:
+        await message.answer(text, reply_markup=kb)
 
 @router.callback_query(F.data.startswith("lang:"))
 async def on_lang(cq: types.CallbackQuery):
     lang = cq.data.split(":")[1]
     chat_settings.set_lang(cq.message.chat.id, lang)
+    chat_settings.publish(cq.message.chat.id)
     await cq.message.edit_text("✅")
     await cq.message.answer(t(lang, "menu_title") + " ✅", reply_markup=main_menu_kbd(lang))
     await cq.answer()
@@ -83,6 +80,7 @@ async def cmd_ai(message: types.Message):
 async def on_ai_pick(cq: types.CallbackQuery):
     _, ai = cq.data.split(":")
     chat_settings.set_ai(cq.message.chat.id, ai)
+    chat_settings.publish(cq.message.chat.id)
     from utils.memory import memory
     memory.reset(cq.message.chat.id)
     lang = chat_settings.get_lang(cq.message.chat.id)
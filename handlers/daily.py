@@ -1,8 +1,13 @@
 # handlers/daily.py
+import contextlib
+from functools import partial
+from typing import Optional
 from aiogram import Router, types, F
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from utils.daily import daily_store
 from utils.chat_settings import chat_settings
+from .pager import fetch_page, nav_row, short
 
 router = Router()
 _add_wait: set[tuple[int,int]] = set()
@@ -25,20 +30,68 @@ def top_add_kbd(lang: str) -> types.InlineKeyboardMarkup:
 async def cmd_daily(message: types.Message):
     await show_daily_list(message)
 
+def render_daily_page(user_id: int, chat_id: int, lang: str,
+                      after_id: int = 0, before_id: Optional[int] = None):
+    """(text, kb) страницы ежедневных или (None, None), если список пуст."""
+    fetch = partial(daily_store.list_page, user_id, chat_id)
+    rows, has_prev, has_next, anchor = fetch_page(fetch, after_id, before_id)
+    if not rows:
+        return None, None
+    lines = ["📅 Ежедневные" if lang=="ru" else "📅 Щоденні", ""]
+    kb = []
+    for t in rows:
+        status = "✅ сегодня" if t["done_today"] else "⬜ сегодня"
+        lines.append(f"• #{t['id']}: {short(t['text'])}  — {status}")
+        kb.append([
+            types.InlineKeyboardButton(text=f"✅ #{t['id']}", callback_data=f"dv:done:{t['id']}:{anchor}"),
+            types.InlineKeyboardButton(text=f"🗑 #{t['id']}", callback_data=f"dv:del:{t['id']}:{anchor}"),
+        ])
+    nav = nav_row("dv", rows, has_prev, has_next)
+    if nav:
+        kb.append(nav)
+    kb.append(top_add_kbd(lang).inline_keyboard[0])
+    return "\n".join(lines), types.InlineKeyboardMarkup(inline_keyboard=kb)
+
 async def show_daily_list(message: types.Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     lang = chat_settings.get_lang(chat_id)
-    tasks = daily_store.list(user_id, chat_id)
-    if not tasks:
+    text, kb = render_daily_page(user_id, chat_id, lang)
+    if text is None:
         _add_wait.add((chat_id, user_id))
         await message.answer("Список ежедневных пуст. Отправь текст — я добавлю." if lang=="ru" else
                              "Список щоденних порожній. Надішли текст — я додам.")
         return
-    await message.answer("📅 Ежедневные" if lang=="ru" else "📅 Щоденні", reply_markup=top_add_kbd(lang))
-    for t in tasks:
-        status = "✅ сегодня" if t["done_today"] else "⬜ сегодня"
-        await message.answer(f"• #{t['id']}: {t['text']}  — {status}", reply_markup=dkbd(t["id"], lang))
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("dv:"))
+async def cb_daily_view(cq: types.CallbackQuery):
+    # dv:a:<after_id> | dv:b:<before_id> | dv:done|del:<task_id>:<anchor>
+    parts = cq.data.split(":")
+    op = parts[1]
+    after_id, before_id, note = 0, None, ""
+    if op == "a":
+        after_id = int(parts[2])
+    elif op == "b":
+        before_id = int(parts[2])
+    else:
+        task_id, after_id = int(parts[2]), int(parts[3])
+        if op == "done":
+            daily_store.mark_done(task_id)
+            note = "Готово"
+        elif op == "del":
+            daily_store.delete(task_id)
+            note = "Удалено"
+    chat_id = cq.message.chat.id
+    lang = chat_settings.get_lang(chat_id)
+    text, kb = render_daily_page(cq.from_user.id, chat_id, lang, after_id, before_id)
+    with contextlib.suppress(TelegramBadRequest):  # «message is not modified»
+        if text is None:
+            await cq.message.edit_text("Список ежедневных пуст." if lang=="ru" else "Список щоденних порожній.",
+                                       reply_markup=top_add_kbd(lang))
+        else:
+            await cq.message.edit_text(text, reply_markup=kb)
+    await cq.answer(note or None)
 
 @router.callback_query(F.data == "daily:add")
 async def cb_daily_add(cq: types.CallbackQuery):
@@ -1,23 +1,20 @@
 # handlers/messages.py
+import functools
 import re
-import asyncio
+import time
 from datetime import datetime
 from aiogram import Router, types, F
 
 from utils.memory import memory
+from utils import summarizer
 from utils.chat_settings import chat_settings
 from utils.notes import notes_store
 from utils import info as info_api
-from utils.gemini import ask_gemini
-
-# Безопасный импорт Cerebras
-try:
-    from utils.llm import ask_cerebras as _ask_cerebras
-    async def ask_cerebras(*a, **kw):
-        return await _ask_cerebras(*a, **kw)
-except Exception:
-    async def ask_cerebras(*a, **kw):
-        return "❗ Cerebras недоступен на сервере. Используй Gemini или установи 'cerebras-cloud-sdk'."
+from utils import budget, engines, hedge, tg_stream
+from utils.coalesce import coalescer
+from utils.reply_cache import reply_cache, is_personal
+from services.semantic_cache import semantic_cache
+from config import REPLY_CACHE_ENABLED, STREAM_REPLIES
 
 router = Router()
 
@@ -42,6 +39,17 @@ NOTE_PREFIX_RE = re.compile(
     re.I | re.S
 )
 
+# Реплики, смысл которых зависит от предыдущих ходов, — мимо семантического кэша
+FOLLOWUP_RE = re.compile(
+    r"^(?:и|а|но|так|ещё|еще|ще|подробнее|почему|зачем|это|этот|он|она|они|там|тогда|дальше|продолжи)\b", re.I
+)
+
+def _standalone(text: str, history) -> bool:
+    """Вопрос понятен без контекста чата (можно отвечать из qa_logs и класть туда)."""
+    if any(m.get("role") == "system" for m in history):
+        return False
+    return not FOLLOWUP_RE.search(text.strip()) and not is_personal(text)
+
 def _day_string(lang: str) -> str:
     now = datetime.now()
     days_ru = ["понедельник","вторник","среда","четверг","пятница","суббота","воскресенье"]
@@ -114,26 +122,73 @@ async def any_text(message: types.Message):
             return
 
     # F) ИИ-диалог (с таймаутом, движок из настроек чата)
-    engine = (chat_settings.get_ai(chat_id) or "gemini").strip().lower()
+    # сообщения, пришедшие подряд или пока готовится ответ, — одним запросом (utils/coalesce)
+    resume = functools.partial(_ai_dialog, message, chat_id, user_id)  # если лидера отменят
+    async with coalescer.turn(chat_id, text, resume=resume) as merged:
+        if merged is None:
+            return
+        await _ai_dialog(message, chat_id, user_id, merged)
+
+async def _ai_dialog(message: types.Message, chat_id: int, user_id: int, text: str):
+    # не закреплён (/ai) — самый здоровый провайдер по utils/breaker
+    engine = engines.pick(chat_settings.get_ai(chat_id))
+    await memory.prefetch(chat_id)  # холодный чат читаем с диска не в event loop
     memory.add(chat_id, "user", text)
     allow_long = bool(re.search(r'подроб|разверну|много', text, flags=re.I))
     history = memory.get(chat_id)
 
+    # кэш ответов: одинаковые «привет»/«кто ты» не гоняем через движок
+    cache_key = reply_cache.key(engine, history, allow_long) if REPLY_CACHE_ENABLED else None
+    reply = reply_cache.get(engine, cache_key) if cache_key else None
+    standalone = _standalone(text, history) and not allow_long
+    if reply is None and standalone:
+        hit = semantic_cache.lookup(text, engine)  # похожий вопрос с хорошим ответом этого движка
+        reply = hit[0] if hit else None
+    if reply is not None:
+        memory.add(chat_id, "assistant", reply)
+        await message.answer(reply)
+        return
+
+    started = time.monotonic()
+    if STREAM_REPLIES:
+        # заглушка сразу, дальше правим её по мере генерации
+        max_tokens = budget.token_budget(600, allow_long)
+        timeout = engines.timeout_for(engine, streaming=True)  # по p95 прошлых стримов (utils/deadlines)
+        answered = {}  # hedge.stream запишет, какой движок на самом деле ответил
+        deltas = hedge.stream(engine, history, max_tokens=max_tokens, timeout=timeout,
+                              info=answered)  # без HEDGE_REQUESTS — просто движок
+        reply, ok = await tg_stream.stream_reply(
+            message, deltas, finish=lambda s: budget.clean_reply(s, allow_long, 600), timeout=timeout,
+            stop_at=None if allow_long else 600, provider=engine, max_tokens=max_tokens,
+        )
+        winner = answered.get("engine", engine)
+        # ключ посчитан для engine — ответ другого движка под ним не храним
+        if ok and REPLY_CACHE_ENABLED and winner == engine:
+            reply_cache.put(engine, cache_key, reply, time.monotonic() - started)
+        _log_qa(user_id, text, reply, ok, standalone, winner)
+        memory.add(chat_id, "assistant", reply)
+        summarizer.schedule(memory, chat_id)
+        return
+
+    ok, winner = False, engine
     try:
-        if engine == "gemini":
-            reply = await asyncio.wait_for(
-                ask_gemini(history=history, allow_long=allow_long, max_len=600),
-                timeout=25
-            )
-        else:
-            reply = await asyncio.wait_for(
-                ask_cerebras(history=history, allow_long=allow_long, max_len=600),
-                timeout=25
-            )
-    except asyncio.TimeoutError:
-        reply = "⚠️ Превышено время ответа ИИ (25с). Попробуй ещё раз или переключи модель."
+        # дедлайн по p95 движка; по истечении engines.ask сам останавливает вызов и отвечает ошибкой
+        reply, winner = await hedge.ask(engine, history, allow_long=allow_long, max_len=600,
+                                   timeout=engines.timeout_for(engine))
+        ok = not engines.is_error_reply(reply)  # ask_* возвращают ошибки текстом
     except Exception as e:
         reply = f"⚠️ Ошибка ИИ: {e}"
 
+    if ok and REPLY_CACHE_ENABLED and winner == engine:
+        reply_cache.put(engine, cache_key, reply, time.monotonic() - started)
+    _log_qa(user_id, text, reply, ok, standalone, winner)
     memory.add(chat_id, "assistant", reply)
+    summarizer.schedule(memory, chat_id)  # старые ходы -> краткое содержание, в фоне
     await message.answer(reply)
+
+def _log_qa(user_id: int, text: str, reply: str, ok: bool, standalone: bool, engine: str):
+    # ok=1 только для самостоятельных вопросов — они же наполняют семантический кэш (по движку)
+    try:
+        semantic_cache.log_qa(user_id, text, reply, ok=(1 if standalone else None) if ok else 0, engine=engine)
+    except Exception:
+        pass
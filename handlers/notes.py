@@ -1,8 +1,13 @@
 # handlers/notes.py
+import contextlib
+from functools import partial
+from typing import Optional
 from aiogram import Router, types, F
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from utils.notes import notes_store
 from utils.chat_settings import chat_settings
+from .pager import fetch_page, nav_row, short
 
 # ждём «ввода новой заметки» только для этих (chat_id, user_id)
 _add_wait: set[tuple[int,int]] = set()
@@ -24,20 +29,76 @@ def add_top_kbd(lang: str) -> types.InlineKeyboardMarkup:
         [types.InlineKeyboardButton(text=txt, callback_data="note:add")]
     ])
 
+# ---- список одним сообщением: kind "o" — все открытые, "p" — ожидающие (/start) ----
+def render_notes_page(user_id: int, chat_id: int, lang: str, kind: str = "o",
+                      after_id: int = 0, before_id: Optional[int] = None):
+    """(text, kb) страницы заметок или (None, None), если список пуст."""
+    if kind == "p":
+        fetch = partial(notes_store.list_pending_page, user_id, chat_id)
+        title = "📝 Ожидающие заметки:" if lang=="ru" else "📝 Нотатки, що чекають:"
+    else:
+        fetch = partial(notes_store.list_open_page, user_id, chat_id)
+        title = "📝 Ваши заметки:" if lang=="ru" else "📝 Ваші нотатки:"
+    rows, has_prev, has_next, anchor = fetch_page(fetch, after_id, before_id)
+    if not rows:
+        return None, None
+    lines = [title, ""]
+    kb = []
+    for it in rows:
+        lines.append(f"• #{it['id']}: {short(it['text'])}\nСтатус: {it['status']}")
+        row = [types.InlineKeyboardButton(text=f"✅ #{it['id']}", callback_data=f"nv:{kind}:done:{it['id']}:{anchor}")]
+        if kind == "p":  # как в прежнем /start: «❌ Нет» — оставить открытой без напоминания
+            row.append(types.InlineKeyboardButton(text=f"❌ #{it['id']}", callback_data=f"nv:{kind}:keep:{it['id']}:{anchor}"))
+        row.append(types.InlineKeyboardButton(text=f"⏰ 2ч #{it['id']}", callback_data=f"nv:{kind}:snz:{it['id']}:{anchor}"))
+        kb.append(row)
+    nav = nav_row(f"nv:{kind}", rows, has_prev, has_next)
+    if nav:
+        kb.append(nav)
+    kb.append(add_top_kbd(lang).inline_keyboard[0])
+    return "\n".join(lines), types.InlineKeyboardMarkup(inline_keyboard=kb)
+
 async def open_notes_or_wait(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     lang = chat_settings.get_lang(chat_id)
-    items = notes_store.list_open_all(user_id, chat_id, limit=50)
-    if not items:
+    text, kb = render_notes_page(user_id, chat_id, lang, "o")
+    if text is None:
         _add_wait.add((chat_id, user_id))
         await message.answer("Список заметок пуст. Пришли текст — добавлю." if lang=="ru" else
                              "Список нотаток порожній. Надішли текст — я додам.")
         return
-    await message.answer(f"📝 Ваши заметки ({len(items)}):" if lang=="ru" else f"📝 Ваші нотатки ({len(items)}):",
-                         reply_markup=add_top_kbd(lang))
-    for it in items:
-        await message.answer(f"• #{it['id']}: {it['text']}\nСтатус: {it['status']}", reply_markup=note_kbd(it["id"]))
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("nv:"))
+async def cb_notes_view(cq: types.CallbackQuery):
+    # nv:<kind>:a:<after_id> | nv:<kind>:b:<before_id> | nv:<kind>:done|keep|snz:<note_id>:<anchor>
+    parts = cq.data.split(":")
+    kind, op = parts[1], parts[2]
+    after_id, before_id, note = 0, None, ""
+    if op == "a":
+        after_id = int(parts[3])
+    elif op == "b":
+        before_id = int(parts[3])
+    else:
+        note_id, after_id = int(parts[3]), int(parts[4])
+        if op == "done":
+            notes_store.set_done(note_id)
+            note = "Отмечено как выполнено"
+        elif op == "keep":
+            notes_store.keep_open(note_id)
+            note = "Оставлено без напоминания"
+        elif op == "snz":
+            notes_store.snooze(note_id, minutes=120)
+            note = "Напоминание установлено"
+    chat_id = cq.message.chat.id
+    lang = chat_settings.get_lang(chat_id)
+    text, kb = render_notes_page(cq.from_user.id, chat_id, lang, kind, after_id, before_id)
+    with contextlib.suppress(TelegramBadRequest):  # «message is not modified»
+        if text is None:
+            await cq.message.edit_text("✅ Все заметки обработаны." if lang=="ru" else "✅ Усі нотатки оброблено.")
+        else:
+            await cq.message.edit_text(text, reply_markup=kb)
+    await cq.answer(note or None)
 
 @router.message(Command("notes"))
 async def cmd_notes(message: types.Message):
@@ -0,0 +1,44 @@
+# handlers/pager.py
+"""
+Общие куски для «одно сообщение + листание кнопками» (заметки, ежедневные).
+
+fetch(after_id=..., before_id=..., limit=...) — keyset-выборка из стора.
+anchor — after_id, с которого строится текущая страница; его кладём в
+callback_data действий, чтобы после действия перерисовать ту же страницу.
+"""
+from typing import Callable, List, Optional, Tuple
+from aiogram import types
+
+PAGE_SIZE = 8
+ITEM_MAX_CHARS = 200
+
+def fetch_page(fetch: Callable[..., List[dict]], after_id: int = 0,
+               before_id: Optional[int] = None) -> Tuple[List[dict], bool, bool, int]:
+    """Возвращает (rows, has_prev, has_next, anchor)."""
+    if before_id is not None:
+        rows = fetch(before_id=before_id, limit=PAGE_SIZE + 1)
+        has_prev = len(rows) > PAGE_SIZE
+        rows = rows[-PAGE_SIZE:]
+        if not rows:
+            return fetch_page(fetch)
+        anchor = rows[0]["id"] - 1 if has_prev else 0
+        return rows, has_prev, True, anchor
+    rows = fetch(after_id=after_id, limit=PAGE_SIZE + 1)
+    if not rows and after_id > 0:
+        # страница опустела (всё выполнено/удалено) — покажем предыдущую
+        return fetch_page(fetch, before_id=after_id + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    return rows, after_id > 0, has_next, after_id
+
+def nav_row(prefix: str, rows: List[dict], has_prev: bool, has_next: bool) -> List[types.InlineKeyboardButton]:
+    row = []
+    if has_prev:
+        row.append(types.InlineKeyboardButton(text="◀️", callback_data=f"{prefix}:b:{rows[0]['id']}"))
+    if has_next:
+        row.append(types.InlineKeyboardButton(text="▶️", callback_data=f"{prefix}:a:{rows[-1]['id']}"))
+    return row
+
+def short(text: str) -> str:
+    text = (text or "").strip()
+    return text if len(text) <= ITEM_MAX_CHARS else text[:ITEM_MAX_CHARS].rstrip() + "…"
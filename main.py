@@ -8,6 +8,11 @@ from config import TELEGRAM_TOKEN
 from handlers import commands, messages
 from handlers import notes as notes_handlers
 from utils.notes import notes_store
+from utils.db import close_all as close_db
+from utils import executors, providers
+from utils.reminder_scheduler import ReminderScheduler
+from utils.memory import run_flusher as memory_flusher
+from utils.sender import OutboundSender
 
 # --- HTTP: минимальный сервер для Render (healthcheck) ---
 async def handle_root(request: web.Request):
@@ -41,21 +46,27 @@ def note_kbd(note_id: int) -> InlineKeyboardMarkup:
         [   InlineKeyboardButton(text="⏰ Отложить 2ч",    callback_data=f"note:snooze:{note_id}:120") ],
     ])
 
+async def send_reminder(sender: OutboundSender, it: dict):
+    await sender.send_message(
+        it["chat_id"],
+        f"⏰ Напоминание по заметке #{it['id']}:\n{it['text']}\n\nУже выполнено?",
+        reply_markup=note_kbd(it["id"])
+    )
+
 async def reminder_loop(bot: Bot):
+    # спим до ближайшего snooze_until, а не опрашиваем БД раз в минуту;
+    # отправка — через общий sender с лимитами Telegram
+    sender = OutboundSender(bot)
+    scheduler = ReminderScheduler(lambda it: send_reminder(sender, it))
     while True:
         try:
-            due = notes_store.list_due(limit=200)
-            for it in due:
-                notes_store.keep_open(it["id"])  # вернём в open, чтобы не дублировалось
-                await bot.send_message(
-                    it["chat_id"],
-                    f"⏰ Напоминание по заметке #{it['id']}:\n{it['text']}\n\nУже выполнено?",
-                    reply_markup=note_kbd(it["id"])
-                )
+            await scheduler.run()
+        except asyncio.CancelledError:
+            raise
         except Exception:
             # не валим цикл из-за разовых ошибок
             pass
-        await asyncio.sleep(60)
+        await asyncio.sleep(5)
 
 # --- Точка входа ---
 async def main():
@@ -70,16 +81,21 @@ async def main():
     # поднимаем HTTP-сервер (для Render) и напоминатель
     http_task = asyncio.create_task(start_http_server())
     remind_task = asyncio.create_task(reminder_loop(bot))
+    memory_task = asyncio.create_task(memory_flusher())
 
     try:
         # запускаем long-polling
         await dp.start_polling(bot)
     finally:
         # аккуратно завершим фоновые задачки
-        for t in (http_task, remind_task):
+        for t in (http_task, remind_task, memory_task):
             t.cancel()
-            with contextlib.suppress(Exception):
+            with contextlib.suppress(BaseException):
                 await t
+        with contextlib.suppress(Exception):
+            await providers.aclose()
+        executors.shutdown()
+        close_db()
 
 if __name__ == "__main__":
     import contextlib
@@ -2,6 +2,7 @@
 import os
 import asyncio
 import contextlib
+import hmac
 import logging
 
 from aiohttp import web
@@ -21,6 +22,15 @@ from handlers import commands, messages
 from handlers import notes as notes_handlers
 from handlers import daily as daily_handlers
 from utils.notes import notes_store
+from utils.db import close_all as close_db
+from utils.reminder_scheduler import LeaseKeeper, ReminderScheduler
+from utils.sender import OutboundSender
+from utils.chat_settings import chat_settings
+from utils.memory import memory, run_flusher as memory_flusher
+from utils.coalesce import coalescer
+from utils import breaker, budget, deadlines, executors, hedge, latency, providers, summarizer, tg_stream
+from utils.reply_cache import reply_cache
+from services.semantic_cache import semantic_cache
 
 # ======================= ЛОГИ =======================
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -170,6 +180,44 @@ async def handle_debug_config(_: web.Request):
         "expect_secret": bool(WEBHOOK_SECRET),
     })
 
+async def handle_debug_stats(request: web.Request):
+    sched = request.app.get("reminders")
+    return web.json_response({
+        "reminders": sched.stats() if sched else None,
+        "sender": request.app["sender"].stats(),
+        "chat_settings_cache": chat_settings.stats(),
+        "memory": memory.stats(),
+        "summarizer": summarizer.stats(),
+        "providers": providers.stats(),
+        "streaming": tg_stream.stats(),
+        "budget": budget.stats(),
+        "reply_cache": reply_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "latency": latency.stats(),
+        "hedge": hedge.stats(),
+        "breakers": breaker.stats(),
+        "executors": executors.stats(),
+        "coalesce": coalescer.stats(),
+        "deadlines": deadlines.stats(),
+    })
+
+async def handle_cache_invalidate(request: web.Request):
+    # межпроцессная инвалидация: другой воркер (или админ) сообщает об изменении настроек чата.
+    # Меняет состояние — только POST и только с секретом вебхука (без него ручка выключена)
+    secret = request.app["webhook_secret"]
+    if not secret or not hmac.compare_digest(request.headers.get("X-Webhook-Secret", ""), secret):
+        return web.Response(status=403, text="forbidden")
+    form = await request.post()
+    raw = (request.query.get("chat_id") or form.get("chat_id") or "").strip()
+    if raw == "all":
+        chat_settings.invalidate(None)
+    else:
+        try:
+            chat_settings.invalidate(int(raw))
+        except ValueError:
+            return web.Response(status=400, text="usage: POST /cache/invalidate chat_id=<id>|all")
+    return web.Response(text="ok")
+
 async def handle_install(request: web.Request):
     if request.app["disable_bot"]:
         return web.json_response({"ok": False, "reason": "DISABLE_BOT=1"}, status=400)
@@ -185,50 +233,53 @@ async def handle_test_send(request: web.Request):
     text = request.query.get("text", "test")
     if not chat_id:
         return web.Response(text="usage: /test/send?key=...&chat_id=<id>&text=hi")
-    bot: Bot = request.app["bot"]
+    sender: OutboundSender = request.app["sender"]
     try:
-        await bot.send_message(chat_id, f"[test] {text}")
+        await sender.send_message(chat_id, f"[test] {text}")
         return web.Response(text="ok")
     except Exception as e:
         log.exception("[test_send] failed: %s", e)
         return web.Response(status=500, text=f"error: {e}")
 
+def reminder_message(it: dict):
+    """(chat_id, text, kwargs) для sender.send_message."""
+    return (
+        it["chat_id"],
+        f"⏰ Напоминание по заметке #{it['id']}:\n{it['text']}\n\nУже выполнено?",
+        {"reply_markup": note_kbd(it["id"])},
+    )
+
 async def handle_cron_tick(request: web.Request):
     if CRON_SECRET and request.query.get("key") != CRON_SECRET:
         log.warning("[cron] forbidden: wrong or missing key")
         return web.Response(status=403, text="forbidden")
-    bot: Bot = request.app["bot"]
-    due = notes_store.list_due(limit=500)
-    sent = 0
-    for it in due:
-        notes_store.keep_open(it["id"])
-        try:
-            await bot.send_message(
-                it["chat_id"],
-                f"⏰ Напоминание по заметке #{it['id']}:\n{it['text']}\n\nУже выполнено?",
-                reply_markup=note_kbd(it["id"])
-            )
-            sent += 1
-        except Exception as e:
-            log.exception("[cron] send_message failed chat=%s note=%s: %s", it["chat_id"], it["id"], e)
+    sender: OutboundSender = request.app["sender"]
+    # claim_due арендует пачки за этим воркером — пересечение с reminder_loop и другими
+    # репликами не даст дублей; sender шлёт их параллельно в пределах лимитов Telegram,
+    # а LeaseKeeper продлевает аренду, пока пачка не подтверждена
+    async with LeaseKeeper() as lease:
+        sent = await sender.send_many(
+            lease.track(notes_store.claim_due(limit=500)), reminder_message,
+            on_chunk=lambda chunk: lease.ack([it["id"] for it in chunk]),
+        )
     log.info("[cron] sent=%d", sent)
     return web.Response(text=f"ok: sent={sent}")
 
 # =================== REMINDER LOOP (опц.) ===================
-async def reminder_loop(bot: Bot):
+async def send_reminder(sender: OutboundSender, it: dict):
+    chat_id, text, kwargs = reminder_message(it)
+    await sender.send_message(chat_id, text, **kwargs)
+
+async def reminder_loop(scheduler: ReminderScheduler):
+    # планировщик спит до ближайшего snooze_until; при сбое — перезапуск через паузу
     while True:
         try:
-            due = notes_store.list_due(limit=200)
-            for it in due:
-                notes_store.keep_open(it["id"])
-                await bot.send_message(
-                    it["chat_id"],
-                    f"⏰ Напоминание по заметке #{it['id']}:\n{it['text']}\n\nУже выполнено?",
-                    reply_markup=note_kbd(it["id"])
-                )
+            await scheduler.run()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             log.exception("[loop] error: %s", e)
-        await asyncio.sleep(60)
+        await asyncio.sleep(5)
 
 # =================== STARTUP / SHUTDOWN ===================
 async def on_startup(app: web.Application):
@@ -275,6 +326,7 @@ async def create_app():
 
     app = web.Application(middlewares=[access_logger])
     app["bot"] = bot
+    app["sender"] = OutboundSender(bot)
     app["WEBHOOK_PATH"]   = WEBHOOK_PATH
     app["webhook_secret"] = WEBHOOK_SECRET or ""
     app["disable_bot"]    = bool(DISABLE_BOT)
@@ -287,6 +339,8 @@ async def create_app():
         web.get("/healthz", handle_health),
         web.get("/tginfo", handle_tginfo),
         web.get("/debug/config", handle_debug_config),
+        web.get("/debug/stats", handle_debug_stats),
+        web.post("/cache/invalidate", handle_cache_invalidate),
         web.get("/install", handle_install),   # ручная установка вебхука
         web.get("/test/send", handle_test_send),
         web.get("/cron/tick", handle_cron_tick),
@@ -302,19 +356,26 @@ async def create_app():
 
     async def _startup(_app):
         await on_startup(_app)
+        _app["memory_task"] = asyncio.create_task(memory_flusher())
         if not DISABLE_LOOP:
-            _app["reminder_task"] = asyncio.create_task(reminder_loop(bot))
+            _app["reminders"] = ReminderScheduler(lambda it: send_reminder(_app["sender"], it))
+            _app["reminder_task"] = asyncio.create_task(reminder_loop(_app["reminders"]))
             log.info("[startup] reminder loop started")
         else:
             log.info("[startup] reminder loop DISABLED (use /cron/tick)")
 
     async def _cleanup(_app):
-        task = _app.get("reminder_task")
-        if task:
-            task.cancel()
-            with contextlib.suppress(Exception):
-                await task
+        for name in ("reminder_task", "memory_task"):
+            task = _app.get(name)
+            if task:
+                task.cancel()
+                with contextlib.suppress(BaseException):
+                    await task
         await on_shutdown(_app)
+        with contextlib.suppress(Exception):
+            await providers.aclose()
+        executors.shutdown()
+        close_db()
 
     app.on_startup.append(_startup)
     app.on_cleanup.append(_cleanup)
@@ -0,0 +1,76 @@
+# scripts/bench_providers.py
+"""
+Сравнение транспортов Cerebras на заглушке scripts/provider_stub.py:
+
+    python -m scripts.provider_stub --port 8089 &
+    python -m scripts.bench_providers --url http://127.0.0.1:8089 -n 200 -c 32
+
+fresh  — новый Cerebras(...) на каждый запрос (как было раньше);
+thread — общий клиент из utils/providers, вызов в пуле потоков;
+async  — AsyncCerebras в event loop.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else 0.0
+
+async def _run(mode: str, n: int, conc: int, url: str):
+    from utils import budget, llm
+
+    history = [{"role": "user", "content": "привет"}]
+
+    def fresh():
+        from cerebras.cloud.sdk import Cerebras
+        client = Cerebras(api_key="stub", base_url=url)
+        try:
+            stream = client.chat.completions.create(**llm._params(history, "", budget.token_budget(0, True)))
+            # последний чанк (usage) приходит без choices
+            text = "".join(c.choices[0].delta.content or "" for c in stream if c.choices)
+            return budget.clean_reply(text, True, 0)
+        finally:
+            client.close()
+
+    async def one():
+        if mode == "async":
+            return await llm._call_async(history, True, 0, "")
+        fn = fresh if mode == "fresh" else (lambda: llm._call_sync(history, True, 0, ""))
+        return await asyncio.get_running_loop().run_in_executor(None, fn)
+
+    sem = asyncio.Semaphore(conc)
+    lat = []
+
+    async def timed():
+        async with sem:
+            t = time.perf_counter()
+            out = await one()
+            lat.append(time.perf_counter() - t)
+            if out.startswith("⚠️"):
+                raise RuntimeError(out)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(n)))
+    wall = time.perf_counter() - t0
+    print(f"{mode:6s}  n={n} c={conc}  wall={wall:.2f}s  rps={n / wall:.1f}  "
+          f"p50={statistics.median(lat) * 1000:.0f}ms  p95={_pct(lat, 0.95) * 1000:.0f}ms  "
+          f"threads={len(__import__('threading').enumerate())}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8089")
+    ap.add_argument("-n", type=int, default=100)
+    ap.add_argument("-c", type=int, default=16)
+    ap.add_argument("--modes", default="fresh,thread,async")
+    a = ap.parse_args()
+    # config читает окружение при импорте — выставляем до импорта utils.*
+    os.environ["CEREBRAS_BASE_URL"] = a.url
+    os.environ.setdefault("CEREBRAS_API_KEY", "stub")
+    for mode in a.modes.split(","):
+        asyncio.run(_run(mode.strip(), a.n, a.c, a.url))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# scripts/provider_stub.py
+"""
+Локальная заглушка LLM-провайдеров для замеров (без ключей и сети).
+
+    python -m scripts.provider_stub --port 8089 --ttfb 0.3 --tokens 40 --token-delay 0.01
+
+Отвечает как Cerebras (/v1/chat/completions, обычный и SSE-стрим) и как Gemini
+(/v1beta/models/<model>:generateContent и :streamGenerateContent). Бота можно направить на неё через
+CEREBRAS_BASE_URL=http://127.0.0.1:8089 / GEMINI_BASE_URL=http://127.0.0.1:8089/.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+def _make_app(ttfb: float, tokens: int, token_delay: float) -> web.Application:
+    stats = {"requests": 0, "connections": set()}
+
+    def _peer(request: web.Request):
+        stats["requests"] += 1
+        stats["connections"].add(request.transport.get_extra_info("peername") if request.transport else None)
+
+    async def warming(request: web.Request):
+        _peer(request)
+        return web.Response(text="ok")
+
+    async def chat(request: web.Request):
+        _peer(request)
+        body = await request.json()
+        await asyncio.sleep(ttfb)
+        n = min(tokens, int(body.get("max_completion_tokens") or tokens))
+        words = [f"слово{i} " for i in range(n)]
+        base = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model"), "system_fingerprint": "stub"}
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * tokens)
+            return web.json_response({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+            })
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for w in words:
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": w}, "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(token_delay)
+        usage = {**base, "choices": [], "usage": {"completion_tokens": n}}
+        await resp.write(f"data: {json.dumps(usage)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def gemini(request: web.Request):
+        _peer(request)
+        body = await request.json()
+        n = min(tokens, int((body.get("generationConfig") or {}).get("maxOutputTokens") or tokens))
+        words = [f"слово{i} " for i in range(n)]
+
+        def _resp(text: str) -> dict:
+            return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+        if not request.match_info["model"].endswith(":streamGenerateContent"):
+            await asyncio.sleep(ttfb + token_delay * tokens)
+            return web.json_response(_resp("".join(words)))
+        await asyncio.sleep(ttfb)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for w in words:
+            await resp.write(f"data: {json.dumps(_resp(w), ensure_ascii=False)}\r\n\r\n".encode())
+            await asyncio.sleep(token_delay)
+        await resp.write_eof()
+        return resp
+
+    async def stub_stats(request: web.Request):
+        return web.json_response({"requests": stats["requests"], "connections": len(stats["connections"])})
+
+    app = web.Application()
+    app.router.add_get("/v1/tcp_warming", warming)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/v1beta/models/{model}", gemini)  # <model>:generateContent / :streamGenerateContent
+    app.router.add_get("/stub/stats", stub_stats)
+    return app
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--ttfb", type=float, default=0.3, help="задержка до первого токена, с")
+    ap.add_argument("--tokens", type=int, default=40)
+    ap.add_argument("--token-delay", type=float, default=0.01)
+    a = ap.parse_args()
+    web.run_app(_make_app(a.ttfb, a.tokens, a.token_delay), host="127.0.0.1", port=a.port)
+
+if __name__ == "__main__":
+    main()
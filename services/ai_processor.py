@@ -1,16 +1,21 @@
 from gpt4all import GPT4All
 import os
 import logging
-from typing import Optional
+import threading
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from utils.aio_bridge import iterate_in_thread
 
 logger = logging.getLogger(__name__)
 
 class AIService:
     def __init__(self, model_name: Optional[str] = None):
         self.model = None
+        self.models_dir = os.path.join(os.path.dirname(__file__), "..", "models")
         # Если модель не указана, используем первую найденную в папке models
         self.model_name = model_name or self._find_available_model()
-        self.models_dir = os.path.join(os.path.dirname(__file__), "..", "models")
+        self._lock = threading.Lock()  # GPT4All не потокобезопасна: один generate за раз
         
     def _find_available_model(self) -> Optional[str]:
         """Находит доступную модель в папке models"""
@@ -41,27 +46,67 @@ class AIService:
             logger.error(f"Ошибка загрузки модели: {e}")
             return False
     
+    @staticmethod
+    def _full_prompt(prompt: str) -> str:
+        """Формируем промпт для модели"""
+        return f"""Ты - полезный ассистент в Telegram-боте. Отвечай кратко и по делу.
+
+Пользователь: {prompt}
+Ассистент:"""
+
     def generate_response(self, prompt: str, max_tokens: int = 150, temp: float = 0.7) -> str:
         """Генерация ответа с помощью модели"""
         if not self.model:
             return "Извините, ИИ модель временно недоступна."
         
         try:
-            # Формируем промпт для модели
-            full_prompt = f"""Ты - полезный ассистент в Telegram-боте. Отвечай кратко и по делу.
-
-Пользователь: {prompt}
-Ассистент:"""
-            
             # Генерируем ответ
-            response = self.model.generate(
-                full_prompt, 
-                max_tokens=max_tokens,
-                temp=temp,
-                streaming=False
-            )
+            with self._lock:
+                response = self.model.generate(
+                    self._full_prompt(prompt),
+                    max_tokens=max_tokens,
+                    temp=temp,
+                    streaming=False
+                )
             
             return response.strip()
         except Exception as e:
             logger.error(f"Ошибка генерации ответа: {e}")
-            return "Произошла ошибка при обработке запроса."
\ No newline at end of file
+            return "Произошла ошибка при обработке запроса."
+
+    async def stream_response(self, prompt: str, max_tokens: int = 150, temp: float = 0.7) -> AsyncIterator[str]:
+        """
+        Токены по мере генерации. Модель работает в потоке пула "gpt4all",
+        токены идут через ограниченную очередь (utils/aio_bridge). Если
+        потребитель бросил генератор (отмена, бюджет длины), callback
+        GPT4All возвращает False и генерация останавливается.
+        """
+        if not self.model:
+            raise RuntimeError("ИИ модель не загружена")
+        stop = threading.Event()
+
+        def _tokens():
+            with self._lock:
+                tokens = self.model.generate(
+                    self._full_prompt(prompt),
+                    max_tokens=max_tokens,
+                    temp=temp,
+                    streaming=True,
+                    callback=lambda _token_id, _text: not stop.is_set(),
+                )
+                try:
+                    for token in tokens:  # не yield from: тот закрыл бы tokens, и дочитать не выйдет
+                        yield token
+                finally:
+                    # генерация идёт в отдельном потоке GPT4All: дочитываем, пока он не увидит stop
+                    stop.set()
+                    for _ in tokens:
+                        pass
+
+        tokens = iterate_in_thread(_tokens, executor="gpt4all")
+        try:
+            async with aclosing(tokens):
+                async for token in tokens:
+                    yield token
+        finally:
+            stop.set()
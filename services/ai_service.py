@@ -1,12 +1,15 @@
 import os
 import logging
+import time
 from config import MODEL_NAME, MODELS_DIR
+from utils.breaker import breaker
 
 logger = logging.getLogger(__name__)
 
 class AIService:
     def __init__(self):
         self.model = None
+        self.breaker = breaker("gpt4all")
         
     def initialize(self) -> bool:
         """Инициализация модели через GPT4All класс (автоматическое скачивание)"""
@@ -31,13 +34,16 @@ class AIService:
     
     def generate_response(self, prompt: str) -> str:
         """Генерация ответа с помощью модели"""
-        if not self.model:
+        if not self.model or not self.breaker.allow():
             return "Извините, ИИ модель временно недоступна."
         
+        t0 = time.monotonic()
         try:
             # Простой вызов модели
             response = self.model.generate(prompt, max_tokens=100)
+            self.breaker.record(True, time.monotonic() - t0)
             return response.strip()
         except Exception as e:
             logger.error(f"Ошибка генерации ответа: {e}")
+            self.breaker.record(False, time.monotonic() - t0, err=e)
             return "Произошла ошибка при обработке запроса."
\ No newline at end of file
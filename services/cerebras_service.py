@@ -1,13 +1,14 @@
 # services/cerebras_service.py
-import asyncio
 import logging
 import traceback
-from typing import Dict, List, Optional
+from typing import List, Optional
 
 from config import (
     CEREBRAS_API_KEY, CEREBRAS_MODEL,
     MAX_PAIRS, HARD_REPLY_LIMIT
 )
+from utils import executors
+from utils.memory import _Mem
 
 try:
     from cerebras.cloud.sdk import Cerebras
@@ -86,7 +87,8 @@ def split_for_telegram(s: str, limit: int = 3500) -> List[str]:
 class CerebrasService:
     def __init__(self):
         self.client: Optional[Cerebras] = None
-        self.dialogs: Dict[int, List[dict]] = {}  # chat_id -> list of {"role","content"}
+        # chat_id -> история {"role","content"}; переживает рестарт (write-behind в SQLite)
+        self.dialogs = _Mem(max_msgs=MAX_PAIRS * 2, max_chars=1_000_000, scope="cerebras")
 
     async def initialize(self) -> bool:
         if Cerebras is None:
@@ -105,35 +107,30 @@ class CerebrasService:
         return self.client is not None
 
     def reset_history(self, chat_id: int):
-        self.dialogs[chat_id] = []
-
-    def _ensure_history(self, chat_id: int):
-        if chat_id not in self.dialogs:
-            self.dialogs[chat_id] = []
+        self.dialogs.reset(chat_id)
 
     async def ask(self, chat_id: int, user_text: str) -> List[str]:
         """Главный метод: собирает историю, зовёт Cerebras, режет на чанки."""
-        self._ensure_history(chat_id)
-        msgs = [SYSTEM_PROMPT] + self.dialogs[chat_id] + [{"role": "user", "content": user_text}]
+        await self.dialogs.prefetch(chat_id)  # холодная история — из диска в потоке, не в event loop
+        msgs = [SYSTEM_PROMPT] + self.dialogs.get(chat_id) + [{"role": "user", "content": user_text}]
         msgs = _trim_history(msgs, MAX_PAIRS)
 
         if not self.client:
             return ["Извините, ИИ тимчасово недоступний."]
 
         try:
-            # Cerebras — синхронный метод; завернём в to_thread
+            # Cerebras — синхронный метод; гоняем в своём пуле потоков
             def _call():
                 return self.client.chat.completions.create(
                     messages=msgs,
                     model=CEREBRAS_MODEL,
                 )
-            resp = await asyncio.to_thread(_call)
+            resp = await executors.run("cerebras", _call)
             answer = _extract_text_from_response(resp) or "(пустой ответ)"
 
             # сохраняем историю
-            self.dialogs[chat_id].append({"role": "user", "content": user_text})
-            self.dialogs[chat_id].append({"role": "assistant", "content": answer})
-            self.dialogs[chat_id] = _trim_history(self.dialogs[chat_id], MAX_PAIRS)
+            self.dialogs.add(chat_id, "user", user_text)
+            self.dialogs.add(chat_id, "assistant", answer)
 
             # ограничение длины, если не просили «подробнее»
             if not _wants_long_answer(user_text):
@@ -0,0 +1,327 @@
+# services/llm_batcher.py
+"""
+Непрерывный батчинг для локального llama.cpp (LLM_BATCHING=1).
+
+Под общим замком модель ведёт одну последовательность за раз, и суммарная
+скорость (токен/с на все чаты) не растёт с числом чатов. Здесь один поток
+декодирования держит отдельный контекст llama.cpp на LLM_BATCH_MAX_SEQS
+последовательностей:
+
+- новые запросы копятся LLM_BATCH_WINDOW_MS (если модель простаивает) и
+  дальше подхватываются на каждом шаге — не дожидаясь конца чужих ответов;
+- за шаг один llama_decode: хвосты промптов (кусками до n_batch) плюс по
+  одному новому токену от каждой активной последовательности;
+- токены уходят каждому запросу отдельно (stream() — async-генератор);
+- stats(): токен/с суммарно, средний размер батча, очередь.
+
+Снимки KV-кэша (services/llm_state) здесь не используются: у батчера
+общий контекст, последовательности в нём живут только на время ответа.
+GPT4All (telegram_gpt_4_all_bot, AIService) многопоследовательного
+декодирования не умеет — там по-прежнему замок.
+"""
+import asyncio
+import codecs
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from utils.executors import Overloaded
+
+log = logging.getLogger("llm_batcher")
+
+try:
+    import numpy as np
+    import llama_cpp
+    from llama_cpp import Llama
+except Exception:
+    llama_cpp = None
+    Llama = None
+
+_DONE = object()
+_TOP_K = 40
+
+# ---------- совместимость версий llama-cpp-python ----------
+def _new_context(model, params):
+    fn = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+    return fn(model, params)
+
+def _seq_rm(ctx, seq_id: int):
+    if hasattr(llama_cpp, "llama_memory_seq_rm"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, -1, -1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+
+def _eog_checker(llm):
+    if hasattr(llama_cpp, "llama_vocab_is_eog"):
+        vocab = llama_cpp.llama_model_get_vocab(llm.model)
+        return lambda tok: bool(llama_cpp.llama_vocab_is_eog(vocab, tok))
+    eos = llm.token_eos()
+    return lambda tok: tok == eos
+
+class _Seq:
+    __slots__ = ("todo", "pos", "max_tokens", "temperature", "generated", "last",
+                 "slot", "out", "loop", "cancelled", "decoder", "logit_idx")
+
+    def __init__(self, tokens: List[int], max_tokens: int, temperature: float, loop, out: asyncio.Queue):
+        self.todo = tokens          # ещё не поданные в модель токены промпта
+        self.pos = 0                # позиция следующего токена в последовательности
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.generated = 0
+        self.last: Optional[int] = None
+        self.slot = -1              # seq_id в контексте
+        self.out = out
+        self.loop = loop
+        self.cancelled = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")("ignore")  # токен может резать символ
+        self.logit_idx = -1
+
+    def emit(self, item):
+        if self.cancelled:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.out.put_nowait, item)
+        except RuntimeError:  # loop уже закрыт
+            self.cancelled = True
+
+class LlamaBatcher:
+    def __init__(self, model_path: str, n_ctx_per_seq: int = 1024, max_seqs: int = 8,
+                 n_batch: int = 512, n_threads: int = 0, window_ms: float = 20, queue_size: int = 64):
+        self.model_path = model_path
+        self.n_ctx_per_seq = n_ctx_per_seq
+        self.max_seqs = max_seqs
+        self.n_batch = n_batch
+        self.n_threads = n_threads
+        self.window = window_ms / 1000.0
+        self._incoming: "queue.Queue[_Seq]" = queue.Queue(maxsize=queue_size)
+        self._active: Dict[int, _Seq] = {}
+        self._free = list(range(max_seqs))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._llm = None
+        self._ctx = None
+        self._rng = None
+        # метрики
+        self.requests = 0
+        self.rejected = 0
+        self.tokens_out = 0
+        self.prefill_tokens = 0
+        self.steps = 0
+        self.batch_seqs = 0
+        self.busy_s = 0.0
+        self._recent: Deque = deque()  # (ts, сгенерировано за шаг) — токен/с за последнюю минуту
+
+    # ---------- запуск / остановка ----------
+    def _load(self):
+        if llama_cpp is None:
+            raise RuntimeError("llama_cpp not installed")
+        self._llm = Llama(model_path=self.model_path, n_ctx=256, verbose=False)  # веса + токенизатор
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx_per_seq * self.max_seqs
+        params.n_batch = self.n_batch
+        params.n_seq_max = self.max_seqs
+        if self.n_threads:
+            params.n_threads = self.n_threads
+            params.n_threads_batch = self.n_threads
+        self._ctx = _new_context(self._llm.model, params)
+        if not self._ctx:
+            raise RuntimeError("llama.cpp: failed to create batched context")
+        self._n_vocab = self._llm.n_vocab()
+        self._rng = np.random.default_rng()
+        self._is_eog = _eog_checker(self._llm)
+
+    async def start(self):
+        await asyncio.to_thread(self._load)
+        self._thread = threading.Thread(target=self._loop, name="llm-batcher", daemon=True)
+        self._thread.start()
+        log.info("[llm_batcher] up: max_seqs=%d n_ctx/seq=%d n_batch=%d",
+                 self.max_seqs, self.n_ctx_per_seq, self.n_batch)
+
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._ctx is not None:
+            llama_cpp.llama_free(self._ctx)
+            self._ctx = None
+
+    # ---------- API ----------
+    async def stream(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2) -> AsyncIterator[str]:
+        """Куски ответа по мере декодирования; закрытие генератора снимает запрос с батча."""
+        if not self.alive():
+            raise RuntimeError("llm batcher is not running")
+        tokens = self._llm.tokenize(prompt.encode("utf-8"))
+        # промпт длиннее окна последовательности — оставляем хвост
+        tokens = tokens[-max(1, self.n_ctx_per_seq - max_tokens):]
+        out: asyncio.Queue = asyncio.Queue()
+        seq = _Seq(tokens, max_tokens, temperature, asyncio.get_running_loop(), out)
+        try:
+            self._incoming.put_nowait(seq)
+        except queue.Full:
+            self.rejected += 1
+            raise Overloaded(f"llm batcher: очередь {self._incoming.maxsize} заполнена")
+        self.requests += 1
+        try:
+            while True:
+                item = await out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            seq.cancelled = True
+
+    async def generate(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2) -> str:
+        parts = [p async for p in self.stream(prompt, max_tokens, temperature)]
+        return "".join(parts)
+
+    # ---------- поток декодирования ----------
+    def _admit(self):
+        """Забирает новые запросы на свободные слоты; в простое ждёт окно батча."""
+        idle = not self._active
+        deadline = None
+        while self._free:
+            try:
+                if idle:
+                    timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+                    seq = self._incoming.get(timeout=timeout)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.window
+                else:
+                    seq = self._incoming.get_nowait()
+            except queue.Empty:
+                return
+            if seq.cancelled:
+                continue
+            seq.slot = self._free.pop()
+            self._active[seq.slot] = seq
+
+    def _finish(self, seq: _Seq, err: Optional[BaseException] = None):
+        self._active.pop(seq.slot, None)
+        _seq_rm(self._ctx, seq.slot)
+        self._free.append(seq.slot)
+        tail = seq.decoder.decode(b"", final=True)
+        if tail:
+            seq.emit(tail)
+        seq.emit(err if err is not None else _DONE)
+
+    def _sample(self, idx: int, temperature: float) -> int:
+        ptr = llama_cpp.llama_get_logits_ith(self._ctx, idx)
+        logits = np.ctypeslib.as_array(ptr, shape=(self._n_vocab,))
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        top = np.argpartition(logits, -_TOP_K)[-_TOP_K:]
+        z = logits[top].astype(np.float64) / temperature
+        p = np.exp(z - z.max())
+        return int(self._rng.choice(top, p=p / p.sum()))
+
+    def _step(self, batch) -> int:
+        """Один llama_decode по всем активным; возвращает число сгенерированных токенов."""
+        n = 0
+        room = self.n_batch
+        for seq in list(self._active.values()):
+            if seq.cancelled:
+                self._finish(seq)
+                continue
+            seq.logit_idx = -1
+            if seq.todo:  # префилл (кусками, если промпт не влезает в n_batch)
+                chunk = seq.todo[:room]
+                if not chunk:
+                    continue
+                seq.todo = seq.todo[len(chunk):]
+                toks = chunk
+                self.prefill_tokens += len(chunk)
+            elif seq.last is not None:
+                if room < 1:
+                    continue
+                toks = [seq.last]
+            else:
+                continue
+            for j, tok in enumerate(toks):
+                batch.token[n] = tok
+                batch.pos[n] = seq.pos
+                batch.n_seq_id[n] = 1
+                batch.seq_id[n][0] = seq.slot
+                last = j == len(toks) - 1 and not seq.todo
+                batch.logits[n] = 1 if last else 0
+                if last:
+                    seq.logit_idx = n
+                seq.pos += 1
+                n += 1
+            room -= len(toks)
+        if n == 0:
+            return 0
+        batch.n_tokens = n
+        rc = llama_cpp.llama_decode(self._ctx, batch)
+        if rc != 0:
+            raise RuntimeError(f"llama_decode failed: {rc}")
+        self.steps += 1
+        produced = 0
+        for seq in list(self._active.values()):
+            if seq.logit_idx < 0:
+                continue
+            self.batch_seqs += 1
+            tok = self._sample(seq.logit_idx, seq.temperature)
+            if self._is_eog(tok):
+                self._finish(seq)
+                continue
+            seq.last = tok
+            seq.generated += 1
+            produced += 1
+            text = seq.decoder.decode(self._llm.detokenize([tok]))
+            if text:
+                seq.emit(text)
+            if seq.generated >= seq.max_tokens or seq.pos >= self.n_ctx_per_seq:
+                self._finish(seq)
+        return produced
+
+    def _loop(self):
+        batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        try:
+            while not self._stop.is_set():
+                self._admit()
+                if not self._active:
+                    continue
+                t0 = time.monotonic()
+                try:
+                    produced = self._step(batch)
+                except Exception as e:
+                    log.exception("[llm_batcher] decode step failed: %s", e)
+                    for seq in list(self._active.values()):
+                        self._finish(seq, e)
+                    continue
+                now = time.monotonic()
+                self.busy_s += now - t0
+                self.tokens_out += produced
+                self._recent.append((now, produced))
+                while self._recent and now - self._recent[0][0] > 60:
+                    self._recent.popleft()
+        finally:
+            for seq in list(self._active.values()):
+                self._finish(seq, RuntimeError("llm batcher stopped"))
+            llama_cpp.llama_batch_free(batch)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        recent = [(t, k) for t, k in list(self._recent) if now - t <= 60]
+        span = now - recent[0][0] if recent else 0.0
+        return {
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "active": len(self._active),
+            "queued": self._incoming.qsize(),
+            "tokens_out": self.tokens_out,
+            "prefill_tokens": self.prefill_tokens,
+            "tok_per_s_busy": round(self.tokens_out / self.busy_s, 1) if self.busy_s else None,
+            "tok_per_s_1m": round(sum(k for _, k in recent) / span, 1) if span > 0 else None,
+            "avg_batch_seqs": round(self.batch_seqs / self.steps, 2) if self.steps else None,
+        }
@@ -0,0 +1,229 @@
+# services/llm_pool.py
+"""
+Пул процессов llama.cpp для LLMService (LLM_WORKERS > 0).
+
+Один Llama за asyncio.Lock генерирует по одному запросу — на многоядерной
+машине остальные чаты ждут, пока ядра простаивают. Здесь:
+
+- K воркеров, каждый — отдельный процесс (ProcessPoolExecutor на 1 процесс)
+  со своей моделью, своим n_threads и своим набором ядер (sched_setaffinity);
+- запрос уходит наименее загруженному воркеру; у каждого не больше
+  1 + queue запросов, сверх — executors.Overloaded сразу;
+- падение процесса (segfault в нативном коде, OOM) ломает только его:
+  воркер перезапускается, запрос один раз повторяется на другом (или, если
+  свободного нет, на перезапущенном том же);
+- отмена/дедлайн вызывающего останавливает генерацию в воркере на следующем
+  токене (общий флаг отмены), а max_sec ограничивает любую генерацию — иначе
+  брошенный запрос держал бы воркер до конца ответа;
+- снимки KV-кэша чатов (services/llm_state) живут в воркере, поэтому чат
+  по возможности идёт туда же, где отвечал в прошлый раз.
+
+Функции воркера — на уровне модуля: при spawn процесс импортирует его заново.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence, Tuple
+
+from services import llm_state
+from utils.executors import Overloaded
+
+log = logging.getLogger("llm_pool")
+
+# ---------- внутри процесса-воркера ----------
+_MODEL = None
+_STATES: Optional[llm_state.StateCache] = None
+_CANCEL = None  # общий с основным процессом: номер задачи, которую бросил вызывающий
+
+def _init_worker(model_path: str, n_ctx: int, n_threads: int, cpus: Optional[Sequence[int]],
+                 state_budget: int, cancel):
+    global _MODEL, _STATES, _CANCEL
+    _CANCEL = cancel
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    os.environ["OMP_NUM_THREADS"] = str(n_threads)
+    from llama_cpp import Llama
+    _MODEL = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+    _STATES = llm_state.StateCache(state_budget)
+
+def _ping() -> int:
+    return os.getpid()
+
+def _generate(prompt: str, max_tokens: int, temperature: float, chat_id: Optional[int],
+              seq: int = 0, max_sec: float = 0.0) -> Tuple[str, dict]:
+    from llama_cpp import StoppingCriteriaList
+    until = time.monotonic() + max_sec if max_sec else None
+
+    def _stop(input_ids, logits) -> bool:
+        return _CANCEL.value == seq or (until is not None and time.monotonic() > until)
+
+    return llm_state.generate(_MODEL, _STATES, chat_id, prompt, max_tokens, temperature,
+                              stop=StoppingCriteriaList([_stop]))
+
+# ---------- в основном процессе ----------
+def core_sets(workers: int, n_threads: int) -> List[Optional[List[int]]]:
+    """Разрезает доступные ядра на непересекающиеся наборы по n_threads."""
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if workers * n_threads > len(cpus):
+        return [None] * workers  # ядер не хватает — пусть раскидывает ОС
+    return [cpus[i * n_threads:(i + 1) * n_threads] for i in range(workers)]
+
+class _Worker:
+    def __init__(self, idx: int, cpus: Optional[List[int]], cancel):
+        self.idx = idx
+        self.cpus = cpus
+        self.cancel = cancel  # RawValue: seq брошенной задачи (воркер выполняет по одной)
+        self.seq = 0
+        self.ex: Optional[ProcessPoolExecutor] = None
+        self.restarting: Optional[asyncio.Task] = None
+        self.pid: Optional[int] = None
+        self.inflight = 0
+        self.served = 0
+        self.failed = 0
+        self.restarts = 0
+
+_MAX_AFFINITY = 10000
+
+class LlamaPool:
+    def __init__(self, model_path: str, workers: int, n_ctx: int = 1024,
+                 n_threads: int = 0, queue: int = 4, pin: bool = True, state_budget: int = 0,
+                 max_sec: float = 0.0):
+        self.model_path = model_path
+        self.state_budget = state_budget // max(1, workers)  # общий бюджет снимков делим между воркерами
+        self.n_ctx = n_ctx
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        self.n_threads = n_threads or max(1, cores // workers)
+        self.queue = queue
+        self.max_sec = max_sec
+        sets = core_sets(workers, self.n_threads) if pin else [None] * workers
+        self._ctx = multiprocessing.get_context("spawn")  # fork после старта потоков небезопасен
+        self._workers = [_Worker(i, cpus, self._ctx.RawValue("q", 0)) for i, cpus in enumerate(sets)]
+        self.rejected = 0
+        self._affinity: "OrderedDict[int, _Worker]" = OrderedDict()  # chat_id -> где лежит снимок
+        self.reuse = llm_state.ReuseStats()
+
+    def _spawn(self, w: _Worker):
+        w.ex = ProcessPoolExecutor(
+            max_workers=1, mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(self.model_path, self.n_ctx, self.n_threads, w.cpus, self.state_budget, w.cancel),
+        )
+
+    async def _load(self, w: _Worker):
+        # initializer отрабатывает при первой задаче; ошибка загрузки -> BrokenProcessPool
+        w.pid = await asyncio.wrap_future(w.ex.submit(_ping))
+
+    async def start(self):
+        """Поднимает все воркеры и ждёт загрузки моделей."""
+        for w in self._workers:
+            self._spawn(w)
+        await asyncio.gather(*(self._load(w) for w in self._workers))
+        log.info("[llm_pool] %d workers up, n_threads=%d, cpus=%s",
+                 len(self._workers), self.n_threads, [w.cpus for w in self._workers])
+
+    def alive(self) -> bool:
+        return any(w.ex is not None for w in self._workers)
+
+    def _free(self, exclude: Optional[_Worker] = None) -> List[_Worker]:
+        return [w for w in self._workers
+                if w.ex is not None and w is not exclude and w.inflight < 1 + self.queue]
+
+    def _pick(self, chat_id: Optional[int] = None) -> _Worker:
+        free = self._free()
+        if not free:
+            self.rejected += 1
+            raise Overloaded(f"llama: все {len(self._workers)} воркеров заняты")
+        home = self._affinity.get(chat_id) if chat_id is not None else None
+        # к «своему» воркеру, если он не сильно загруженнее остальных: снимок дешевле очереди
+        best = min(free, key=lambda w: w.inflight)
+        if home in free and home.inflight <= best.inflight + 1:
+            return home
+        return best
+
+    def _remember(self, chat_id: Optional[int], w: _Worker):
+        if chat_id is None:
+            return
+        self._affinity[chat_id] = w
+        self._affinity.move_to_end(chat_id)
+        while len(self._affinity) > _MAX_AFFINITY:
+            self._affinity.popitem(last=False)
+
+    async def _restart(self, w: _Worker, broken: ProcessPoolExecutor):
+        if w.ex is not broken:  # этот сбой уже обрабатывается
+            return
+        w.restarts += 1
+        log.warning("[llm_pool] worker %d (pid %s) crashed, restarting", w.idx, w.pid)
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._spawn(w)
+        try:
+            await self._load(w)
+        except Exception as e:
+            log.exception("[llm_pool] worker %d failed to restart: %s", w.idx, e)
+            w.ex.shutdown(wait=False, cancel_futures=True)
+            w.ex = None
+
+    async def _run(self, w: _Worker, prompt: str, max_tokens: int, temperature: float,
+                   chat_id: Optional[int]) -> str:
+        ex = w.ex
+        w.seq += 1
+        seq = w.seq
+        w.inflight += 1
+        try:
+            text, info = await asyncio.wrap_future(
+                ex.submit(_generate, prompt, max_tokens, temperature, chat_id, seq, self.max_sec))
+            w.served += 1
+            self.reuse.observe(info)
+            self._remember(chat_id, w)
+            return text
+        except asyncio.CancelledError:
+            # ещё в очереди — снимется сама; уже генерируется — воркер бросит на следующем токене
+            w.cancel.value = seq
+            raise
+        except BrokenProcessPool:
+            w.failed += 1
+            if w.restarting is None or w.restarting.done():
+                w.restarting = asyncio.create_task(self._restart(w, ex))
+            raise
+        finally:
+            w.inflight -= 1
+
+    async def generate(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2,
+                       chat_id: Optional[int] = None) -> str:
+        w = self._pick(chat_id=chat_id)
+        try:
+            return await self._run(w, prompt, max_tokens, temperature, chat_id)
+        except BrokenProcessPool as e:
+            # повторяем один раз: на другом свободном воркере, иначе — на перезапущенном этом.
+            # Сбой воркера — ошибка генерации, а не Overloaded
+            free = self._free(exclude=w)
+            retry = min(free, key=lambda x: x.inflight) if free else w
+            if retry is w and w.restarting is not None:
+                await asyncio.shield(w.restarting)
+            if retry.ex is None:
+                raise RuntimeError(f"llama: воркер {w.idx} упал и не перезапустился") from e
+            return await self._run(retry, prompt, max_tokens, temperature, chat_id)
+
+    def shutdown(self):
+        for w in self._workers:
+            if w.ex is not None:
+                w.ex.shutdown(wait=False, cancel_futures=True)
+                w.ex = None
+
+    def stats(self) -> dict:
+        return {
+            "n_threads": self.n_threads,
+            "rejected": self.rejected,
+            "state_reuse": self.reuse.snapshot(),
+            "workers": [
+                {"pid": w.pid, "cpus": w.cpus, "up": w.ex is not None, "inflight": w.inflight,
+                 "served": w.served, "failed": w.failed, "restarts": w.restarts}
+                for w in self._workers
+            ],
+        }
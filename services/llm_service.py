@@ -2,8 +2,21 @@
 import os
 import logging
 import asyncio
+import threading
+import time
+from contextlib import aclosing
 from pathlib import Path
-from config import MODELS_DIR, MODEL_NAME
+from typing import AsyncIterator
+from config import (
+    MODELS_DIR, MODEL_NAME, LLM_BATCH_MAX_SEQS, LLM_BATCH_TOKENS, LLM_BATCH_WINDOW_MS, LLM_BATCHING,
+    LLM_PIN_CORES, LLM_STATE_CACHE_MB, LLM_WORKERS, LLM_WORKER_MAX_SEC, LLM_WORKER_QUEUE, LLM_WORKER_THREADS,
+)
+from services import llm_state
+from services.llm_batcher import LlamaBatcher
+from services.llm_pool import LlamaPool
+from utils import executors
+from utils.aio_bridge import iterate_in_thread
+from utils.breaker import breaker
 
 logger = logging.getLogger(__name__)
 
@@ -15,32 +28,71 @@ except Exception:
     _HAS_LLAMA = False
 
 class LLMService:
-    def __init__(self, model_name: str = None, model_dir: str = None, n_ctx: int = 1024, n_threads: int = 2):
+    def __init__(self, model_name: str = None, model_dir: str = None, n_ctx: int = 1024, n_threads: int = 2,
+                 workers: int = LLM_WORKERS, batching: bool = LLM_BATCHING):
         self.model_name = model_name or MODEL_NAME
         self.model_dir = model_dir or MODELS_DIR
         self.n_ctx = n_ctx
         self.n_threads = n_threads or int(os.environ.get("OMP_NUM_THREADS", "2"))
+        self.workers = workers              # > 0 — пул процессов (services/llm_pool) вместо одной модели
+        self.batching = batching            # один батч на все чаты (services/llm_batcher); важнее workers
         self.model = None
+        self.pool = None
+        self.batcher = None
         self._lock = asyncio.Lock()           # <- ключевая защита от параллельных вызовов
         self._reinit_scheduled = False
+        self.breaker = breaker("llama")
+        # снимки KV-кэша по чатам: следующий ход досчитывает только новые токены
+        self.states = llm_state.StateCache(LLM_STATE_CACHE_MB * 1024 * 1024)
+        self.reuse = llm_state.ReuseStats()
 
     def _init_model_sync(self):
         """Синхронная инициализация (выполняется в to_thread)"""
-        if not _HAS_LLAMA:
-            raise RuntimeError("llama_cpp not installed")
-        model_path = Path(self.model_dir) / self.model_name
-        if not model_path.exists():
-            raise FileNotFoundError(f"LLM model file not found: {model_path}")
+        model_path = self._model_path()
         os.environ["OMP_NUM_THREADS"] = str(self.n_threads)
         logger.info("Initializing Llama model (sync): %s", model_path)
         # Создаём экземпляр (может бросить исключение)
         model = Llama(model_path=str(model_path), n_ctx=self.n_ctx)
         return model
 
+    def _model_path(self) -> Path:
+        if not _HAS_LLAMA:
+            raise RuntimeError("llama_cpp not installed")
+        model_path = Path(self.model_dir) / self.model_name
+        if not model_path.exists():
+            raise FileNotFoundError(f"LLM model file not found: {model_path}")
+        return model_path
+
+    async def _init_batcher(self) -> bool:
+        batcher = LlamaBatcher(str(self._model_path()), n_ctx_per_seq=self.n_ctx, max_seqs=LLM_BATCH_MAX_SEQS,
+                               n_batch=LLM_BATCH_TOKENS, n_threads=self.n_threads,
+                               window_ms=LLM_BATCH_WINDOW_MS)
+        await batcher.start()
+        self.batcher = batcher
+        return True
+
+    async def _init_pool(self) -> bool:
+        model_path = self._model_path()
+        pool = LlamaPool(str(model_path), self.workers, n_ctx=self.n_ctx, n_threads=LLM_WORKER_THREADS,
+                         queue=LLM_WORKER_QUEUE, pin=LLM_PIN_CORES,
+                         state_budget=LLM_STATE_CACHE_MB * 1024 * 1024, max_sec=LLM_WORKER_MAX_SEC)
+        try:
+            await pool.start()
+        except BaseException:
+            pool.shutdown()
+            raise
+        self.pool = pool
+        return True
+
     async def initialize(self) -> bool:
         """Асинхронная обёртка для инициализации модели"""
         try:
+            if self.batching:
+                return await self._init_batcher()
+            if self.workers > 0:
+                return await self._init_pool()
             self.model = await asyncio.to_thread(self._init_model_sync)
+            self.states = llm_state.StateCache(self.states.budget)  # снимки старой модели не годятся
             logger.info("LLM loaded, n_ctx=%s, threads=%s", self.n_ctx, self.n_threads)
             self._reinit_scheduled = False
             return True
@@ -49,8 +101,26 @@ class LLMService:
             return False
 
     def is_ready(self) -> bool:
+        if self.batcher is not None:
+            return self.batcher.alive()
+        if self.pool is not None:
+            return self.pool.alive()
         return self.model is not None
 
+    def shutdown(self):
+        if self.batcher is not None:
+            self.batcher.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def stats(self) -> dict:
+        if self.batcher is not None:
+            return dict(self.batcher.stats(), mode="batch")
+        if self.pool is not None:
+            return dict(self.pool.stats(), mode="pool")
+        return {"mode": "single", "ready": self.is_ready(), "states": len(self.states),
+                "state_mb": round(self.states.bytes / 1048576, 1), "state_reuse": self.reuse.snapshot()}
+
     async def _reinit_async(self):
         """Попытка реинициализировать модель в фоне (однократно)"""
         if self._reinit_scheduled:
@@ -66,30 +136,51 @@ class LLMService:
         except Exception:
             logger.exception("Error during async reinit.")
 
-    async def generate_response(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2) -> str:
-        """Генерация ответа (безопасно, сериализовано)"""
-        if not self.is_ready():
+    async def generate_response(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2,
+                                chat_id: int = None) -> str:
+        """
+        Генерация ответа (безопасно, сериализовано). С chat_id промпт продолжает
+        снимок прошлого хода этого чата — разбирается только новый хвост.
+        """
+        if not self.is_ready() or not self.breaker.allow():
             return "Извините, LLM временно недоступна."
+        try:
+            if self.batcher is not None:
+                return await self._generate_batched(prompt, max_tokens, temperature)
+            if self.pool is not None:
+                return await self._generate_pooled(prompt, max_tokens, temperature, chat_id)
+            return await self._generate_single(prompt, max_tokens, temperature, chat_id)
+        except asyncio.CancelledError:
+            self.breaker.release()  # отмена — не вердикт о модели, пробу breaker'а отпускаем
+            raise
 
+    async def _generate_single(self, prompt: str, max_tokens: int, temperature: float, chat_id: int) -> str:
         # Сериализуем все вызовы к self.model
         async with self._lock:
-            loop = asyncio.get_running_loop()
             def _sync():
-                # синхронный вызов Llama — выполняется в thread pool
+                # синхронный вызов Llama — выполняется в пуле "llama" (utils/executors)
                 try:
-                    out = self.model(prompt, max_tokens=max_tokens, temperature=temperature)
-                    if isinstance(out, dict) and "choices" in out and out["choices"]:
-                        return out["choices"][0].get("text") or str(out["choices"][0])
-                    return str(out)
+                    text, info = llm_state.generate(self.model, self.states, chat_id, prompt,
+                                                    max_tokens, temperature)
+                    self.reuse.observe(info)
+                    return text
                 except Exception as e:
                     # пробросим исключение наружу для логики ниже
                     raise
 
+            t0 = time.monotonic()
             try:
-                result = await loop.run_in_executor(None, _sync)
+                result = await executors.run("llama", _sync)
+                self.breaker.record(True, time.monotonic() - t0)
                 return (result or "").strip()
+            except executors.Overloaded as e:
+                logger.warning("LLM executor overloaded: %s", e)
+                self.breaker.release()
+                return "Извините, LLM временно недоступна."
             except Exception as e:
                 logger.exception("LLM generation failed: %s", e)
+                self.breaker.record(False, time.monotonic() - t0, err=e)
+                self.states.drop(chat_id)
                 # Если упало на нативной стороне — попробуем перезагрузить модель (однократно)
                 # не блокируем текущий обработчик: запустим реинициализацию в фоне
                 try:
@@ -97,3 +188,126 @@ class LLMService:
                 except Exception:
                     logger.exception("Cannot schedule reinit task.")
                 return "Ошибка при генерации."
+
+    async def stream_response(self, prompt: str, max_tokens: int = 256, temperature: float = 0.2,
+                              chat_id: int = None) -> AsyncIterator[str]:
+        """
+        Куски ответа по мере генерации; ошибки — исключениями (как stream_* в utils).
+        Досрочная остановка — aclose() у потребителя (отмена пользователем, исчерпан
+        бюджет длины): генерация прерывается на следующем токене.
+        В режиме пула процессов стрима нет — ответ приходит одним куском.
+        """
+        if not self.is_ready() or not self.breaker.allow():
+            raise RuntimeError("LLM временно недоступна")
+        t0 = time.monotonic()
+        got = verdict = False
+        try:
+            if self.batcher is not None:
+                stream = self.batcher.stream(prompt, max_tokens=max_tokens, temperature=temperature)
+            elif self.pool is not None:
+                stream = self._stream_pooled(prompt, max_tokens, temperature, chat_id)
+            else:
+                stream = self._stream_single(prompt, max_tokens, temperature, chat_id)
+            # aclosing: при досрочном выходе генерация снимается сразу, а не при сборке мусора
+            async with aclosing(stream):
+                async for piece in stream:
+                    got = True
+                    yield piece
+            self.breaker.record(True, time.monotonic() - t0)
+            verdict = True
+        except executors.Overloaded:
+            raise
+        except Exception as e:
+            self.breaker.record(False, time.monotonic() - t0, err=e)
+            verdict = True
+            raise
+        finally:
+            if not verdict:
+                if got:  # потребитель остановил сам (aclose), модель при этом отвечала
+                    self.breaker.record(True, time.monotonic() - t0)
+                else:    # перегрузка или отмена до первого куска — без вердикта
+                    self.breaker.release()
+
+    async def _stream_pooled(self, prompt: str, max_tokens: int, temperature: float,
+                             chat_id: int) -> AsyncIterator[str]:
+        # из процесса-воркера ответ приходит целиком
+        yield await self.pool.generate(prompt, max_tokens=max_tokens, temperature=temperature, chat_id=chat_id)
+
+    async def _stream_single(self, prompt: str, max_tokens: int, temperature: float,
+                             chat_id: int) -> AsyncIterator[str]:
+        """
+        Одна модель: поток пула "llama" генерирует, куски идут в event loop через
+        ограниченную очередь (utils/aio_bridge). Лок держится, пока поток не
+        закончит (в т.ч. не сохранит снимок чата) — даже если потребитель ушёл раньше.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            finished = loop.create_future()
+            gone = threading.Event()
+            info = {}
+
+            def _done():
+                if not finished.done():
+                    finished.set_result(None)
+
+            def _pieces():
+                try:
+                    if gone.is_set():  # поток достался из очереди пула, когда ответ уже не нужен
+                        return
+                    yield from llm_state.stream(self.model, self.states, chat_id, prompt,
+                                                max_tokens, temperature, info)
+                finally:
+                    loop.call_soon_threadsafe(_done)
+
+            overloaded = False
+            pieces = iterate_in_thread(_pieces, executor="llama")
+            try:
+                async with aclosing(pieces):
+                    async for piece in pieces:
+                        yield piece
+            except executors.Overloaded:
+                overloaded = True
+                raise
+            except Exception:
+                self.states.drop(chat_id)
+                asyncio.create_task(self._reinit_async())
+                raise
+            finally:
+                gone.set()
+                if not overloaded:
+                    await finished
+                if info:
+                    self.reuse.observe(info)
+
+    async def _generate_pooled(self, prompt: str, max_tokens: int, temperature: float, chat_id: int) -> str:
+        """Параллельно на наименее загруженном воркере; упавший воркер пул перезапускает сам."""
+        t0 = time.monotonic()
+        try:
+            result = await self.pool.generate(prompt, max_tokens=max_tokens, temperature=temperature,
+                                              chat_id=chat_id)
+        except executors.Overloaded as e:
+            logger.warning("LLM pool overloaded: %s", e)
+            self.breaker.release()
+            return "Извините, LLM временно недоступна."
+        except Exception as e:
+            logger.exception("LLM generation failed: %s", e)
+            self.breaker.record(False, time.monotonic() - t0, err=e)
+            return "Ошибка при генерации."
+        self.breaker.record(True, time.monotonic() - t0)
+        return (result or "").strip()
+
+    async def _generate_batched(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        """Вместе с запросами других чатов в одном llama_decode (services/llm_batcher)."""
+        t0 = time.monotonic()
+        try:
+            result = await self.batcher.generate(prompt, max_tokens=max_tokens, temperature=temperature)
+        except executors.Overloaded as e:
+            logger.warning("LLM batcher overloaded: %s", e)
+            self.breaker.release()
+            return "Извините, LLM временно недоступна."
+        except Exception as e:
+            logger.exception("LLM generation failed: %s", e)
+            self.breaker.record(False, time.monotonic() - t0, err=e)
+            return "Ошибка при генерации."
+        self.breaker.record(True, time.monotonic() - t0)
+        return (result or "").strip()
@@ -0,0 +1,155 @@
+# services/llm_state.py
+"""
+Переиспользование KV-кэша llama.cpp между ходами одного чата.
+
+На CPU время ответа в длинном диалоге съедает разбор промпта: system-текст
+и все прежние ходы заново прогоняются через модель. Здесь после каждого
+ответа снимок состояния модели (Llama.save_state) кладётся в LRU по chat_id
+с бюджетом по байтам; следующий ход того же чата загружает снимок
+(load_state), и модель досчитывает только токены после общего префикса.
+
+generate()/stream() работают и в процессе бота (LLMService), и в воркерах
+services/llm_pool (там только generate) — у каждого процесса свой StateCache.
+"""
+import time
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+class StateCache:
+    def __init__(self, budget_bytes: int):
+        self.budget = budget_bytes
+        self.bytes = 0
+        self._states: "OrderedDict[int, object]" = OrderedDict()
+        self.evicted = 0
+
+    @staticmethod
+    def _size(state) -> int:
+        # save_state() копирует не только KV-кэш, но и логиты (n_batch × n_vocab float32,
+        # ~65 МБ при 32k словаре) и input_ids — считаем всё, иначе бюджет врёт в разы
+        size = int(getattr(state, "llama_state_size", 0) or 0)
+        for arr in (getattr(state, "scores", None), getattr(state, "input_ids", None)):
+            size += int(getattr(arr, "nbytes", 0) or 0)
+        return size
+
+    def get(self, chat_id: int):
+        st = self._states.get(chat_id)
+        if st is not None:
+            self._states.move_to_end(chat_id)
+        return st
+
+    def put(self, chat_id: int, state):
+        self.drop(chat_id)
+        size = self._size(state)
+        if size > self.budget:
+            return
+        self._states[chat_id] = state
+        self.bytes += size
+        while self.bytes > self.budget and self._states:
+            _, old = self._states.popitem(last=False)
+            self.bytes -= self._size(old)
+            self.evicted += 1
+
+    def drop(self, chat_id: int):
+        st = self._states.pop(chat_id, None)
+        if st is not None:
+            self.bytes -= self._size(st)
+
+    def __len__(self):
+        return len(self._states)
+
+def _common_prefix(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def _prefill(model, cache: Optional[StateCache], chat_id: Optional[int], prompt: str) -> dict:
+    """Подгружает снимок чата и досчитывает хвост промпта; возвращает info."""
+    tokens = model.tokenize(prompt.encode("utf-8"))
+    state = cache.get(chat_id) if cache is not None and chat_id is not None else None
+    if state is not None:
+        model.load_state(state)
+        reused = _common_prefix(model.input_ids[:model.n_tokens].tolist(), tokens)
+    else:
+        model.reset()
+        reused = 0
+    # последний токен промпта модель всё равно пересчитывает ради логитов
+    reused = min(reused, len(tokens) - 1) if tokens else 0
+    model.n_tokens = reused  # eval() сам отрежет KV-кэш после этой позиции
+    t0 = time.perf_counter()
+    model.eval(tokens[reused:])
+    return {"hit": state is not None, "reused": reused,
+            "prefill": len(tokens) - reused, "prefill_s": time.perf_counter() - t0}
+
+def _save(model, cache: Optional[StateCache], chat_id: Optional[int]):
+    if cache is not None and chat_id is not None:
+        cache.put(chat_id, model.save_state())
+
+def generate(model, cache: Optional[StateCache], chat_id: Optional[int], prompt: str,
+             max_tokens: int, temperature: float, stop=None) -> Tuple[str, dict]:
+    """
+    Синхронная генерация с подгрузкой снимка чата. Возвращает (текст, info),
+    info: reused — токены префикса из снимка, prefill — досчитанные токены
+    промпта, prefill_s — время на них. stop — llama_cpp.StoppingCriteriaList
+    (проверяется на каждом токене).
+    """
+    info = _prefill(model, cache, chat_id, prompt)
+    # весь промпт уже в кэше — генерация найдёт префикс и сразу пойдёт дальше
+    kw = {"stopping_criteria": stop} if stop is not None else {}
+    out = model(prompt, max_tokens=max_tokens, temperature=temperature, **kw)
+    if isinstance(out, dict) and out.get("choices"):
+        text = out["choices"][0].get("text") or str(out["choices"][0])
+    else:
+        text = str(out)
+    _save(model, cache, chat_id)
+    return text, info
+
+def stream(model, cache: Optional[StateCache], chat_id: Optional[int], prompt: str,
+           max_tokens: int, temperature: float, info: Optional[dict] = None) -> Iterator[str]:
+    """
+    То же, что generate(), но куски текста по мере генерации. close() генератора
+    останавливает модель; снимок сохраняется и для оборванного ответа.
+    info (если передан) заполняется после разбора промпта.
+    """
+    res = _prefill(model, cache, chat_id, prompt)
+    if info is not None:
+        info.update(res)
+    try:
+        for chunk in model(prompt, max_tokens=max_tokens, temperature=temperature, stream=True):
+            text = chunk["choices"][0].get("text") if chunk.get("choices") else None
+            if text:
+                yield text
+    finally:
+        _save(model, cache, chat_id)
+
+class ReuseStats:
+    """Доля попаданий и оценка сэкономленного разбора промпта (в основном процессе)."""
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.reused_tokens = 0
+        self.prefill_tokens = 0
+        self.prefill_s = 0.0
+        self.saved_s = 0.0
+
+    def observe(self, info: dict):
+        self.calls += 1
+        self.hits += bool(info.get("hit"))
+        self.reused_tokens += info.get("reused", 0)
+        self.prefill_tokens += info.get("prefill", 0)
+        self.prefill_s += info.get("prefill_s", 0.0)
+        # переиспользованные токены стоили бы столько же, сколько досчитанные
+        if self.prefill_tokens:
+            self.saved_s += info.get("reused", 0) * self.prefill_s / self.prefill_tokens
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hit_rate": round(self.hits / self.calls, 3) if self.calls else None,
+            "reused_tokens": self.reused_tokens,
+            "prefill_tokens": self.prefill_tokens,
+            "prefill_s": round(self.prefill_s, 2),
+            "saved_s_est": round(self.saved_s, 2),
+        }
@@ -2,19 +2,22 @@
 services/mistral_service.py
 
 Async-friendly wrapper around mistralai client with:
-- cooldown circuit-breaker on 429 / "capacity exceeded"
+- shared circuit-breaker (utils/breaker): cooldown on 429 / capacity, error-rate window
 - very small retry/backoff loop
 - optional Hugging Face fallback (requires HF_API_TOKEN)
 - returns `None` on unrecoverable failure so caller can fallback to retrieval/local response
 """
 from __future__ import annotations
-import os
 import asyncio
+import os
 import logging
 import time
 import random
 from typing import Optional, List, Dict, Any
 
+from utils import executors
+from utils.breaker import breaker, is_rate_limit
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -49,7 +52,7 @@ class MistralService:
         self.client = None
         self.cooldown_seconds = cooldown_seconds
         self.max_retries = max_retries
-        self._cooldown_until = 0.0
+        self.breaker = breaker("mistral", cooldown=cooldown_seconds)
 
         if not Mistral:
             logger.error("mistralai library is unavailable; MistralService disabled.")
@@ -67,12 +70,8 @@ class MistralService:
             self.client = None
 
     def is_ready(self) -> bool:
-        """Consider ready if client exists and not in cooldown."""
-        return bool(self.client) and (time.time() >= self._cooldown_until)
-
-    def _enter_cooldown(self, reason: str):
-        self._cooldown_until = time.time() + self.cooldown_seconds
-        logger.warning("Entering Mistral cooldown for %ds: %s", self.cooldown_seconds, reason)
+        """Consider ready if client exists and the breaker is not open."""
+        return bool(self.client) and self.breaker.available()
 
     async def chat(
         self,
@@ -90,16 +89,16 @@ class MistralService:
         if not self.client:
             return None
 
-        now = time.time()
-        if now < self._cooldown_until:
-            logger.info("Mistral in cooldown (%.1fs remaining)", self._cooldown_until - now)
+        if not self.breaker.allow():
+            logger.info("Mistral breaker open, skipping call")
             return None
 
         msgs = messages if messages is not None else [{"role": "user", "content": prompt or ""}]
 
         def _sync_call():
-            # minimal retries; if 429/capacity occurs -> cooldown
+            # minimal retries; if 429/capacity persists -> breaker opens for cooldown
             for attempt in range(self.max_retries + 1):
+                t0 = time.monotonic()
                 try:
                     resp = self.client.chat.complete(
                         model=self.model,
@@ -107,6 +106,7 @@ class MistralService:
                         max_tokens=max_tokens,
                         temperature=temperature,
                     )
+                    self.breaker.record(True, time.monotonic() - t0)
                     # try structured extraction
                     try:
                         return resp.choices[0].message.content
@@ -116,12 +116,11 @@ class MistralService:
                             return resp.get("text") or resp.get("content") or str(resp)
                         return str(resp)
                 except Exception as e:
-                    s = str(e).lower()
                     # handle capacity / 429 heuristically
-                    if "429" in s or "too many requests" in s or "capacity" in s or "service tier capacity" in s:
+                    if is_rate_limit(e):
                         if attempt >= self.max_retries:
-                            # go to cooldown
-                            self._enter_cooldown("429/capacity")
+                            logger.warning("Mistral 429/capacity, opening breaker for %ds", self.cooldown_seconds)
+                            self.breaker.record(False, time.monotonic() - t0, err=e)
                             return None
                         backoff = (2 ** attempt) + random.random()
                         logger.warning("Mistral 429/capacity (attempt %d). Backing off %.1fs", attempt + 1, backoff)
@@ -129,17 +128,26 @@ class MistralService:
                         continue
                     # other errors: log and abort
                     logger.exception("Mistral API error: %s", e)
+                    self.breaker.record(False, time.monotonic() - t0, err=e)
                     return None
             return None
 
-        return await asyncio.to_thread(_sync_call)
+        try:
+            return await executors.run("mistral", _sync_call)
+        except executors.Overloaded as e:
+            logger.warning("Mistral executor overloaded: %s", e)
+            self.breaker.release()
+            return None
+        except asyncio.CancelledError:
+            self.breaker.release()  # поток ещё может дописать record — это не страшно
+            raise
 
     async def embeddings(self, texts: List[str], model: str = "mistral-embed"):
         if not self.client:
             raise RuntimeError("Mistral client not initialized")
         def _sync_embeddings():
             return self.client.embeddings.create(model=model, inputs=texts)
-        return await asyncio.to_thread(_sync_embeddings)
+        return await executors.run("mistral", _sync_embeddings)
 
     # Optional HF fallback (requires HF_API_TOKEN in env). Returns string or None.
     async def hf_fallback(self, prompt: str, model: str = "gpt2"):
@@ -165,4 +173,7 @@ class MistralService:
             except Exception:
                 logger.exception("HF fallback failed")
                 return None
-        return await asyncio.to_thread(_sync_hf)
+        try:
+            return await executors.run("hf", _sync_hf)
+        except executors.Overloaded:
+            return None
@@ -45,6 +45,10 @@ def list_documents(limit: int = 1000) -> List[Dict]:
     conn.close()
     return [{"id": r[0], "title": r[1], "content": r[2]} for r in rows]
 
+def make_vectorizer() -> TfidfVectorizer:
+    """Общие настройки TF-IDF (индекс документов, services/semantic_cache)."""
+    return TfidfVectorizer(ngram_range=(1,2), max_features=50000)
+
 def rebuild_index():
     """Собрать TF-IDF индекс заново (читает все documents из БД)."""
     os.makedirs(MODELS_DIR, exist_ok=True)
@@ -54,7 +58,7 @@ def rebuild_index():
         # сохраняем пустой структуру
         joblib.dump({"vectorizer": None, "tfidf": None, "doc_ids": []}, INDEX_FILE)
         return
-    vectorizer = TfidfVectorizer(ngram_range=(1,2), max_features=50000)
+    vectorizer = make_vectorizer()
     tfidf = vectorizer.fit_transform(texts)
     doc_ids = [d["id"] for d in docs]
     joblib.dump({"vectorizer": vectorizer, "tfidf": tfidf, "doc_ids": doc_ids}, INDEX_FILE)
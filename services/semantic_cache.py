@@ -0,0 +1,255 @@
+# services/semantic_cache.py
+"""
+Семантический кэш ответов по таблице qa_logs (bot.db).
+
+Прошлые вопросы с ok=1 векторизуются тем же TF-IDF, что и индекс документов
+(services/retriever_tfidf.make_vectorizer). Новый вопрос с косинусной
+близостью >= SEMANTIC_CACHE_THRESHOLD к лучшему из них получает сохранённый
+ответ без обращения к LLM — только ответ того же движка (qa_logs.engine),
+иначе чат на Cerebras получил бы ответ Gemini «я — Gemini».
+
+- вопросы о самом боте («какая ты модель») и ответы, где названа модель
+  или есть личные данные собеседника, в кэш не попадают и из него не берутся;
+
+- строки TF-IDF L2-нормированы, так что косинус — это одно разреженное
+  произведение матрицы на вектор запроса, top-1 — argmax;
+- новые хорошие ответы (log_qa(..., ok=1) / mark_ok) копятся и пачкой
+  (_MERGE_BATCH штук или раз в _MERGE_SEC) векторизуются по текущему
+  словарю и дописываются к матрице — не vstack на каждый поиск;
+- когда добавлений набралось много (словарь устарел), словарь
+  пересобирается в фоне, старый индекс работает до подмены;
+- без scikit-learn кэш просто выключен.
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from config import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD
+from utils.db import get_con
+from utils.reply_cache import is_personal, is_volatile, normalize
+
+try:
+    from services import retriever_tfidf
+    import numpy as np
+    from scipy import sparse
+except Exception:  # scikit-learn/numpy не установлены
+    retriever_tfidf = None
+
+log = logging.getLogger("semantic_cache")
+
+_QA_DB = retriever_tfidf.DB_PATH if retriever_tfidf else None
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qa_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    query TEXT,
+    response TEXT,
+    ok INTEGER DEFAULT NULL,  -- 1 = ok, 0 = bad, NULL = unknown
+    created_at TEXT,
+    engine TEXT               -- движок, давший ответ (NULL — старые строки, в кэш не идут)
+);
+"""
+_MIGRATIONS = (
+    ("engine", "ALTER TABLE qa_logs ADD COLUMN engine TEXT"),
+)
+_LOAD_LIMIT = 50000
+_REFIT_RATIO = 0.2  # пересобрать словарь, когда добавлено >20% от базы
+_MERGE_BATCH = 32   # дописывать новые ответы к матрице пачками...
+_MERGE_SEC = 30.0   # ...или не реже, чем раз в столько секунд
+
+# вопросы о самом боте: ответ зависит от движка и устаревает при смене модели
+_IDENTITY_RE = re.compile(
+    r"кто ты|ты кто|хто ти|ти хто|who are you|"
+    r"\b(ты|вы|ти|you)\b.*\b(модел|нейросет|gpt|gemini|cerebras|llama|model|ai\b|ии\b)",
+    re.I,
+)
+# ответы, где названа модель или есть данные собеседника, другим пользователям не отдаём
+_SELF_REPLY_RE = re.compile(r"gemini|google|cerebras|llama|mistral|gpt|openai|\bмодел[ьи]\b", re.I)
+_PERSONAL_REPLY_RE = re.compile(
+    r"\b(твой|твоя|твоё|твое|твои|твоего|твоей|твоих|ваш|ваша|ваше|ваши|вашего|вашей|ваших|"
+    r"твій|твоя|твоє|твої|your|yours)\b|@|\d{3,}",
+    re.I,
+)
+
+def _cacheable(query: str, response: str) -> bool:
+    return not (
+        is_personal(query) or is_volatile(query) or _IDENTITY_RE.search(query or "")
+        or _SELF_REPLY_RE.search(response or "") or _PERSONAL_REPLY_RE.search(response or "")
+    )
+
+class SemanticCache:
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self.enabled = SEMANTIC_CACHE_ENABLED and retriever_tfidf is not None
+        self._vec = None
+        self._matrix = None                   # csr, строки L2-нормированы
+        self._answers: List[str] = []
+        self._engines = None                  # np.array движков, по строке матрицы
+        self._pending: List[Tuple[str, str, str]] = []  # (вопрос, ответ, движок), ещё не в матрице
+        self._pending_since = 0.0
+        self._added: List[Tuple[str, str, str]] = []    # все добавленные с начала последнего fit
+        self._base = 0                         # сколько строк было при fit
+        self._lock = threading.Lock()
+        self._building = False
+        self._stats = {"lookups": 0, "hits": 0, "added": 0, "refits": 0, "lookup_ms_total": 0.0}
+        self._schema_ready = False
+
+    def _con(self):
+        """
+        Соединение с bot.db. Файл лежит в репозитории и его же открывают
+        services/retriever*, поэтому режим журнала не меняем (wal=False),
+        а схему создаём при первом обращении, а не при импорте.
+        """
+        con = get_con(_QA_DB, wal=False)
+        if not self._schema_ready:
+            with con:
+                con.executescript(_SCHEMA)
+                cols = {r[1] for r in con.execute("PRAGMA table_info(qa_logs)")}
+                for col, sql in _MIGRATIONS:
+                    if col not in cols:
+                        con.execute(sql)
+            self._schema_ready = True
+        return con
+
+    # ---------- индекс ----------
+    def _fit(self):
+        with self._lock:
+            mark = len(self._added)  # всё, что добавлено до этой точки, уже есть в БД
+        with self._con() as con:
+            rows = con.execute(
+                "SELECT query, response, engine FROM qa_logs"
+                " WHERE ok=1 AND query IS NOT NULL AND response IS NOT NULL AND engine IS NOT NULL"
+                " ORDER BY id DESC LIMIT ?", (_LOAD_LIMIT,)
+            ).fetchall()
+        rows = [r for r in rows if _cacheable(r[0], r[1])]
+        queries = [normalize(q) for q, _, _ in rows]
+        vec, matrix = None, None
+        if queries:
+            vec = retriever_tfidf.make_vectorizer()
+            matrix = vec.fit_transform(queries).tocsr()
+        with self._lock:
+            # то, что добавили во время fit, дольётся в новую матрицу при следующем поиске
+            self._added = self._added[mark:]
+            self._pending = list(self._added)
+            self._pending_since = time.monotonic()
+            self._vec, self._matrix = vec, matrix
+            self._answers = [a for _, a, _ in rows]
+            self._engines = np.array([e for _, _, e in rows], dtype=object)
+            self._base = len(rows)
+            self._stats["refits"] += 1
+        log.info("[semantic_cache] indexed %d answers", len(rows))
+
+    async def _rebuild(self):
+        try:
+            await asyncio.to_thread(self._fit)
+        except Exception as e:
+            log.exception("[semantic_cache] build failed: %s", e)
+        finally:
+            self._building = False
+
+    def _schedule_rebuild(self):
+        if self._building:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._building = True
+        loop.create_task(self._rebuild())
+
+    def _merge_pending(self):
+        """Дописывает накопившиеся ответы к матрице по текущему словарю (пачкой)."""
+        with self._lock:
+            if not self._pending or self._vec is None:
+                return
+            if len(self._pending) < _MERGE_BATCH and time.monotonic() - self._pending_since < _MERGE_SEC:
+                return
+            pending, self._pending = self._pending, []
+            rows = self._vec.transform([normalize(q) for q, _, _ in pending])
+            self._matrix = sparse.vstack([self._matrix, rows], format="csr")
+            self._answers.extend(a for _, a, _ in pending)
+            self._engines = np.concatenate([self._engines, np.array([e for _, _, e in pending], dtype=object)])
+        if len(self._answers) - self._base > max(50, self._base * _REFIT_RATIO):
+            self._schedule_rebuild()
+
+    # ---------- API ----------
+    def lookup(self, query: str, engine: str) -> Optional[Tuple[str, float]]:
+        """(ответ движка engine, сходство) или None. Индекс строится в фоне при первом вызове."""
+        if not self.enabled or is_personal(query) or is_volatile(query) or _IDENTITY_RE.search(query):
+            return None
+        if self._vec is None and self._matrix is None and self._stats["refits"] == 0:
+            self._schedule_rebuild()
+            return None
+        t0 = time.perf_counter()
+        self._stats["lookups"] += 1
+        self._merge_pending()
+        vec, matrix, answers, engines = self._vec, self._matrix, self._answers, self._engines
+        if vec is None or matrix is None:
+            return None
+        q = vec.transform([normalize(query)])
+        if not q.nnz:
+            return None
+        sims = (matrix @ q.T).toarray().ravel()
+        sims[engines != engine] = -1.0  # ответы других движков не подходят
+        i = int(np.argmax(sims))
+        score = float(sims[i])
+        self._stats["lookup_ms_total"] += (time.perf_counter() - t0) * 1000
+        if score < self.threshold:
+            return None
+        self._stats["hits"] += 1
+        return answers[i], score
+
+    def add(self, query: str, response: str, engine: str):
+        if not self.enabled or not query or not response or not engine or not _cacheable(query, response):
+            return
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((query, response, engine))
+            self._added.append((query, response, engine))
+        self._stats["added"] += 1
+        if self._vec is None and self._stats["refits"]:
+            self._schedule_rebuild()  # индекс был пуст — словаря ещё нет
+
+    def log_qa(self, user_id: int, query: str, response: str, ok: Optional[int] = None,
+               engine: Optional[str] = None) -> Optional[int]:
+        """Пишет ответ в qa_logs; ok=1 сразу попадает в очередь кэша."""
+        if not self.enabled:
+            return None
+        with self._con() as con:
+            cur = con.execute(
+                "INSERT INTO qa_logs(user_id, query, response, ok, created_at, engine) VALUES(?,?,?,?,?,?)",
+                (user_id, query, response, ok, datetime.utcnow().isoformat(), engine),
+            )
+            qa_id = cur.lastrowid
+        if ok == 1:
+            self.add(query, response, engine)
+        return qa_id
+
+    def mark_ok(self, qa_id: int, ok: int = 1):
+        if not self.enabled:
+            return
+        with self._con() as con:
+            con.execute("UPDATE qa_logs SET ok=? WHERE id=?", (ok, qa_id))
+            row = con.execute("SELECT query, response, engine FROM qa_logs WHERE id=?", (qa_id,)).fetchone()
+        if ok == 1 and row:
+            self.add(row[0], row[1], row[2])
+
+    def stats(self) -> dict:
+        st = self._stats
+        return {
+            "enabled": self.enabled,
+            "size": len(self._answers) + len(self._pending),
+            "lookups": st["lookups"],
+            "hits": st["hits"],
+            "hit_rate": round(st["hits"] / st["lookups"], 3) if st["lookups"] else None,
+            "added": st["added"],
+            "refits": st["refits"],
+            "avg_lookup_ms": round(st["lookup_ms_total"] / st["lookups"], 3) if st["lookups"] else None,
+        }
+
+semantic_cache = SemanticCache()
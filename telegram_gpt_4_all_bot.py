@@ -13,21 +13,33 @@ Usage:
   4) Run: python telegram_gpt4all_bot.py
 
 Notes:
- - This script loads the GPT4All model once at startup and serializes access with a lock to
-   avoid concurrent generate() calls colliding.
- - The code uses run_in_executor to avoid blocking asyncio event loop while generating.
+ - Every chat gets its own warm GPT4All chat session (SessionManager below): the model keeps
+   the conversation in its context, so a new message only ingests the new text instead of
+   re-reading the whole prompt. Sessions live in an LRU bounded by GPT4ALL_SESSIONS_MB
+   (each is its own GPT4All instance: about the model file size plus the KV cache for
+   GPT4ALL_N_CTX tokens, or GPT4ALL_SESSION_MB if set), the least recently used one is
+   recycled for a new chat, idle ones are closed after GPT4ALL_SESSION_IDLE_SEC.
+   A session is used by one generate() at a time.
+ - Generation runs in the bounded "gpt4all" thread pool (utils/executors) so it never blocks
+   the event loop; the pool gets one thread per session, so different chats generate in
+   parallel. When the pool queue is full the user gets a "busy" reply right away.
  - Keep your bot token secret. If you accidentally posted it anywhere public, revoke/regenerate it in BotFather immediately.
 
 """
 
 import os
-import asyncio
 import logging
 import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
 from gpt4all import GPT4All
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
 
+from utils import executors
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -35,38 +47,207 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 MODEL_PATH = os.getenv("MODEL_PATH", r"D:\telegram_reminder_bot\models\orca-mini-3b-gguf2-q4_0.gguf")
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "512"))
+# Per-chat sessions: memory budget, cost of one session (0 = estimate from the model file and
+# context size), context length, KV cache per 1024 tokens in MB (f16: ~330 for 3B, ~520 for 7B),
+# idle timeout, turns before a reset
+SESSIONS_MB = int(os.getenv("GPT4ALL_SESSIONS_MB", "8192"))
+SESSION_MB = int(os.getenv("GPT4ALL_SESSION_MB", "0"))
+N_CTX = int(os.getenv("GPT4ALL_N_CTX", "2048"))
+KV_MB_PER_1K = int(os.getenv("GPT4ALL_KV_MB_PER_1K", "340"))
+SESSION_IDLE_SEC = float(os.getenv("GPT4ALL_SESSION_IDLE_SEC", "900"))
+SESSION_MAX_TURNS = int(os.getenv("GPT4ALL_SESSION_MAX_TURNS", "30"))
 
 if not TELEGRAM_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN environment variable not set. Set it and restart the bot.")
 
-# Global model and lock
-MODEL = None
-MODEL_LOCK = threading.Lock()
+def estimate_session_mb(path: str) -> int:
+    """Memory of one GPT4All instance: weights (the file size) + KV cache + ~10% for buffers."""
+    if SESSION_MB > 0:
+        return SESSION_MB
+    try:
+        file_mb = os.path.getsize(path) >> 20
+    except OSError:
+        file_mb = 2048  # not downloaded yet: assume a 3B q4 model
+    return int((file_mb + N_CTX * KV_MB_PER_1K // 1024) * 1.1)
+
+
+class _Session:
+    """One chat's GPT4All instance with an open chat_session()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()  # one generate() per session
+        self.model: Optional[GPT4All] = None
+        self.ctx = None               # the entered chat_session() context manager
+        self.turns = 0
+        self.last_used = time.monotonic()
+        self.closed = False
 
 
-def load_model(path: str):
-    """Load GPT4All model (only once).
-    We keep the GPT4All instance in a global variable.
+class SessionManager:
+    """Warm per-chat chat sessions in an LRU bounded by a memory budget.
+
+    The budget is turned into a number of sessions (budget / per-session estimate).
+    A new chat takes a spare model, or loads a new instance while under the budget, or
+    recycles the least recently used idle session; if all are busy, executors.Overloaded.
     """
-    global MODEL
-    if MODEL is None:
-        logger.info("Loading GPT4All model from: %s", path)
-        MODEL = GPT4All(path)
+
+    def __init__(self, path: str, budget_mb: int = SESSIONS_MB, session_mb: Optional[int] = None,
+                 idle_sec: float = SESSION_IDLE_SEC, max_turns: int = SESSION_MAX_TURNS):
+        self.path = path
+        self.session_mb = session_mb or estimate_session_mb(path)
+        self.capacity = max(1, budget_mb // max(1, self.session_mb))
+        self.idle_sec = idle_sec
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[int, _Session]" = OrderedDict()
+        self._spare: List[GPT4All] = []  # loaded models without a chat (count against capacity)
+        self._lock = threading.Lock()    # guards _sessions/_spare only, never held during generate()
+        self.hits = 0
+        self.opened = 0
+        self.recycled = 0
+        self.evicted_idle = 0
+
+    def preload(self):
+        """Load one model at startup so the first chat doesn't wait for it."""
+        with self._lock:
+            if self._sessions or self._spare:
+                return
+        model = self._load()
+        with self._lock:
+            self._spare.append(model)
+
+    def _load(self) -> GPT4All:
+        logger.info("Loading GPT4All model from: %s", self.path)
+        model = GPT4All(self.path, n_ctx=N_CTX)
         logger.info("Model loaded.")
-    return MODEL
+        return model
+
+    @staticmethod
+    def _end_chat(s: _Session):
+        if s.ctx is not None:
+            s.ctx.__exit__(None, None, None)
+            s.ctx = None
 
+    @staticmethod
+    def _free(model: GPT4All):
+        close = getattr(model, "close", None)
+        if close:
+            close()
 
-def generate_response(prompt: str) -> str:
-    """Blocking generation call. Use run_in_executor to call from async code.
+    def _take_lru_idle(self) -> Optional[_Session]:
+        """Detach the least recently used session that is not generating right now."""
+        for chat_id, s in self._sessions.items():
+            if s.lock.acquire(blocking=False):
+                del self._sessions[chat_id]
+                s.closed = True
+                return s
+        return None
 
-    We use a lock to avoid concurrent generate() calls on the same model instance.
+    def _sweep(self) -> List[GPT4All]:
+        """Close sessions idle longer than idle_sec; returns models to free outside the lock."""
+        now = time.monotonic()
+        to_free = []
+        for chat_id, s in list(self._sessions.items()):
+            if now - s.last_used < self.idle_sec:
+                break  # OrderedDict is in LRU order
+            if not s.lock.acquire(blocking=False):
+                continue
+            try:
+                del self._sessions[chat_id]
+                s.closed = True
+                self._end_chat(s)
+                if s.model is not None:
+                    # one loaded model stays as spare, so the next chat skips the load
+                    (to_free if self._spare else self._spare).append(s.model)
+                s.model = None
+                self.evicted_idle += 1
+            finally:
+                s.lock.release()
+        return to_free
+
+    def _get(self, chat_id: int) -> _Session:
+        """Session of the chat, reserving a model for it if it has none yet."""
+        with self._lock:
+            to_free = self._sweep()
+            s = self._sessions.get(chat_id)
+            if s is not None:
+                self._sessions.move_to_end(chat_id)
+                self.hits += 1
+            else:
+                s = _Session()
+                if self._spare:
+                    s.model = self._spare.pop()
+                elif len(self._sessions) >= self.capacity:
+                    old = self._take_lru_idle()
+                    if old is None:
+                        raise executors.Overloaded(f"gpt4all: all {self.capacity} sessions are busy")
+                    try:
+                        self._end_chat(old)  # before the new chat can see this model
+                    finally:
+                        old.lock.release()
+                    s.model, old.model = old.model, None
+                    self.recycled += 1
+                self._sessions[chat_id] = s
+                self.opened += 1
+        for model in to_free:
+            self._free(model)
+        return s
+
+    def generate(self, chat_id: int, prompt: str, max_tokens: int = MAX_TOKENS) -> str:
+        """Blocking; run it in the "gpt4all" executor."""
+        while True:
+            s = self._get(chat_id)
+            with s.lock:
+                if s.closed:  # evicted between _get() and here
+                    continue
+                try:
+                    if s.model is None:
+                        s.model = self._load()
+                    if s.ctx is not None and s.turns >= self.max_turns:
+                        self._end_chat(s)  # context is full of old turns: start over
+                    if s.ctx is None:
+                        s.ctx = s.model.chat_session()
+                        s.ctx.__enter__()
+                        s.turns = 0
+                    reply = s.model.generate(prompt, max_tokens=max_tokens)
+                    s.turns += 1
+                except Exception:
+                    # the session's context is in an unknown state — next message starts a fresh one
+                    try:
+                        self._end_chat(s)
+                    except Exception:
+                        s.ctx = None
+                    raise
+                finally:
+                    s.last_used = time.monotonic()
+                return reply
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "spare": len(self._spare),
+                "capacity": self.capacity,
+                "session_mb": self.session_mb,
+                "hits": self.hits,
+                "opened": self.opened,
+                "recycled": self.recycled,
+                "evicted_idle": self.evicted_idle,
+            }
+
+
+SESSIONS = SessionManager(MODEL_PATH)
+# one pool thread per session: warm chats generate in parallel, a second message of the same
+# chat waits for its session's lock (EXECUTOR_SIZES=gpt4all=... still wins)
+executors.configure("gpt4all", SESSIONS.capacity, max(4, SESSIONS.capacity))
+
+
+def generate_response(chat_id: int, text: str) -> str:
+    """Blocking generation call. Use executors.run("gpt4all", ...) to call from async code.
+
+    The user's text goes as is to the chat's own warm session, which already holds the earlier
+    turns and wraps each one in the model's chat template.
     """
-    model = load_model(MODEL_PATH)
-    with MODEL_LOCK:
-        # open a chat session for nicer assistant-style behavior
-        with model.chat_session():
-            # You can tweak parameters here (max_tokens, temperature, etc.)
-            reply = model.generate(prompt, max_tokens=MAX_TOKENS)
+    reply = SESSIONS.generate(chat_id, text)
     # Ensure reply is a str
     return reply if isinstance(reply, str) else str(reply)
 
@@ -81,13 +262,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     logger.info("Message from %s (%s): %s", user.username or user.id, chat_id, text)
 
-    # Very short messages can be answered with a quick prompt
-    prompt = f"Пользователь: {text}\nАссистент:" 
-
-    loop = asyncio.get_running_loop()
+    # the chat's session applies the model's chat template itself: send the bare text,
+    # role prefixes here would end up in the context twice on every turn
     try:
-        # run blocking generation in default ThreadPoolExecutor
-        reply = await loop.run_in_executor(None, generate_response, prompt)
+        # run blocking generation in the dedicated gpt4all pool
+        reply = await executors.run("gpt4all", generate_response, chat_id, text)
+    except executors.Overloaded:
+        await update.message.reply_text("Модель сейчас занята, попробуй через минуту.")
+        return
     except Exception as e:
         logger.exception("Error during generation: %s", e)
         await update.message.reply_text("Ошибка при генерации ответа: %s" % str(e))
@@ -101,12 +283,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def health_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Bot is running. Model path: %s" % MODEL_PATH)
+    await update.message.reply_text("Bot is running. Model path: %s\nSessions: %s" % (MODEL_PATH, SESSIONS.stats()))
 
 
 def main():
     # load model in main thread (so startup cost occurs once)
-    load_model(MODEL_PATH)
+    SESSIONS.preload()
 
     app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
 
@@ -0,0 +1,70 @@
+# utils/aio_bridge.py
+"""
+Синхронный итератор (стрим SDK) -> async-генератор.
+
+Итератор крутится в отдельном потоке, элементы идут в event loop через
+ограниченную asyncio.Queue: если потребитель (редактирование сообщения)
+отстаёт, поток-производитель ждёт, а не копит весь ответ в памяти.
+Если потребитель бросил генератор (таймаут, досрочная остановка), поток
+закрывает итератор при следующей попытке положить элемент.
+Поток берётся из именованного пула utils/executors (поток занят весь стрим).
+"""
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+from utils import executors
+
+T = TypeVar("T")
+
+_DONE = object()
+
+async def iterate_in_thread(make_iter: Callable[[], Iterator[T]], maxsize: int = 64,
+                            executor: Optional[str] = None) -> AsyncIterator[T]:
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue(maxsize)
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        if stop.is_set():
+            return False
+        asyncio.run_coroutine_threadsafe(q.put(item), loop).result()
+        return not stop.is_set()
+
+    def _produce():
+        it = None
+        try:
+            it = make_iter()
+            for item in it:
+                if not _put(item):
+                    break
+            _put(_DONE)
+        except BaseException as e:  # ошибку SDK пробрасываем потребителю
+            _put(e)
+        finally:
+            close = getattr(it, "close", None)
+            if close:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+    # пул переполнен — executors.Overloaded уходит потребителю сразу
+    fut = executors.submit(executor, _produce) if executor else loop.run_in_executor(None, _produce)
+    try:
+        while True:
+            item = await q.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # освобождаем производителя, если он ждёт места в очереди
+        while not q.empty():
+            q.get_nowait()
+        if fut.done():
+            fut.exception()
+        else:
+            fut.add_done_callback(lambda f: f.exception())
@@ -0,0 +1,169 @@
+# utils/breaker.py
+"""
+Общий circuit breaker и «здоровье» ИИ-провайдеров
+(gemini, cerebras, mistral, локальные llama/gpt4all).
+
+На каждого провайдера — скользящее окно BREAKER_WINDOW_SEC: успехи, ошибки,
+задержки. Размыкаемся (open), когда в окне >= BREAKER_MIN_CALLS вызовов и
+доля ошибок >= BREAKER_ERROR_RATE, а на 429/capacity — сразу (на retry_after
+или cooldown). Пока open — allow() = False, вызывающий отвечает мгновенно.
+После cooldown пропускаем один пробный вызов (half_open): успех замыкает,
+ошибка снова размыкает с удвоенным cooldown (до BREAKER_MAX_COOLDOWN_SEC).
+Вызов дольше BREAKER_SLOW_SEC считается ошибкой.
+
+Каждый allow() == True должен закончиться record() или release(): отменённый
+вызов (хедж, таймаут потребителя), перегруженный пул, брошенный стрим — это
+не вердикт о провайдере, release() просто освобождает пробу. Если итог так и
+не пришёл, проба освобождается сама через BREAKER_PROBE_TIMEOUT_SEC.
+
+healthiest(names) — провайдер с лучшим score (ошибки + медиана задержки).
+"""
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from config import (
+    BREAKER_COOLDOWN_SEC, BREAKER_ERROR_RATE, BREAKER_MAX_COOLDOWN_SEC, BREAKER_MIN_CALLS,
+    BREAKER_PROBE_TIMEOUT_SEC, BREAKER_SLOW_SEC, BREAKER_WINDOW_SEC,
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_RATE_LIMIT_RE = re.compile(r"\b429\b|too many requests|rate.?limit|capacity|quota|resource.?exhausted", re.I)
+
+def is_rate_limit(err) -> bool:
+    """Исключение или текст ошибки похож на 429/перегрузку провайдера."""
+    return bool(err) and bool(_RATE_LIMIT_RE.search(str(err)))
+
+class CircuitBreaker:
+    def __init__(self, name: str, cooldown: float = BREAKER_COOLDOWN_SEC):
+        self.name = name
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.open_until = 0.0
+        self._probe = False
+        self._probe_at = 0.0
+        self._calls: Deque[Tuple[float, bool, float]] = deque()  # (ts, ok, latency)
+        self._lock = threading.Lock()  # record() зовут и из потоков (to_thread)
+        self.opened = 0
+        self.rejected = 0
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > BREAKER_WINDOW_SEC:
+            self._calls.popleft()
+
+    def _open(self, now: float, for_sec: Optional[float] = None):
+        self.state = OPEN
+        self.open_until = now + (for_sec if for_sec else self.cooldown)
+        self._probe = False
+        self.opened += 1
+
+    def _probe_free(self, now: float) -> bool:
+        return not self._probe or now - self._probe_at >= BREAKER_PROBE_TIMEOUT_SEC
+
+    def available(self) -> bool:
+        """Без побочных эффектов: можно ли сейчас звать провайдера."""
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now >= self.open_until
+        return self._probe_free(now)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.open_until:
+                self.state = HALF_OPEN
+                self._probe = False
+            if self.state == HALF_OPEN and self._probe_free(now):
+                self._probe = True  # ровно один пробный вызов
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """Вызов после allow() закончился без вердикта (отмена, перегрузка) — освободить пробу."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe = False
+
+    def record(self, ok: bool, latency: float = 0.0, err=None, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        if ok and latency > BREAKER_SLOW_SEC:
+            ok = False
+        with self._lock:
+            self._calls.append((now, ok, latency))
+            self._prune(now)
+            if self.state == HALF_OPEN:
+                if ok:
+                    self.state = CLOSED
+                    self.cooldown = self.base_cooldown
+                    self._calls.clear()
+                else:
+                    self.cooldown = min(BREAKER_MAX_COOLDOWN_SEC, self.cooldown * 2)
+                    self._open(now, retry_after)
+                return
+            if ok or self.state == OPEN:
+                return
+            if retry_after or is_rate_limit(err):
+                self._open(now, retry_after)
+                return
+            fails = sum(1 for _, good, _ in self._calls if not good)
+            if len(self._calls) >= BREAKER_MIN_CALLS and fails / len(self._calls) >= BREAKER_ERROR_RATE:
+                self._open(now)
+
+    def _window(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = list(self._calls)
+        errors = sum(1 for _, ok, _ in calls if not ok)
+        lat = sorted(l for _, ok, l in calls if ok)
+        p50 = lat[len(lat) // 2] if lat else None
+        return len(calls), errors, p50
+
+    def score(self) -> float:
+        """Меньше — лучше; разомкнутый — бесконечность."""
+        if not self.available():
+            return float("inf")
+        n, errors, p50 = self._window()
+        err_rate = errors / n if n else 0.0
+        return err_rate * 100 + (p50 if p50 is not None else 0.0)
+
+    def snapshot(self) -> dict:
+        n, errors, p50 = self._window()
+        left = self.open_until - time.monotonic()
+        return {
+            "state": self.state,
+            "calls": n,
+            "error_rate": round(errors / n, 3) if n else None,
+            "p50_s": round(p50, 3) if p50 is not None else None,
+            "open_for_s": round(left, 1) if self.state == OPEN and left > 0 else 0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def breaker(name: str, **kwargs) -> CircuitBreaker:
+    b = _breakers.get(name)
+    if b is None:
+        b = _breakers[name] = CircuitBreaker(name, **kwargs)
+    return b
+
+def healthiest(names: Iterable[str], prefer: Optional[str] = None) -> Optional[str]:
+    """Самый здоровый из names; при равенстве — prefer (или первый)."""
+    names = list(names)
+    if not names:
+        return None
+    best = min(names, key=lambda n: (breaker(n).score(), n != prefer))
+    return best
+
+def stats() -> dict:
+    return {name: b.snapshot() for name, b in sorted(_breakers.items())}
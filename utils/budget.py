@@ -0,0 +1,70 @@
+# utils/budget.py
+"""
+Бюджет длины ответа ИИ.
+
+Раньше у провайдера просили до 2000 токенов, а показывали _smart_trim до
+max_len (600) символов — генерацию примерно втрое длиннее нужной оплачивали
+и ждали. Теперь:
+- token_budget(max_len, allow_long) — потолок токенов для провайдера;
+- clean_reply(text, allow_long, max_len) — чистка и обрезка ответа любого движка;
+- enough(text, max_len) — дальше стрим можно закрывать: smart_trim зависит
+  только от первых max_len символов, новые токены результат не изменят;
+- record(...) — сколько токенов сэкономлено относительно прежнего потолка.
+"""
+import logging
+import math
+import re
+from typing import Dict, Optional
+
+from config import LLM_CHARS_PER_TOKEN, LLM_LONG_MAX_TOKENS
+
+log = logging.getLogger("budget")
+
+_MARGIN = 32  # на разметку/пробелы и чтобы фраза успела закончиться
+
+def smart_trim(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    for sep in (". ", "! ", "? ", "\n", " "):
+        p = cut.rfind(sep)
+        if p >= int(limit * 0.6):
+            return cut[:p+1].rstrip()
+    return cut.rstrip() + "…"
+
+def clean_reply(text: str, allow_long: bool, max_len: int) -> str:
+    """Срезает префиксы вида «assistant:» и, если не просили подробно, обрезает до max_len."""
+    out = re.sub(r"^(?:model|assistant)\s*:\s*", "", (text or "").strip(), flags=re.I).strip()
+    return out if allow_long else smart_trim(out, max_len)
+
+def token_budget(max_len: int, allow_long: bool) -> int:
+    if allow_long or not max_len:
+        return LLM_LONG_MAX_TOKENS
+    return min(LLM_LONG_MAX_TOKENS, math.ceil(max_len / LLM_CHARS_PER_TOKEN * 1.3) + _MARGIN)
+
+def enough(text: str, max_len: Optional[int]) -> bool:
+    return bool(max_len) and len(text) > max_len
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / LLM_CHARS_PER_TOKEN)
+
+_stats: Dict[str, Dict[str, int]] = {}
+
+def record(provider: str, budget: int, used: Optional[int], text: str, early: bool):
+    """used — completion tokens от провайдера (если он их вернул), иначе оценка по тексту."""
+    if used is None:
+        used = estimate_tokens(text)
+    saved = max(0, LLM_LONG_MAX_TOKENS - used)
+    st = _stats.setdefault(provider, {"requests": 0, "early_stops": 0, "tokens_used": 0, "tokens_saved": 0})
+    st["requests"] += 1
+    st["early_stops"] += int(early)
+    st["tokens_used"] += used
+    st["tokens_saved"] += saved
+    log.debug("[budget] %s budget=%d used=%d saved=%d early=%s", provider, budget, used, saved, early)
+
+def stats() -> dict:
+    out = {}
+    for provider, st in _stats.items():
+        n = st["requests"] or 1
+        out[provider] = dict(st, avg_used=round(st["tokens_used"] / n, 1), avg_saved=round(st["tokens_saved"] / n, 1))
+    return {"legacy_max_tokens": LLM_LONG_MAX_TOKENS, "providers": out}
@@ -1,7 +1,13 @@
 # utils/chat_settings.py
-import sqlite3
-from typing import Optional
-from config import DB_PATH
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Set, Tuple
+from config import DB_PATH, SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_PEERS, WEBHOOK_SECRET
+from utils.db import get_con
+
+log = logging.getLogger("chat_settings")
 
 _SCHEMA = """
 CREATE TABLE IF NOT EXISTS chat_settings (
@@ -13,14 +19,90 @@ CREATE TABLE IF NOT EXISTS chat_settings (
 """
 
 class ChatSettings:
-    def __init__(self, path: str):
+    """
+    Настройки чата с LRU-кэшем (read-through, write-through).
+
+    Оба поля читаются одной строкой; set_* обновляют кэш сразу после записи.
+    Для нескольких реплик: publish(chat_id) после set_* шлёт POST /cache/invalidate
+    репликам из SETTINGS_PEERS (с WEBHOOK_SECRET), там invalidate(chat_id)
+    применяет изменение; TTL ограничивает устаревание, если сообщение не дошло.
+    """
+    def __init__(self, path: str, cache_size: int = SETTINGS_CACHE_SIZE, ttl: float = SETTINGS_CACHE_TTL):
         self.path = path
-        with sqlite3.connect(self.path) as con:
+        self.cache_size = cache_size
+        self.ttl = ttl
+        # chat_id -> (ai_engine | None, language, loaded_at)
+        self._cache: "OrderedDict[int, Tuple[Optional[str], str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._tasks: Set[asyncio.Task] = set()
+        with self._con() as con:
             con.executescript(_SCHEMA)
 
     def _con(self):
-        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        return get_con(self.path)
+
+    # ---------- кэш ----------
+    def _put(self, chat_id: int, ai: Optional[str], lang: str):
+        self._cache[chat_id] = (ai, lang, time.monotonic())
+        self._cache.move_to_end(chat_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _row(self, chat_id: int) -> Tuple[Optional[str], str]:
+        ent = self._cache.get(chat_id)
+        if ent is not None and (self.ttl <= 0 or time.monotonic() - ent[2] < self.ttl):
+            self._cache.move_to_end(chat_id)
+            self.hits += 1
+            return ent[0], ent[1]
+        self.misses += 1
+        with self._con() as con:
+            cur = con.execute("SELECT ai_engine, language FROM chat_settings WHERE chat_id=?", (chat_id,))
+            row = cur.fetchone()
+        ai, lang = (row[0], row[1]) if row else (None, "ru")
+        self._put(chat_id, ai, lang)
+        return ai, lang
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        """Сбросить запись чата (или весь кэш, если chat_id=None)."""
+        if chat_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(chat_id, None)
 
+    def publish(self, chat_id: int):
+        """Сообщить другим репликам об изменении настроек чата (в фоне, из event loop)."""
+        if not SETTINGS_PEERS or not WEBHOOK_SECRET:
+            return
+        task = asyncio.create_task(self._notify_peers(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _notify_peers(chat_id: int):
+        import aiohttp
+        headers = {"X-Webhook-Secret": WEBHOOK_SECRET}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            async def one(base: str):
+                try:
+                    async with session.post(f"{base}/cache/invalidate", data={"chat_id": str(chat_id)},
+                                            headers=headers) as resp:
+                        if resp.status != 200:
+                            log.warning("[chat_settings] %s: invalidate -> HTTP %s", base, resp.status)
+                except Exception as e:
+                    log.warning("[chat_settings] %s: invalidate failed: %s", base, e)
+            await asyncio.gather(*(one(base) for base in SETTINGS_PEERS))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+    # ---------- API ----------
     def set_ai(self, chat_id: int, ai: str):
         ai = ai.lower().strip()
         if ai not in ("cerebras","gemini"):
@@ -30,12 +112,12 @@ class ChatSettings:
                 INSERT INTO chat_settings(chat_id, ai_engine) VALUES(?,?)
                 ON CONFLICT(chat_id) DO UPDATE SET ai_engine=excluded.ai_engine, updated_at=CURRENT_TIMESTAMP
             """, (chat_id, ai))
+        ent = self._cache.get(chat_id)
+        if ent is not None:
+            self._put(chat_id, ai, ent[1])
 
     def get_ai(self, chat_id: int) -> Optional[str]:
-        with self._con() as con:
-            cur = con.execute("SELECT ai_engine FROM chat_settings WHERE chat_id=?", (chat_id,))
-            row = cur.fetchone()
-            return row[0] if row else None
+        return self._row(chat_id)[0]
 
     def set_lang(self, chat_id: int, lang: str):
         lang = "uk" if (lang or "").lower().startswith("uk") else "ru"
@@ -44,11 +126,13 @@ class ChatSettings:
                 INSERT INTO chat_settings(chat_id, language) VALUES(?,?)
                 ON CONFLICT(chat_id) DO UPDATE SET language=excluded.language, updated_at=CURRENT_TIMESTAMP
             """, (chat_id, lang))
+        ent = self._cache.get(chat_id)
+        if ent is not None and ent[0] is not None:
+            self._put(chat_id, ent[0], lang)
+        else:
+            self._cache.pop(chat_id, None)  # строки не было — ai_engine взял DEFAULT из схемы
 
     def get_lang(self, chat_id: int) -> str:
-        with self._con() as con:
-            cur = con.execute("SELECT language FROM chat_settings WHERE chat_id=?", (chat_id,))
-            row = cur.fetchone()
-            return (row[0] if row else "ru")
+        return self._row(chat_id)[1]
 
 chat_settings = ChatSettings(DB_PATH)
@@ -0,0 +1,146 @@
+# utils/coalesce.py
+"""
+Склейка «очередей» сообщений одного чата перед вызовом ИИ.
+
+Мысль часто приходит тремя-четырьмя сообщениями подряд. Раньше каждое шло
+отдельным запросом к движку, ответы обгоняли друг друга и писали ходы в
+memory вперемешку. Теперь на чат:
+
+- первое сообщение ждёт window секунд тишины (но не дольше max_wait);
+- всё, что пришло за это время или пока готовится предыдущий ответ,
+  дописывается к нему — обработчик таких сообщений просто выходит;
+- к движку одновременно идёт не больше одного запроса от чата;
+- если «лидера» отменили, пока он собирал сообщения, чужие тексты не
+  теряются: их забирает новый лидер — resume последнего дописавшегося.
+
+    async with coalescer.turn(chat_id, text, resume=partial(answer, message)) as merged:
+        if merged is None:
+            return  # сообщение ушло в чужой запрос
+        await answer(message, merged)
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from config import COALESCE_MAX_WAIT_SEC, COALESCE_WINDOW_SEC
+
+log = logging.getLogger("coalesce")
+
+Resume = Callable[[str], Awaitable[None]]
+
+class _Slot:
+    __slots__ = ("lock", "texts", "collecting", "arrived", "resume")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()   # один запрос к движку на чат
+        self.texts: List[str] = []
+        self.collecting = False      # есть «лидер», который заберёт texts
+        self.arrived = asyncio.Event()
+        self.resume: Optional[Resume] = None  # как ответить за дописавшихся, если лидер отменён
+
+class Coalescer:
+    def __init__(self, window: float = COALESCE_WINDOW_SEC, max_wait: float = COALESCE_MAX_WAIT_SEC):
+        self.window = window
+        self.max_wait = max_wait
+        self._chats: Dict[int, _Slot] = {}
+        self.turns = 0
+        self.merged = 0
+        self.inherited = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _gc(self, chat_id: int, s: _Slot):
+        if not s.lock.locked() and not s.collecting and not s.texts and self._chats.get(chat_id) is s:
+            del self._chats[chat_id]
+
+    async def _debounce(self, s: _Slot):
+        if self.window <= 0:
+            return
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            left = min(self.window, deadline - time.monotonic())
+            if left <= 0:
+                return
+            s.arrived.clear()
+            try:
+                await asyncio.wait_for(s.arrived.wait(), timeout=left)
+            except asyncio.TimeoutError:
+                return
+
+    def _take(self, s: _Slot) -> str:
+        texts, s.texts = s.texts, []
+        s.collecting = False
+        s.resume = None
+        self.turns += 1
+        return "\n".join(texts)
+
+    def _abandon(self, chat_id: int, s: _Slot, own: int):
+        """Лидер отменён: свой текст убираем, дописанное другими передаём новому лидеру."""
+        del s.texts[own]
+        if s.texts and s.resume is not None:
+            task = asyncio.create_task(self._inherit(chat_id, s))  # collecting остаётся за ним
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+        # ответить за оставшиеся некому — их заберёт следующее сообщение чата
+        s.collecting = False
+        self._gc(chat_id, s)
+
+    async def _inherit(self, chat_id: int, s: _Slot):
+        self.inherited += 1
+        try:
+            await s.lock.acquire()
+        except BaseException:
+            s.collecting = False
+            self._gc(chat_id, s)
+            raise
+        try:
+            resume = s.resume
+            await resume(self._take(s))
+        except Exception as e:
+            log.exception("[coalesce] inherited turn failed chat=%s: %s", chat_id, e)
+        finally:
+            s.lock.release()
+            self._gc(chat_id, s)
+
+    @asynccontextmanager
+    async def turn(self, chat_id: int, text: str,
+                   resume: Optional[Resume] = None) -> AsyncIterator[Optional[str]]:
+        """resume(merged) — чем ответить за это сообщение, если его лидера отменят."""
+        s = self._chats.get(chat_id)
+        if s is None:
+            s = self._chats[chat_id] = _Slot()
+        s.texts.append(text)
+        if s.collecting:
+            self.merged += 1
+            if resume is not None:
+                s.resume = resume  # отвечать — на последнее сообщение
+            s.arrived.set()
+            yield None
+            return
+        own = len(s.texts) - 1
+        s.collecting = True
+        try:
+            await self._debounce(s)
+            await s.lock.acquire()  # пока ждём предыдущий ответ, новые сообщения копятся здесь же
+        except BaseException:
+            self._abandon(chat_id, s, own)
+            raise
+        merged = self._take(s)
+        try:
+            yield merged
+        finally:
+            s.lock.release()
+            self._gc(chat_id, s)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "turns": self.turns,
+            "merged": self.merged,
+            "inherited": self.inherited,
+            "window_s": self.window,
+        }
+
+coalescer = Coalescer()
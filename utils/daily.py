@@ -1,8 +1,8 @@
 # utils/daily.py
-import sqlite3
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from config import DB_PATH
+from utils.db import get_con
 
 # ВАЖНО: тройные "простые" кавычки ''' или """ — без «умных» кавычек.
 _SCHEMA = """
@@ -18,7 +18,7 @@ CREATE INDEX IF NOT EXISTS idx_daily_user_chat ON daily_tasks(user_id, chat_id);
 """
 
 def _con():
-    return sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    return get_con(DB_PATH)
 
 # Создаём схему один раз при импорте
 with _con() as con:
@@ -45,6 +45,26 @@ def list(user_id: int, chat_id: int) -> List[Dict[str, Any]]:
         out.append({"id": r[0], "text": r[1], "done_today": (r[2] == today)})
     return out
 
+def list_page(user_id: int, chat_id: int, after_id: int = 0, limit: int = 10,
+              before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Keyset-пагинация по id (см. notes._page)."""
+    with _con() as con:
+        if before_id is not None:
+            cur = con.execute(
+                "SELECT id, text, last_done FROM daily_tasks WHERE user_id=? AND chat_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                (user_id, chat_id, before_id, limit),
+            )
+        else:
+            cur = con.execute(
+                "SELECT id, text, last_done FROM daily_tasks WHERE user_id=? AND chat_id=? AND id>? ORDER BY id ASC LIMIT ?",
+                (user_id, chat_id, after_id, limit),
+            )
+        rows = cur.fetchall()
+    if before_id is not None:
+        rows.reverse()
+    today = datetime.utcnow().date().isoformat()
+    return [{"id": r[0], "text": r[1], "done_today": (r[2] == today)} for r in rows]
+
 def mark_done(task_id: int):
     with _con() as con:
         con.execute("UPDATE daily_tasks SET last_done=DATE('now') WHERE id=?", (task_id,))
@@ -57,6 +77,7 @@ def delete(task_id: int):
 class _DailyFacade:
     add = staticmethod(add)
     list = staticmethod(list)
+    list_page = staticmethod(list_page)
     mark_done = staticmethod(mark_done)
     delete = staticmethod(delete)
 
@@ -0,0 +1,62 @@
+# utils/db.py
+"""
+Общий менеджер SQLite-соединений для notes / daily / chat_settings.
+
+Вместо sqlite3.connect() на каждый вызов держим одно долгоживущее соединение
+на (поток, путь к БД). При открытии включаем WAL (wal=False — не трогать режим
+журнала, например у закоммиченного bot.db), synchronous=NORMAL, mmap и
+кэш страниц; подготовленные выражения кэширует сам sqlite3 (cached_statements).
+
+Использование такое же, как раньше с sqlite3.connect:
+    with get_con(DB_PATH) as con:   # commit/rollback, соединение НЕ закрывается
+        con.execute(...)
+"""
+import os
+import sqlite3
+import threading
+from typing import Dict, Tuple
+
+from config import DB_BUSY_TIMEOUT, DB_CACHE_KB, DB_MMAP_MB, DB_STMT_CACHE
+
+_lock = threading.Lock()
+# (поток, путь) -> соединение; общий реестр, чтобы close_all() закрыл соединения
+# всех потоков (и пулов executors), а не только вызвавшего
+_cons: Dict[Tuple[int, str], sqlite3.Connection] = {}
+
+def _open(path: str, wal: bool) -> sqlite3.Connection:
+    con = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=DB_STMT_CACHE,
+    )
+    if wal:
+        # WAL — читатели не блокируют писателя, fsync только на checkpoint.
+        # Режим сохраняется в файле БД, поэтому для чужих файлов его можно не включать.
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA cache_size=-{int(DB_CACHE_KB)}")          # в KiB
+    con.execute(f"PRAGMA mmap_size={int(DB_MMAP_MB) * 1024 * 1024}")
+    con.execute("PRAGMA temp_store=MEMORY")
+    return con
+
+def get_con(path: str, wal: bool = True) -> sqlite3.Connection:
+    """Соединение текущего потока для path (создаётся при первом обращении)."""
+    key = (threading.get_ident(), os.path.abspath(path))
+    con = _cons.get(key)
+    if con is None:
+        con = _open(path, wal)
+        with _lock:
+            _cons[key] = con
+    return con
+
+def close_all() -> None:
+    """Закрыть все открытые соединения всех потоков (для shutdown)."""
+    with _lock:
+        cons = list(_cons.values())
+        _cons.clear()
+    for con in cons:
+        try:
+            con.close()
+        except Exception:
+            pass
@@ -0,0 +1,65 @@
+# utils/deadlines.py
+"""
+Адаптивные дедлайны вызовов по наблюдаемым задержкам (utils/latency).
+
+Вместо фиксированных 25 с: перцентиль DEADLINE_PERCENTILE недавних задержек
+вызова × DEADLINE_FACTOR, зажатый в [lo, hi]. Пока замеров мало — default.
+Дедлайн передаётся внутрь вызова (таймаут HTTP-запроса SDK, проверка в
+цикле стрима), чтобы работа действительно останавливалась, а не
+догенерировала в потоке после того, как пользователь получил «таймаут».
+"""
+import asyncio
+import time
+from typing import Awaitable, Dict, TypeVar
+
+from config import (
+    DEADLINE_DEFAULT_SEC, DEADLINE_FACTOR, DEADLINE_MAX_SEC, DEADLINE_MIN_SEC, DEADLINE_PERCENTILE,
+    TOOL_DEADLINE_MAX_SEC, TOOL_DEADLINE_MIN_SEC,
+)
+from utils.latency import tracker
+
+T = TypeVar("T")
+
+_MIN_SAMPLES = 20
+_last: Dict[str, float] = {}
+_expired: Dict[str, int] = {}
+
+def deadline_for(name: str, default: float = DEADLINE_DEFAULT_SEC,
+                 lo: float = DEADLINE_MIN_SEC, hi: float = DEADLINE_MAX_SEC) -> float:
+    """Секунды на вызов name."""
+    t = tracker(name)
+    if len(t) < _MIN_SAMPLES:
+        sec = min(default, hi)
+    else:
+        sec = min(hi, max(lo, t.percentile(DEADLINE_PERCENTILE) * DEADLINE_FACTOR))
+    _last[name] = sec
+    return sec
+
+def expired(name: str):
+    """Счётчик сработавших дедлайнов — для /debug/stats."""
+    _expired[name] = _expired.get(name, 0) + 1
+
+class ToolTimeout(asyncio.TimeoutError):
+    pass
+
+async def tool_call(name: str, aw: Awaitable[T]) -> T:
+    """
+    Внешний инструмент (погода/праздники/поиск) в пределах своего дедлайна.
+    aiohttp отменяется по-настоящему; по истечении — ToolTimeout с понятным текстом.
+    """
+    key = f"tool.{name}"
+    sec = deadline_for(key, TOOL_DEADLINE_MAX_SEC, TOOL_DEADLINE_MIN_SEC, TOOL_DEADLINE_MAX_SEC)
+    t0 = time.monotonic()
+    try:
+        res = await asyncio.wait_for(aw, timeout=sec)
+    except asyncio.TimeoutError:
+        expired(key)
+        raise ToolTimeout(f"сервис не ответил за {sec:.0f} с") from None
+    tracker(key).observe(time.monotonic() - t0)
+    return res
+
+def stats() -> dict:
+    return {
+        name: {"deadline_s": round(sec, 2), "expired": _expired.get(name, 0)}
+        for name, sec in sorted(_last.items())
+    }
@@ -0,0 +1,142 @@
+# utils/engines.py
+"""
+Единая точка вызова ИИ-движков (gemini / cerebras) с учётом задержек.
+
+ask()    — полный ответ; в utils/latency пишется время ответа движка;
+stream() — куски ответа; пишется время до первого куска (<engine>.ttft).
+Таймаут и отмена до ответа (проигравший в хедже) тоже пишутся — прошедшим
+временем: настоящая задержка не меньше, а без этих замеров медленный хвост
+выпадал бы из перцентиля, и хедж срабатывал бы всё раньше.
+Ошибки ask_* возвращают текстом — is_error_reply() их узнаёт.
+Каждый вызов проходит через circuit breaker провайдера (utils/breaker):
+пока он разомкнут, отвечаем сразу, не дожидаясь таймаута. Переполнение
+собственного пула (executors.Overloaded) — не сбой провайдера: слот breaker'а
+освобождается без вердикта, ask() отвечает «занят».
+Дедлайн (utils/deadlines) уходит внутрь вызова — в таймаут HTTP-запроса SDK
+и проверку в цикле стрима, — чтобы по истечении работа останавливалась.
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from config import CEREBRAS_API_KEY, GEMINI_API_KEY
+from utils import executors
+from utils.breaker import breaker, healthiest
+from utils.deadlines import deadline_for, expired
+from utils.gemini import ask_gemini, stream_gemini
+from utils.latency import tracker
+from utils.llm import ask_cerebras, stream_cerebras
+
+ENGINES = ("gemini", "cerebras")
+
+def normalize(engine: str) -> str:
+    engine = (engine or "gemini").strip().lower()
+    return engine if engine in ENGINES else "gemini"
+
+def available(engine: str) -> bool:
+    return bool(GEMINI_API_KEY if engine == "gemini" else CEREBRAS_API_KEY)
+
+def other(engine: str) -> str:
+    return "cerebras" if engine == "gemini" else "gemini"
+
+def is_error_reply(text: str) -> bool:
+    return not text or text.startswith(("⚠️", "❗"))
+
+def usable(engine: str) -> bool:
+    return available(engine) and breaker(engine).available()
+
+def pick(pinned: Optional[str]) -> str:
+    """Движок чата: закреплённый пользователем или самый здоровый из доступных."""
+    if pinned:
+        return normalize(pinned)
+    return healthiest([e for e in ENGINES if available(e)] or ["gemini"], prefer="gemini")
+
+def _busy(engine: str) -> str:
+    return f"{engine.capitalize()} сейчас перегружен запросами. Попробуй через минуту или смени движок: /ai"
+
+def _unavailable(engine: str) -> str:
+    return f"{engine.capitalize()} сейчас недоступен (много ошибок подряд). Попробуй позже или смени движок: /ai"
+
+def timeout_for(engine: str, streaming: bool = False) -> float:
+    """Дедлайн вызова движка: по p95 полного ответа (или полного стрима)."""
+    return deadline_for(f"{engine}.stream" if streaming else engine)
+
+async def ask(engine: str, history: List[Dict], allow_long: bool, max_len: int,
+              timeout: float = None) -> str:
+    b = breaker(engine)
+    if not b.allow():
+        return "⚠️ " + _unavailable(engine)
+    timeout = timeout or timeout_for(engine)
+    t0 = time.monotonic()
+    try:
+        if engine == "gemini":
+            call = ask_gemini(history=history, allow_long=allow_long, max_len=max_len, timeout=timeout)
+        else:
+            call = ask_cerebras(history=history, allow_long=allow_long, max_len=max_len, timeout=timeout)
+        # async-транспорт отменяется здесь; поток SDK остановит собственный таймаут
+        reply = await asyncio.wait_for(call, timeout=timeout)
+    except asyncio.TimeoutError:
+        expired(engine)
+        b.record(False, time.monotonic() - t0, err="timeout")
+        tracker(engine).observe(time.monotonic() - t0)
+        return f"⚠️ {engine.capitalize()} не ответил за {timeout:.0f} с. Попробуй ещё раз или смени движок: /ai"
+    except executors.Overloaded:
+        b.release()  # отказал наш пул, а не провайдер
+        return "⚠️ " + _busy(engine)
+    except asyncio.CancelledError:
+        b.release()  # отменили (хедж, потребитель) — о провайдере это ничего не говорит
+        tracker(engine).observe(time.monotonic() - t0)  # цензурированный замер: ответ был бы не раньше
+        raise
+    except Exception as e:
+        b.record(False, time.monotonic() - t0, err=e)
+        raise
+    latency = time.monotonic() - t0
+    ok = not is_error_reply(reply)
+    b.record(ok, latency, err=None if ok else reply)
+    if ok:
+        tracker(engine).observe(latency)
+    return reply
+
+async def stream(engine: str, history: List[Dict], max_tokens: int = None,
+                 timeout: float = None) -> AsyncIterator[str]:
+    """Общий дедлайн стрима держит потребитель (tg_stream); timeout здесь — таймаут чтения SDK."""
+    b = breaker(engine)
+    if not b.allow():
+        raise RuntimeError(_unavailable(engine))
+    timeout = timeout or timeout_for(engine, streaming=True)
+    t0 = time.monotonic()
+    if engine == "gemini":
+        deltas = stream_gemini(history, max_tokens=max_tokens, timeout=timeout)
+    else:
+        deltas = stream_cerebras(history, max_tokens=max_tokens, timeout=timeout)
+    first = True
+    verdict = False  # record() уже вызван
+    shed = False     # отказал наш пул — ни вердикта, ни замера
+    try:
+        async for d in deltas:
+            if first:
+                first = False
+                ttft = time.monotonic() - t0
+                b.record(True, ttft)  # здоровье стрима — по первому куску
+                verdict = True
+                tracker(f"{engine}.ttft").observe(ttft)
+            yield d
+        if first:  # стрим закончился, не дав ни куска
+            b.record(False, time.monotonic() - t0, err="empty stream")
+            verdict = True
+        else:
+            tracker(f"{engine}.stream").observe(time.monotonic() - t0)
+    except executors.Overloaded:
+        shed = True  # слот освободит finally
+        raise
+    except Exception as e:
+        if not verdict:
+            b.record(False, time.monotonic() - t0, err=e)
+            verdict = True
+        raise
+    finally:
+        if not verdict:
+            b.release()  # отмена/aclose до первого куска — без вердикта
+            if not shed:  # цензурированный замер: первый кусок пришёл бы не раньше
+                tracker(f"{engine}.ttft").observe(time.monotonic() - t0)
+        await deltas.aclose()
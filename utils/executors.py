@@ -0,0 +1,161 @@
+# utils/executors.py
+"""
+Именованные ограниченные пулы потоков для блокирующих вызовов SDK.
+
+Раньше все провайдеры шли в общий пул loop.run_in_executor(None, ...) /
+asyncio.to_thread: зависший провайдер занимал все потоки, и в очередь за
+ним вставала любая другая работа бота. Теперь у каждого свой пул:
+
+- run(name, fn, *args)    — await результата в пуле name;
+- submit(name, fn, *args) — то же, но сразу asyncio.Future (для стримов);
+- допуск: в работе + в очереди не больше workers + queue, сверх —
+  Overloaded сразу, без ожидания;
+- счётчики (в работе, в очереди, отказы, ожидание в очереди) — /debug/stats.
+
+Размеры по умолчанию — _DEFAULTS (или configure() от владельца пула, если
+размер зависит от его настроек), переопределяются EXECUTOR_SIZES
+("gemini=8:32,llama=1:4" — потоки:очередь).
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from config import EXECUTOR_SIZES
+from utils.latency import LatencyTracker
+
+log = logging.getLogger("executors")
+
+# name -> (потоков, мест в очереди)
+_DEFAULTS: Dict[str, Tuple[int, int]] = {
+    "gemini": (8, 32),
+    "cerebras": (8, 32),
+    "mistral": (2, 8),
+    "llama": (1, 4),
+    "gpt4all": (1, 4),
+    "retriever": (2, 16),
+}
+_FALLBACK = (4, 16)
+
+class Overloaded(RuntimeError):
+    """Пул и его очередь заняты — запрос отклонён без ожидания."""
+
+def _parse(spec: str) -> Dict[str, Tuple[int, int]]:
+    out = {}
+    for part in (spec or "").split(","):
+        name, _, size = part.partition("=")
+        if not name.strip() or not size:
+            continue
+        workers, _, queue = size.partition(":")
+        try:
+            out[name.strip().lower()] = (max(1, int(workers)), max(0, int(queue or 0)))
+        except ValueError:
+            log.warning("[executors] bad EXECUTOR_SIZES entry: %r", part)
+    return out
+
+_OVERRIDES = _parse(EXECUTOR_SIZES)
+_SIZES = {**_DEFAULTS, **_OVERRIDES}
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, queue: int):
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"exec-{name}")
+        self._lock = threading.Lock()  # счётчики меняются и из потоков пула
+        self.pending = 0   # принято и ещё не завершено
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.peak = 0
+        self.wait = LatencyTracker()  # сколько задача простояла в очереди
+
+    def submit(self, fn: Callable, *args) -> "asyncio.Future":
+        with self._lock:
+            if self.pending >= self.workers + self.queue:
+                self.rejected += 1
+                raise Overloaded(f"{self.name}: занято {self.pending} из {self.workers}+{self.queue}")
+            self.pending += 1
+            self.submitted += 1
+            self.peak = max(self.peak, self.pending)
+        queued_at = time.monotonic()
+
+        def _run():
+            self.wait.observe(time.monotonic() - queued_at)
+            with self._lock:
+                self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        def _done(_):
+            with self._lock:
+                self.pending -= 1
+
+        try:
+            cf = self._pool.submit(_run)
+        except BaseException:
+            _done(None)
+            raise
+        # отмена до старта (таймаут вызывающего) снимает задачу из очереди — _done всё равно сработает
+        cf.add_done_callback(_done)
+        return asyncio.wrap_future(cf)
+
+    async def run(self, fn: Callable, *args):
+        return await self.submit(fn, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        p95 = self.wait.percentile(0.95)
+        return {
+            "workers": self.workers,
+            "queue": self.queue,
+            "running": self.running,
+            "queued": max(0, self.pending - self.running),
+            "peak": self.peak,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "wait_p95_s": round(p95, 3) if p95 is not None else None,
+        }
+
+_executors: Dict[str, BoundedExecutor] = {}
+_reg_lock = threading.Lock()
+
+def executor(name: str) -> BoundedExecutor:
+    ex = _executors.get(name)
+    if ex is None:
+        with _reg_lock:
+            ex = _executors.get(name)
+            if ex is None:
+                workers, queue = _SIZES.get(name, _FALLBACK)
+                ex = _executors[name] = BoundedExecutor(name, workers, queue)
+    return ex
+
+def configure(name: str, workers: int, queue: int):
+    """Размер пула по умолчанию от его владельца; звать до первого run(). EXECUTOR_SIZES главнее."""
+    if name in _OVERRIDES:
+        return
+    with _reg_lock:
+        if name in _executors:
+            log.warning("[executors] %s already started, configure() ignored", name)
+            return
+        _SIZES[name] = (max(1, workers), max(0, queue))
+
+def submit(name: str, fn: Callable, *args) -> "asyncio.Future":
+    return executor(name).submit(fn, *args)
+
+async def run(name: str, fn: Callable, *args):
+    return await executor(name).submit(fn, *args)
+
+def shutdown():
+    for ex in list(_executors.values()):
+        ex.shutdown()
+
+def stats() -> dict:
+    return {name: ex.stats() for name, ex in _executors.items()}
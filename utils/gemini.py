@@ -1,22 +1,8 @@
 # D:\telegram_reminder_bot\utils\gemini.py
-import re
-import asyncio
-from typing import List, Dict
-from google import genai
-from config import GEMINI_API_KEY, GEMINI_MODEL
-
-# Инициализируем клиент один раз
-_client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
-
-def _smart_trim(text: str, limit: int) -> str:
-    if len(text) <= limit:
-        return text
-    cut = text[:limit]
-    for sep in (". ", "! ", "? ", "\n", " "):
-        p = cut.rfind(sep)
-        if p >= int(limit * 0.6):
-            return cut[:p+1].rstrip()
-    return cut.rstrip() + "…"
+from typing import AsyncIterator, List, Dict
+from config import GEMINI_MODEL, GEMINI_THINKING_RESERVE
+from utils import budget, executors, providers
+from utils.aio_bridge import iterate_in_thread
 
 def _history_to_prompt(history: List[Dict], model_name: str) -> str:
     """
@@ -28,7 +14,9 @@ def _history_to_prompt(history: List[Dict], model_name: str) -> str:
         "Если спрашивают, какая ты модель — отвечай точным названием Gemini."
     ]
     for m in history:
-        role = "user" if m.get("role") == "user" else "assistant"
+        role = m.get("role")
+        if role not in ("user", "system"):
+            role = "assistant"
         content = (m.get("content") or "").strip()
         if content:
             lines.append(f"[{role}] {content}")
@@ -36,25 +24,88 @@ def _history_to_prompt(history: List[Dict], model_name: str) -> str:
     lines.append("[assistant]")
     return "\n".join(lines)
 
-def _call_sync(history: List[Dict], allow_long: bool, max_len: int, model_name: str) -> str:
-    if not _client:
-        return "❗ GEMINI_API_KEY не задан (config_secrets.py / переменные окружения)."
+_NO_KEY = "❗ GEMINI_API_KEY не задан (config_secrets.py / переменные окружения)."
+
+def _config(model: str, max_tokens: int, timeout: float = None) -> dict:
+    # у 2.5-моделей «размышления» входят в max_output_tokens — оставляем запас
+    if "2.5" in model:
+        max_tokens += GEMINI_THINKING_RESERVE
+    config = {"max_output_tokens": max_tokens}
+    if timeout:
+        # таймаут HTTP-запроса (мс): по дедлайну поток SDK освобождается, а не ждёт ответа
+        config["http_options"] = {"timeout": int(timeout * 1000)}
+    return config
+
+def _finish(resp, allow_long: bool, max_len: int, max_tokens: int = 0) -> str:
+    out = (getattr(resp, "text", "") or "").strip()
+    meta = getattr(resp, "usage_metadata", None)
+    budget.record("gemini", max_tokens, getattr(meta, "candidates_token_count", None), out, False)
+    return budget.clean_reply(out, allow_long, max_len)
+
+def _call_sync(history: List[Dict], allow_long: bool, max_len: int, model_name: str,
+               timeout: float = None) -> str:
+    client = providers.gemini()  # один клиент на процесс
+    if not client:
+        return _NO_KEY
 
     model = model_name or GEMINI_MODEL or "gemini-2.5-flash"
+    max_tokens = budget.token_budget(max_len, allow_long)
     try:
         prompt = _history_to_prompt(history, model)
-        # Без types.*, без thinking_config — максимально совместимый вызов
-        resp = _client.models.generate_content(
+        # Без types.*, без thinking_config — максимально совместимый вызов (config — обычный dict)
+        resp = client.models.generate_content(
             model=model,
             contents=prompt,
+            config=_config(model, max_tokens, timeout),
         )
-        out = (getattr(resp, "text", "") or "").strip()
-        # На всякий случай срежем возможные префиксы
-        out = re.sub(r"^(?:model|assistant)\s*:\s*", "", out, flags=re.I).strip()
-        return out if allow_long else _smart_trim(out, max_len)
+        return _finish(resp, allow_long, max_len, max_tokens)
     except Exception as e:
         return f"⚠️ Gemini error: {e}"
 
-async def ask_gemini(history: List[Dict], allow_long: bool, max_len: int = 500, model: str = None) -> str:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _call_sync, history, allow_long, max_len, model or "")
+async def _call_async(history: List[Dict], allow_long: bool, max_len: int, model_name: str,
+                      timeout: float = None) -> str:
+    client = providers.gemini()
+    if not client:
+        return _NO_KEY
+
+    model = model_name or GEMINI_MODEL or "gemini-2.5-flash"
+    max_tokens = budget.token_budget(max_len, allow_long)
+    try:
+        resp = await client.aio.models.generate_content(
+            model=model,
+            contents=_history_to_prompt(history, model),
+            config=_config(model, max_tokens, timeout),
+        )
+        return _finish(resp, allow_long, max_len, max_tokens)
+    except Exception as e:
+        return f"⚠️ Gemini error: {e}"
+
+async def ask_gemini(history: List[Dict], allow_long: bool, max_len: int = 500, model: str = None,
+                     timeout: float = None) -> str:
+    """Ошибки провайдера — текстом; переполнение пула — executors.Overloaded (это не сбой Gemini)."""
+    if providers.use_async():
+        return await _call_async(history, allow_long, max_len, model or "", timeout)
+    return await executors.run("gemini", _call_sync, history, allow_long, max_len, model or "", timeout)
+
+
+async def stream_gemini(history: List[Dict], model: str = None,
+                        max_tokens: int = None, timeout: float = None) -> AsyncIterator[str]:
+    """
+    Куски ответа по мере генерации (без обрезки); ошибки — исключениями.
+    Стрим google-genai читается синхронно даже через .aio — поэтому всегда в потоке.
+    """
+    client = providers.gemini()
+    if not client:
+        raise RuntimeError(_NO_KEY)
+    model = model or GEMINI_MODEL or "gemini-2.5-flash"
+    prompt = _history_to_prompt(history, model)
+    config = _config(model, max_tokens or budget.token_budget(0, True), timeout)
+
+    def _deltas():
+        for resp in client.models.generate_content_stream(model=model, contents=prompt, config=config):
+            text = getattr(resp, "text", "") or ""
+            if text:
+                yield text
+
+    async for delta in iterate_in_thread(_deltas, executor="gemini"):
+        yield delta
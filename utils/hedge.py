@@ -0,0 +1,133 @@
+# utils/hedge.py
+"""
+Хеджирование запросов к ИИ (HEDGE_REQUESTS=1).
+
+Если выбранный движок не ответил за адаптивную задержку — перцентиль
+HEDGE_PERCENTILE его недавних задержек (utils/latency), зажатый в
+[HEDGE_MIN_DELAY, HEDGE_MAX_DELAY], — тот же запрос уходит во второй движок;
+берём ответ, пришедший первым (и не ошибку), проигравшего отменяем.
+Для стрима «ответом» считается первый кусок текста.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from config import (
+    HEDGE_DEFAULT_DELAY, HEDGE_MAX_DELAY, HEDGE_MIN_DELAY, HEDGE_PERCENTILE, HEDGE_REQUESTS,
+)
+from utils import engines
+from utils.latency import tracker
+
+log = logging.getLogger("hedge")
+
+_MIN_SAMPLES = 20
+_stats = {"requests": 0, "hedged": 0, "primary_won": 0, "secondary_won": 0}
+
+def delay_for(name: str) -> float:
+    t = tracker(name)
+    if len(t) < _MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, t.percentile(HEDGE_PERCENTILE)))
+
+def _enabled(engine: str) -> bool:
+    return HEDGE_REQUESTS and engines.usable(engines.other(engine))
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is not None and not task.done():
+        task.cancel()
+        with contextlib.suppress(BaseException):
+            await task
+
+async def ask(engine: str, history: List[Dict], allow_long: bool, max_len: int,
+              timeout: float = None) -> Tuple[str, str]:
+    """(ответ, движок-победитель); timeout — общий дедлайн на оба движка."""
+    timeout = timeout or engines.timeout_for(engine)
+    if not _enabled(engine):
+        return await engines.ask(engine, history, allow_long, max_len, timeout), engine
+    _stats["requests"] += 1
+    t0 = time.monotonic()
+    primary = asyncio.create_task(engines.ask(engine, history, allow_long, max_len, timeout))
+    done, _ = await asyncio.wait({primary}, timeout=delay_for(engine))
+    if done:
+        _stats["primary_won"] += 1
+        return primary.result(), engine
+
+    _stats["hedged"] += 1
+    alt = engines.other(engine)
+    left = max(1.0, timeout - (time.monotonic() - t0))
+    secondary = asyncio.create_task(engines.ask(alt, history, allow_long, max_len, left))
+    owner = {primary: engine, secondary: alt}
+    pending = {primary, secondary}
+    reply, winner = None, engine
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                res = t.result() if not t.exception() else f"⚠️ Ошибка ИИ: {t.exception()}"
+                if reply is None or engines.is_error_reply(reply):
+                    reply, winner = res, owner[t]
+            if not engines.is_error_reply(reply):
+                break
+    finally:
+        for t in pending:
+            await _cancel(t)
+    _stats["primary_won" if winner == engine else "secondary_won"] += 1
+    return reply, winner
+
+async def stream(engine: str, history: List[Dict], max_tokens: int = None,
+                 timeout: float = None, info: Optional[dict] = None) -> AsyncIterator[str]:
+    """
+    Как engines.stream, но с хеджем по времени до первого куска.
+    info (если передан) получает "engine" — движок, чей ответ идёт в стрим.
+    """
+    if info is not None:
+        info["engine"] = engine
+    if not _enabled(engine):
+        async for d in engines.stream(engine, history, max_tokens, timeout):
+            yield d
+        return
+    _stats["requests"] += 1
+    gens = {engine: engines.stream(engine, history, max_tokens, timeout)}
+    firsts = {asyncio.ensure_future(gens[engine].__anext__()): engine}
+    done, _ = await asyncio.wait(firsts, timeout=delay_for(f"{engine}.ttft"))
+    if not done:
+        _stats["hedged"] += 1
+        alt = engines.other(engine)
+        gens[alt] = engines.stream(alt, history, max_tokens, timeout)
+        firsts[asyncio.ensure_future(gens[alt].__anext__())] = alt
+
+    winner, first, error = None, None, None
+    pending = set(firsts)
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if winner is None and not t.exception():
+                    winner, first = firsts[t], t.result()
+                elif t.exception() and not isinstance(t.exception(), StopAsyncIteration):
+                    error = t.exception()
+    finally:
+        for t in pending:
+            await _cancel(t)
+        for name, g in gens.items():
+            if name != winner:
+                with contextlib.suppress(BaseException):
+                    await g.aclose()
+    if winner is None:
+        if error is not None:
+            raise error
+        return
+    _stats["primary_won" if winner == engine else "secondary_won"] += 1
+    if info is not None:
+        info["engine"] = winner
+    yield first
+    try:
+        async for d in gens[winner]:
+            yield d
+    finally:
+        await gens[winner].aclose()
+
+def stats() -> dict:
+    return dict(_stats, enabled=bool(HEDGE_REQUESTS), percentile=HEDGE_PERCENTILE)
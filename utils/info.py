@@ -7,6 +7,8 @@ from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 from urllib.parse import quote
 
+from utils.deadlines import tool_call
+
 # ---- нормализация городов и простые алиасы (опечатки/падежи) ----
 _CITY_ALIASES = {
     # Kyiv
@@ -45,6 +47,7 @@ def _cleanup_city(raw: str) -> str:
     return s.capitalize()
 
 # ---------- HTTP ----------
+# потолок одного запроса; общий дедлайн инструмента (по p95, utils/deadlines) — в tool_call
 _TIMEOUT = aiohttp.ClientTimeout(total=10)
 
 async def _fetch_json(session: aiohttp.ClientSession, url: str) -> Any:
@@ -71,7 +74,10 @@ async def _geocode_city(session: aiohttp.ClientSession, city: str, lang: str) ->
     return res[0] if res else None
 
 async def weather_today(city: str, lang: str = "ru") -> str:
-    """Вернёт краткий отчёт о погоде сегодня."""
+    """Вернёт краткий отчёт о погоде сегодня (в пределах дедлайна; иначе ToolTimeout)."""
+    return await tool_call("weather", _weather_today(city, lang))
+
+async def _weather_today(city: str, lang: str) -> str:
     city = (city or "").strip()
     if not city:
         city = "Київ" if lang == "uk" else "Киев"
@@ -135,6 +141,9 @@ async def weather_today(city: str, lang: str = "ru") -> str:
 # ---------- Праздники сегодня ----------
 async def holidays_today(country_code: str = "UA") -> List[Dict[str, Any]]:
     """Возвращает список праздников на сегодня (локальные названия, если есть)."""
+    return await tool_call("holidays", _holidays_today(country_code))
+
+async def _holidays_today(country_code: str) -> List[Dict[str, Any]]:
     now = datetime.now(timezone.utc)
     year = now.year
     url = f"https://date.nager.at/api/v3/PublicHolidays/{year}/{country_code}"
@@ -158,6 +167,9 @@ def _strip_tags(s: str) -> str:
 
 async def web_search(query: str, lang: str = "ru", limit: int = 3) -> str:
     """Очень простой поиск (топ-N ссылок) без ключей. Для продакшена лучше Google CSE/SerpAPI."""
+    return await tool_call("search", _web_search(query, lang, limit))
+
+async def _web_search(query: str, lang: str, limit: int) -> str:
     q = query.strip()
     if not q:
         return "Пустой запрос."
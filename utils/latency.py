@@ -0,0 +1,53 @@
+# utils/latency.py
+"""
+Скользящие перцентили задержек по имени (движок, этап).
+
+Храним последние N замеров в кольцевом буфере; перцентиль считается
+сортировкой копии — N небольшое, вызывается раз на запрос.
+"""
+import math
+from collections import deque
+from typing import Deque, Dict, Optional
+
+_WINDOW = 200
+
+class LatencyTracker:
+    def __init__(self, window: int = _WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def observe(self, sec: float):
+        self._samples.append(max(0.0, sec))
+        self.count += 1
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        xs = sorted(self._samples)
+        i = min(len(xs) - 1, max(0, math.ceil(p * len(xs)) - 1))
+        return xs[i]
+
+    def snapshot(self) -> dict:
+        def r(x):
+            return round(x, 3) if x is not None else None
+        return {
+            "count": self.count,
+            "p50": r(self.percentile(0.5)),
+            "p90": r(self.percentile(0.9)),
+            "p95": r(self.percentile(0.95)),
+            "p99": r(self.percentile(0.99)),
+        }
+
+_trackers: Dict[str, LatencyTracker] = {}
+
+def tracker(name: str) -> LatencyTracker:
+    t = _trackers.get(name)
+    if t is None:
+        t = _trackers[name] = LatencyTracker()
+    return t
+
+def stats() -> dict:
+    return {name: t.snapshot() for name, t in sorted(_trackers.items())}
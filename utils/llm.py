@@ -1,48 +1,133 @@
 # utils/llm.py
-import re
-import asyncio
-from typing import List, Dict
+import time
+from typing import AsyncIterator, List, Dict, Optional
 from config import CEREBRAS_API_KEY, CEREBRAS_MODEL
+from utils import budget, executors, providers
+from utils.aio_bridge import iterate_in_thread
 
-__all__ = ["ask_cerebras"]
+__all__ = ["ask_cerebras", "stream_cerebras"]
 
-def _smart_trim(text: str, limit: int) -> str:
-    if len(text) <= limit:
-        return text
-    cut = text[:limit]
-    for sep in (". ", "! ", "? ", "\n", " "):
-        p = cut.rfind(sep)
-        if p >= int(limit * 0.6):
-            return cut[:p+1].rstrip()
-    return cut.rstrip() + "…"
+_NO_SDK = "⚠️ Cerebras SDK не установлен. Добавь 'cerebras-cloud-sdk' в requirements.txt или используй Gemini."
 
-def _call_sync(history: List[Dict], allow_long: bool, max_len: int, model_name: str) -> str:
+def _params(history: List[Dict], model_name: str, max_tokens: int, timeout: float = None) -> dict:
+    params = dict(
+        messages=history,
+        model=model_name or CEREBRAS_MODEL,
+        stream=True,
+        max_completion_tokens=max_tokens,
+        temperature=0.7,
+        top_p=0.9,
+    )
+    if timeout:
+        params["timeout"] = timeout  # таймаут HTTP-запроса SDK: зависший провайдер не держит поток
+    return params
+
+def _usage(chunk) -> Optional[int]:
+    usage = getattr(chunk, "usage", None)
+    return getattr(usage, "completion_tokens", None) if usage else None
+
+def _call_sync(history: List[Dict], allow_long: bool, max_len: int, model_name: str,
+               timeout: float = None) -> str:
     if not CEREBRAS_API_KEY:
         return "❗ CEREBRAS_API_KEY не задан."
+    client = providers.cerebras()  # общий клиент с keep-alive пулом
+    if client is None:
+        return _NO_SDK
+
+    limit = None if allow_long else max_len
+    max_tokens = budget.token_budget(max_len, allow_long)
+    at = time.monotonic() + timeout if timeout else None
     try:
-        from cerebras.cloud.sdk import Cerebras  # требует пакет 'cerebras-cloud-sdk' в requirements.txt
-    except Exception:
-        return "⚠️ Cerebras SDK не установлен. Добавь 'cerebras-cloud-sdk' в requirements.txt или используй Gemini."
+        stream = client.chat.completions.create(**_params(history, model_name, max_tokens, timeout))
+        out_parts, used, early = [], None, False
+        try:
+            for chunk in stream:
+                if at is not None and time.monotonic() > at:
+                    # вызывающий уже ответил «таймаут» — не догенерируем в потоке
+                    raise TimeoutError(f"дедлайн {timeout:.0f} с")
+                used = _usage(chunk) or used
+                if chunk.choices:
+                    out_parts.append(chunk.choices[0].delta.content or "")
+                if budget.enough("".join(out_parts), limit):
+                    early = True  # дальше — всё равно срежем; закрываем стрим
+                    break
+        finally:
+            stream.close()
+        budget.record("cerebras", max_tokens, used, "".join(out_parts), early)
+        return budget.clean_reply("".join(out_parts), allow_long, max_len)
+    except Exception as e:
+        return f"⚠️ Cerebras error: {e}"
+
+async def _call_async(history: List[Dict], allow_long: bool, max_len: int, model_name: str,
+                      timeout: float = None) -> str:
+    if not CEREBRAS_API_KEY:
+        return "❗ CEREBRAS_API_KEY не задан."
+    client = providers.cerebras_async()
+    if client is None:
+        return _NO_SDK
 
+    limit = None if allow_long else max_len
+    max_tokens = budget.token_budget(max_len, allow_long)
     try:
-        client = Cerebras(api_key=CEREBRAS_API_KEY)
-        stream = client.chat.completions.create(
-            messages=history,
-            model=model_name or CEREBRAS_MODEL,
-            stream=True,
-            max_completion_tokens=2000,
-            temperature=0.7,
-            top_p=0.9,
-        )
-        out_parts = []
-        for chunk in stream:
-            out_parts.append(chunk.choices[0].delta.content or "")
-        out = "".join(out_parts).strip()
-        out = re.sub(r"^(?:model|assistant)\s*:\s*", "", out, flags=re.I).strip()
-        return out if allow_long else _smart_trim(out, max_len)
+        stream = await client.chat.completions.create(**_params(history, model_name, max_tokens, timeout))
+        out_parts, used, early = [], None, False
+        try:
+            async for chunk in stream:
+                used = _usage(chunk) or used
+                if chunk.choices:
+                    out_parts.append(chunk.choices[0].delta.content or "")
+                if budget.enough("".join(out_parts), limit):
+                    early = True
+                    break
+        finally:
+            await stream.close()
+        budget.record("cerebras", max_tokens, used, "".join(out_parts), early)
+        return budget.clean_reply("".join(out_parts), allow_long, max_len)
     except Exception as e:
         return f"⚠️ Cerebras error: {e}"
 
-async def ask_cerebras(history: List[Dict], allow_long: bool, max_len: int = 600, model: str = "") -> str:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _call_sync, history, allow_long, max_len, model or "")
+async def ask_cerebras(history: List[Dict], allow_long: bool, max_len: int = 600, model: str = "",
+                       timeout: float = None) -> str:
+    """Ошибки провайдера — текстом; переполнение пула — executors.Overloaded (это не сбой Cerebras)."""
+    if providers.use_async():
+        return await _call_async(history, allow_long, max_len, model or "", timeout)
+    return await executors.run("cerebras", _call_sync, history, allow_long, max_len, model or "", timeout)
+
+async def stream_cerebras(history: List[Dict], model: str = "",
+                          max_tokens: int = None, timeout: float = None) -> AsyncIterator[str]:
+    """
+    Куски ответа по мере генерации (без обрезки); ошибки — исключениями.
+    Досрочная остановка — на стороне потребителя (aclose() закрывает HTTP-стрим).
+    """
+    if not CEREBRAS_API_KEY:
+        raise RuntimeError("CEREBRAS_API_KEY не задан.")
+    params = _params(history, model, max_tokens or budget.token_budget(0, True), timeout)
+    if providers.use_async():
+        client = providers.cerebras_async()
+        if client is None:
+            raise RuntimeError(_NO_SDK)
+        stream = await client.chat.completions.create(**params)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+        return
+    client = providers.cerebras()
+    if client is None:
+        raise RuntimeError(_NO_SDK)
+
+    def _deltas():
+        stream = client.chat.completions.create(**params)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+    async for delta in iterate_in_thread(_deltas, executor="cerebras"):
+        yield delta
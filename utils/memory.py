@@ -1,24 +1,315 @@
 # utils/memory.py
-from collections import defaultdict, deque
-from typing import Deque, Dict, List
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from config import (
+    DB_PATH, MEMORY_FLUSH_SEC, MEMORY_IDLE_TTL, MEMORY_MAX_TOTAL_CHARS, MEMORY_PERSIST,
+)
+from utils.db import get_con
 
-# простая «память» в ОЗУ по chat_id
+log = logging.getLogger("memory")
+
+# write-behind: история чатов переживает рестарт/деплой
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_memory (
+  scope      TEXT    NOT NULL,
+  chat_id    INTEGER NOT NULL,
+  history    TEXT    NOT NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (scope, chat_id)
+);
+"""
+
+_instances: "weakref.WeakSet[_Mem]" = weakref.WeakSet()
+
+_SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога: "
+
+class _Chat:
+    """
+    История одного чата: (role, content)-кортежи + бегущий счётчик символов.
+
+    summary — сжатое содержание старых ходов (utils/summarizer); base — сквозной
+    номер msgs[0] (сколько сообщений уже ушло из головы), по нему проверяем,
+    что сжатый кусок всё ещё на месте.
+    """
+    __slots__ = ("msgs", "chars", "seen", "summary", "base")
+
+    def __init__(self):
+        self.msgs: Deque[Tuple[str, str]] = deque()
+        self.chars = 0
+        self.seen = time.monotonic()
+        self.summary = ""
+        self.base = 0
+
+# простая «память» в ОЗУ по chat_id (+ отложенная запись в SQLite)
 class _Mem:
-    def __init__(self, max_msgs: int = 30, max_chars: int = 6000):
+    def __init__(self, max_msgs: int = 30, max_chars: int = 6000,
+                 max_total_chars: int = MEMORY_MAX_TOTAL_CHARS, idle_ttl: float = MEMORY_IDLE_TTL,
+                 scope: str = "chat", persist: bool = MEMORY_PERSIST):
         self.max_msgs = max_msgs
         self.max_chars = max_chars
-        self.store: Dict[int, Deque[dict]] = defaultdict(deque)
+        self.max_total_chars = max_total_chars  # общий бюджет на процесс
+        self.idle_ttl = idle_ttl                # чат без активности дольше — выселяем
+        self.store: "OrderedDict[int, _Chat]" = OrderedDict()  # LRU: давно неактивные слева
+        self.total_chars = 0
+        self.evicted = 0
+        # persistence
+        self.scope = scope
+        self.persist = persist
+        self._dirty: Set[int] = set()
+        self._pending: Dict[int, Optional[str]] = {}  # снимки выселенных/сброшенных чатов до flush (None — удалить)
+        self.restored = 0
+        self.flushes = 0
+        self.flushed_chats = 0
+        if persist:
+            with get_con(DB_PATH) as con:
+                con.executescript(_SCHEMA)
+        _instances.add(self)
+
+    # ---------- LRU ----------
+    def _touch(self, chat_id: int, create: bool):
+        c = self.store.get(chat_id)
+        if c is None:
+            c = self._restore(chat_id)
+            if c is None:
+                if not create:
+                    return None
+                c = _Chat()
+            self.store[chat_id] = c
+            self.total_chars += c.chars
+        else:
+            self.store.move_to_end(chat_id)
+        c.seen = time.monotonic()
+        return c
+
+    def _drop(self, chat_id: int):
+        c = self.store.pop(chat_id, None)
+        if c is not None:
+            self.total_chars -= c.chars
+            if chat_id in self._dirty:
+                self._dirty.discard(chat_id)
+                self._pending[chat_id] = self._dump(c)
+        return c
+
+    def _evict(self):
+        now = time.monotonic()
+        while len(self.store) > 1:
+            chat_id, c = next(iter(self.store.items()))
+            if self.total_chars <= self.max_total_chars and now - c.seen <= self.idle_ttl:
+                break
+            self._drop(chat_id)
+            self.evicted += 1
+
+    def _trim(self, c: _Chat):
+        while c.msgs and (len(c.msgs) > self.max_msgs or c.chars > self.max_chars):
+            _, old = c.msgs.popleft()
+            c.chars -= len(old)
+            c.base += 1
+            self.total_chars -= len(old)
+
+    # ---------- persistence ----------
+    @staticmethod
+    def _dump(c: _Chat) -> str:
+        if c.summary:
+            return json.dumps({"summary": c.summary, "msgs": list(c.msgs)}, ensure_ascii=False)
+        return json.dumps(list(c.msgs), ensure_ascii=False)
 
+    def _load(self, raw: Optional[str]) -> Optional[_Chat]:
+        if not raw:
+            return None
+        data = json.loads(raw)
+        c = _Chat()
+        if isinstance(data, dict):  # с summary
+            c.summary = data.get("summary") or ""
+            c.chars = len(c.summary)
+            data = data.get("msgs") or []
+        for role, content in data:
+            c.msgs.append((role, content))
+            c.chars += len(content)
+        while c.msgs and (len(c.msgs) > self.max_msgs or c.chars > self.max_chars):
+            _, old = c.msgs.popleft()
+            c.chars -= len(old)
+        return c
+
+    def _read(self, chat_id: int) -> Optional[str]:
+        with get_con(DB_PATH) as con:
+            row = con.execute(
+                "SELECT history FROM chat_memory WHERE scope=? AND chat_id=?", (self.scope, chat_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _restore(self, chat_id: int) -> Optional[_Chat]:
+        """
+        Восстановление при первом обращении после старта/выселения. Из диска —
+        только если чат не подгрузили заранее через prefetch() (обработчики
+        зовут его, поэтому в event loop сюда приходят уже тёплые чаты).
+        """
+        if not self.persist:
+            return None
+        if chat_id in self._pending:  # ещё не записанный снимок свежее диска
+            raw = self._pending[chat_id]
+            if raw is not None:
+                del self._pending[chat_id]
+                self._dirty.add(chat_id)
+            return self._load(raw)
+        try:
+            raw = self._read(chat_id)
+        except Exception as e:
+            log.warning("[memory] restore failed chat=%s: %s", chat_id, e)
+            return None
+        c = self._load(raw)
+        if c is not None:
+            self.restored += 1
+        return c
+
+    async def prefetch(self, chat_id: int):
+        """Подгрузить историю холодного чата в отдельном потоке, чтобы add/get не ждали диск."""
+        if not self.persist or chat_id in self.store or chat_id in self._pending:
+            return
+        try:
+            raw = await asyncio.to_thread(self._read, chat_id)
+        except Exception as e:
+            log.warning("[memory] prefetch failed chat=%s: %s", chat_id, e)
+            return
+        if chat_id in self.store or chat_id in self._pending:  # пока читали, чат ожил сам
+            return
+        c = self._load(raw)
+        if c is None:
+            c = _Chat()  # на диске пусто — новый чат тоже не должен читать диск в add()
+        else:
+            self.restored += 1
+        self.store[chat_id] = c
+        self.total_chars += c.chars
+        self._evict()
+
+    def _snapshot(self) -> Dict[int, Optional[str]]:
+        snap = dict(self._pending)
+        for chat_id in self._dirty:
+            c = self.store.get(chat_id)
+            snap[chat_id] = self._dump(c) if c is not None else None
+        self._dirty.clear()
+        self._pending.clear()
+        return snap
+
+    def _write(self, snap: Dict[int, Optional[str]]):
+        # одна транзакция на flush
+        with get_con(DB_PATH) as con:
+            con.executemany(
+                """
+                INSERT INTO chat_memory(scope, chat_id, history) VALUES(?,?,?)
+                ON CONFLICT(scope, chat_id) DO UPDATE SET history=excluded.history, updated_at=CURRENT_TIMESTAMP
+                """,
+                [(self.scope, cid, h) for cid, h in snap.items() if h is not None],
+            )
+            con.executemany(
+                "DELETE FROM chat_memory WHERE scope=? AND chat_id=?",
+                [(self.scope, cid) for cid, h in snap.items() if h is None],
+            )
+
+    async def flush(self):
+        """Снимок грязных чатов берём в event loop, пишем в отдельном потоке."""
+        if not self.persist or not (self._dirty or self._pending):
+            return
+        snap = self._snapshot()
+        try:
+            await asyncio.to_thread(self._write, snap)
+            self.flushes += 1
+            self.flushed_chats += len(snap)
+        except Exception as e:
+            log.exception("[memory] flush failed (%d chats): %s", len(snap), e)
+            for cid, h in snap.items():  # вернём в очередь — запишем в следующий раз
+                if cid not in self._dirty:
+                    self._pending.setdefault(cid, h)
+
+    # ---------- API ----------
     def add(self, chat_id: int, role: str, content: str):
-        q = self.store[chat_id]
-        q.append({"role": role, "content": content or ""})
-        while len(q) > self.max_msgs or sum(len(m["content"]) for m in q) > self.max_chars:
-            q.popleft()
+        content = content or ""
+        c = self._touch(chat_id, create=True)
+        c.msgs.append((role, content))
+        c.chars += len(content)
+        self.total_chars += len(content)
+        self._trim(c)
+        if self.persist:
+            self._dirty.add(chat_id)
+        self._evict()
 
     def get(self, chat_id: int) -> List[dict]:
-        return list(self.store.get(chat_id, []))
+        c = self._touch(chat_id, create=False)
+        if c is None:
+            return []
+        out = [{"role": "system", "content": _SUMMARY_PREFIX + c.summary}] if c.summary else []
+        out.extend({"role": r, "content": t} for r, t in c.msgs)
+        return out
+
+    # ---------- сжатие старых ходов (utils/summarizer) ----------
+    def compaction_candidate(self, chat_id: int, keep: int, trigger_chars: int):
+        """
+        Если история чата переросла порог, вернёт (ticket, summary, old), где
+        old — старые ходы (всё, кроме последних keep), ticket — для apply_summary.
+        Иначе None.
+        """
+        c = self.store.get(chat_id)
+        if c is None or len(c.msgs) <= keep:
+            return None
+        msg_chars = c.chars - len(c.summary)
+        # по числу сообщений срабатываем заранее, пока _trim не начал молча выбрасывать голову
+        if msg_chars < trigger_chars and len(c.msgs) < self.max_msgs - 2:
+            return None
+        n = len(c.msgs) - keep
+        old = [{"role": r, "content": t} for r, t in list(c.msgs)[:n]]
+        return (c, c.base + n), c.summary, old
+
+    def apply_summary(self, chat_id: int, ticket, summary: str) -> bool:
+        """Заменяет сжатые ходы на summary. False — чат за это время сбросили/выселили."""
+        c, end = ticket
+        if self.store.get(chat_id) is not c:
+            return False
+        while c.msgs and c.base < end:
+            _, old = c.msgs.popleft()
+            c.chars -= len(old)
+            c.base += 1
+            self.total_chars -= len(old)
+        delta = len(summary) - len(c.summary)
+        c.summary = summary
+        c.chars += delta
+        self.total_chars += delta
+        if self.persist:
+            self._dirty.add(chat_id)
+        return True
 
     def reset(self, chat_id: int):
-        self.store.pop(chat_id, None)
+        self._drop(chat_id)
+        if self.persist:
+            self._dirty.discard(chat_id)
+            self._pending[chat_id] = None
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self.store),
+            "chars": self.total_chars,
+            "max_total_chars": self.max_total_chars,
+            "evicted": self.evicted,
+            "dirty": len(self._dirty) + len(self._pending),
+            "restored": self.restored,
+            "flushes": self.flushes,
+            "flushed_chats": self.flushed_chats,
+        }
+
+async def flush_all():
+    for m in list(_instances):
+        await m.flush()
+
+async def run_flusher(interval: float = MEMORY_FLUSH_SEC):
+    """Фоновая задача: раз в interval секунд сбрасывает грязные истории всех _Mem."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush_all()
+    finally:
+        await flush_all()  # финальный сброс при остановке
 
 memory = _Mem()
@@ -1,8 +1,8 @@
 # utils/notes.py
-import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from config import DB_PATH
+from typing import List, Dict, Any, Callable, Iterator, Optional
+from config import DB_PATH, REMINDER_LEASE_SEC, WORKER_ID
+from utils.db import get_con
 
 _SCHEMA = """
 CREATE TABLE IF NOT EXISTS notes (
@@ -13,7 +13,9 @@ CREATE TABLE IF NOT EXISTS notes (
   status       TEXT    NOT NULL CHECK(status IN ('open','done','snoozed')),
   created_at   DATETIME DEFAULT CURRENT_TIMESTAMP,
   updated_at   DATETIME DEFAULT CURRENT_TIMESTAMP,
-  snooze_until DATETIME
+  snooze_until DATETIME,
+  claimed_by   TEXT,
+  lease_until  DATETIME
 );
 CREATE INDEX IF NOT EXISTS idx_notes_user_chat ON notes(user_id, chat_id);
 CREATE INDEX IF NOT EXISTS idx_notes_status ON notes(status);
@@ -21,11 +23,41 @@ CREATE INDEX IF NOT EXISTS idx_notes_snooze ON notes(snooze_until);
 """
 
 def _con():
-    con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-    return con
+    return get_con(DB_PATH)
+
+# lease-колонки для нескольких реплик: напоминание «взято» воркером claimed_by
+# до lease_until; если воркер упал до ack_sent — по истечении аренды его заберёт другой
+_MIGRATIONS = (
+    ("claimed_by", "ALTER TABLE notes ADD COLUMN claimed_by TEXT"),
+    ("lease_until", "ALTER TABLE notes ADD COLUMN lease_until DATETIME"),
+)
 
 with _con() as con:
     con.executescript(_SCHEMA)
+    _cols = {r[1] for r in con.execute("PRAGMA table_info(notes)")}
+    for _col, _sql in _MIGRATIONS:
+        if _col not in _cols:
+            con.execute(_sql)
+
+def _fmt(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+# подписчики на изменения snooze_until: fn(note_id, snooze_until | None)
+_listeners: List[Callable[[int, Optional[str]], None]] = []
+
+def subscribe(fn: Callable[[int, Optional[str]], None]):
+    _listeners.append(fn)
+
+def unsubscribe(fn: Callable[[int, Optional[str]], None]):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+def _notify(note_id: int, snooze_until: Optional[str]):
+    for fn in list(_listeners):
+        try:
+            fn(note_id, snooze_until)
+        except Exception:
+            pass
 
 def add(user_id: int, chat_id: int, text: str) -> int:
     with _con() as con:
@@ -38,28 +70,36 @@ def add(user_id: int, chat_id: int, text: str) -> int:
 def set_done(note_id: int):
     with _con() as con:
         con.execute(
-            "UPDATE notes SET status='done', updated_at=CURRENT_TIMESTAMP, snooze_until=NULL WHERE id=?",
+            "UPDATE notes SET status='done', updated_at=CURRENT_TIMESTAMP, snooze_until=NULL, "
+            "claimed_by=NULL, lease_until=NULL WHERE id=?",
             (note_id,),
         )
+    _notify(note_id, None)
 
 def keep_open(note_id: int):
     with _con() as con:
         con.execute(
-            "UPDATE notes SET status='open', updated_at=CURRENT_TIMESTAMP, snooze_until=NULL WHERE id=?",
+            "UPDATE notes SET status='open', updated_at=CURRENT_TIMESTAMP, snooze_until=NULL, "
+            "claimed_by=NULL, lease_until=NULL WHERE id=?",
             (note_id,),
         )
+    _notify(note_id, None)
 
 def snooze(note_id: int, minutes: int):
     dt = datetime.utcnow() + timedelta(minutes=max(1, int(minutes)))
+    until = dt.strftime("%Y-%m-%d %H:%M:%S")
     with _con() as con:
         con.execute(
-            "UPDATE notes SET status='snoozed', updated_at=CURRENT_TIMESTAMP, snooze_until=? WHERE id=?",
-            (dt.strftime("%Y-%m-%d %H:%M:%S"), note_id),
+            "UPDATE notes SET status='snoozed', updated_at=CURRENT_TIMESTAMP, snooze_until=?, "
+            "claimed_by=NULL, lease_until=NULL WHERE id=?",
+            (until, note_id),
         )
+    _notify(note_id, until)
 
 def delete(note_id: int):
     with _con() as con:
         con.execute("DELETE FROM notes WHERE id=?", (note_id,))
+    _notify(note_id, None)
 
 def list_open_all(user_id: int, chat_id: int, limit: int) -> List[Dict[str, Any]]:
     with _con() as con:
@@ -91,6 +131,32 @@ def list_pending(user_id: int, chat_id: int, limit: int) -> List[Dict[str, Any]]
         rows = cur.fetchall()
     return [{"id": r[0], "text": r[1], "status": r[2], "snooze_until": r[3], "created_at": r[4]} for r in rows]
 
+def _page(where: str, params: tuple, after_id: int, before_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    """Keyset-пагинация по id: следующая страница — id > after_id, предыдущая — id < before_id."""
+    if before_id is not None:
+        sql = f"SELECT id, text, status, snooze_until, created_at FROM notes WHERE {where} AND id<? ORDER BY id DESC LIMIT ?"
+        args = params + (before_id, limit)
+    else:
+        sql = f"SELECT id, text, status, snooze_until, created_at FROM notes WHERE {where} AND id>? ORDER BY id ASC LIMIT ?"
+        args = params + (after_id, limit)
+    with _con() as con:
+        rows = con.execute(sql, args).fetchall()
+    if before_id is not None:
+        rows.reverse()
+    return [{"id": r[0], "text": r[1], "status": r[2], "snooze_until": r[3], "created_at": r[4]} for r in rows]
+
+def list_open_page(user_id: int, chat_id: int, after_id: int = 0, limit: int = 10,
+                   before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    return _page("user_id=? AND chat_id=? AND status IN ('open','snoozed')",
+                 (user_id, chat_id), after_id, before_id, limit)
+
+def list_pending_page(user_id: int, chat_id: int, after_id: int = 0, limit: int = 10,
+                      before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    return _page("user_id=? AND chat_id=? "
+                 "AND (status='open' OR (status='snoozed' AND (snooze_until IS NULL OR snooze_until<=?)))",
+                 (user_id, chat_id, now), after_id, before_id, limit)
+
 def list_due(limit: int) -> List[Dict[str, Any]]:
     now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     with _con() as con:
@@ -106,6 +172,99 @@ def list_due(limit: int) -> List[Dict[str, Any]]:
         rows = cur.fetchall()
     return [{"id": r[0], "user_id": r[1], "chat_id": r[2], "text": r[3], "snooze_until": r[4]} for r in rows]
 
+def claim_due(limit: int, batch: int = 100, worker: str = WORKER_ID,
+              lease_sec: float = REMINDER_LEASE_SEC) -> Iterator[Dict[str, Any]]:
+    """
+    Атомарно арендует наступившие напоминания и отдаёт их генератором.
+
+    Одна транзакция на пачку из batch строк; BEGIN IMMEDIATE сразу берёт
+    write-lock, поэтому две реплики (или cron + loop) не арендуют одну заметку.
+    Заметка остаётся 'snoozed' с claimed_by=worker до ack_sent(); если воркер
+    упал раньше, после lease_until её снова заберёт claim_due любой реплики.
+    """
+    left = int(limit)
+    while left > 0:
+        now = datetime.utcnow()
+        with _con() as con:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute(
+                """
+                SELECT id, user_id, chat_id, text, snooze_until
+                  FROM notes
+                 WHERE status='snoozed' AND snooze_until IS NOT NULL AND snooze_until<=?
+                   AND (lease_until IS NULL OR lease_until<=?)
+                 ORDER BY snooze_until ASC
+                 LIMIT ?
+                """, (_fmt(now), _fmt(now), min(batch, left))
+            ).fetchall()
+            if rows:
+                ids = [r[0] for r in rows]
+                con.execute(
+                    f"UPDATE notes SET claimed_by=?, lease_until=? WHERE id IN ({','.join('?' * len(ids))})",
+                    [worker, _fmt(now + timedelta(seconds=lease_sec))] + ids,
+                )
+        for r in rows:
+            yield {"id": r[0], "user_id": r[1], "chat_id": r[2], "text": r[3], "snooze_until": r[4]}
+        if len(rows) < min(batch, left):
+            return
+        left -= len(rows)
+
+def ack_sent(note_ids: List[int], worker: str = WORKER_ID):
+    """Закрыть аренду после отправки: заметка возвращается в open (одним UPDATE)."""
+    if not note_ids:
+        return
+    with _con() as con:
+        con.execute(
+            f"UPDATE notes SET status='open', updated_at=CURRENT_TIMESTAMP, snooze_until=NULL, "
+            f"claimed_by=NULL, lease_until=NULL "
+            f"WHERE claimed_by=? AND status='snoozed' AND id IN ({','.join('?' * len(note_ids))})",
+            [worker] + list(note_ids),
+        )
+    for nid in note_ids:
+        _notify(nid, None)
+
+def renew_lease(note_ids: List[int], worker: str = WORKER_ID, lease_sec: float = REMINDER_LEASE_SEC):
+    """Продлить аренду ещё не отправленных заметок (пока идёт долгая рассылка)."""
+    if not note_ids:
+        return
+    until = _fmt(datetime.utcnow() + timedelta(seconds=lease_sec))
+    with _con() as con:
+        con.execute(
+            f"UPDATE notes SET lease_until=? "
+            f"WHERE claimed_by=? AND status='snoozed' AND id IN ({','.join('?' * len(note_ids))})",
+            [until, worker] + list(note_ids),
+        )
+
+# срок для планировщика: у арендованной заметки — конец аренды (тогда её можно перехватить)
+_DUE = "MAX(snooze_until, COALESCE(lease_until, snooze_until))"
+
+def list_upcoming(limit: int) -> List[Dict[str, Any]]:
+    """Все отложенные заметки (в т.ч. будущие) — для загрузки в планировщик."""
+    with _con() as con:
+        cur = con.execute(
+            f"""
+            SELECT id, {_DUE} AS due
+              FROM notes
+             WHERE status='snoozed' AND snooze_until IS NOT NULL
+             ORDER BY due ASC
+             LIMIT ?
+            """, (limit,)
+        )
+        rows = cur.fetchall()
+    return [{"id": r[0], "snooze_until": r[1]} for r in rows]
+
+def due_of(note_ids: List[int]) -> List[Dict[str, Any]]:
+    """Сроки (как в list_upcoming) для заметок, которые ещё отложены — например, в чужой аренде."""
+    if not note_ids:
+        return []
+    with _con() as con:
+        rows = con.execute(
+            f"SELECT id, {_DUE} FROM notes "
+            f"WHERE status='snoozed' AND snooze_until IS NOT NULL AND id IN ({','.join('?' * len(note_ids))})",
+            list(note_ids),
+        ).fetchall()
+    return [{"id": r[0], "snooze_until": r[1]} for r in rows]
+
 # удобная фасада
 class _NotesFacade:
     add = staticmethod(add)
@@ -115,6 +274,15 @@ class _NotesFacade:
     delete = staticmethod(delete)
     list_open_all = staticmethod(list_open_all)
     list_pending = staticmethod(list_pending)
+    list_open_page = staticmethod(list_open_page)
+    list_pending_page = staticmethod(list_pending_page)
     list_due = staticmethod(list_due)
+    claim_due = staticmethod(claim_due)
+    ack_sent = staticmethod(ack_sent)
+    renew_lease = staticmethod(renew_lease)
+    list_upcoming = staticmethod(list_upcoming)
+    due_of = staticmethod(due_of)
+    subscribe = staticmethod(subscribe)
+    unsubscribe = staticmethod(unsubscribe)
 
 notes_store = _NotesFacade()
@@ -0,0 +1,107 @@
+# utils/providers.py
+"""
+Реестр клиентов LLM-провайдеров: создаются один раз и переиспользуются.
+
+Раньше utils/llm собирал Cerebras(...) на каждое сообщение — TLS-рукопожатие,
+пул соединений и «прогрев» /v1/tcp_warming оплачивались каждым запросом.
+Теперь:
+- cerebras()        — синхронный клиент с keep-alive пулом (для LLM_TRANSPORT=thread);
+- cerebras_async()  — AsyncCerebras, по одному на event loop (LLM_TRANSPORT=async);
+- gemini()          — genai.Client (у него есть .aio для async-вызовов).
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from config import (
+    CEREBRAS_API_KEY, CEREBRAS_BASE_URL, GEMINI_API_KEY, GEMINI_BASE_URL,
+    LLM_KEEPALIVE_SEC, LLM_POOL_SIZE, LLM_TRANSPORT,
+)
+
+log = logging.getLogger("providers")
+
+_lock = threading.Lock()
+_sync: Dict[str, Any] = {}
+_async: Dict[int, Any] = {}  # id(loop) -> AsyncCerebras (httpx.AsyncClient привязан к своему loop)
+_created = {"cerebras": 0, "cerebras_async": 0, "gemini": 0}
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_POOL_SIZE,
+        keepalive_expiry=LLM_KEEPALIVE_SEC,
+    )
+
+def cerebras():
+    """Общий синхронный клиент Cerebras или None (нет ключа/SDK)."""
+    c = _sync.get("cerebras")
+    if c is not None or not CEREBRAS_API_KEY:
+        return c
+    with _lock:
+        c = _sync.get("cerebras")
+        if c is None:
+            try:
+                from cerebras.cloud.sdk import Cerebras, DefaultHttpxClient
+            except Exception:
+                return None
+            c = Cerebras(
+                api_key=CEREBRAS_API_KEY,
+                base_url=CEREBRAS_BASE_URL or None,
+                http_client=DefaultHttpxClient(limits=_limits()),
+            )
+            _sync["cerebras"] = c
+            _created["cerebras"] += 1
+    return c
+
+def cerebras_async():
+    """AsyncCerebras для текущего event loop или None."""
+    if not CEREBRAS_API_KEY:
+        return None
+    loop = asyncio.get_running_loop()
+    c = _async.get(id(loop))
+    if c is None:
+        try:
+            from cerebras.cloud.sdk import AsyncCerebras, DefaultAsyncHttpxClient
+        except Exception:
+            return None
+        c = AsyncCerebras(
+            api_key=CEREBRAS_API_KEY,
+            base_url=CEREBRAS_BASE_URL or None,
+            http_client=DefaultAsyncHttpxClient(limits=_limits()),
+            warm_tcp_connection=False,  # прогрев у SDK синхронный — в event loop не нужен
+        )
+        _async[id(loop)] = c
+        _created["cerebras_async"] += 1
+    return c
+
+def gemini():
+    """Общий genai.Client или None (нет ключа)."""
+    c = _sync.get("gemini")
+    if c is not None or not GEMINI_API_KEY:
+        return c
+    with _lock:
+        c = _sync.get("gemini")
+        if c is None:
+            from google import genai
+            opts = {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+            c = genai.Client(api_key=GEMINI_API_KEY, http_options=opts)
+            _sync["gemini"] = c
+            _created["gemini"] += 1
+    return c
+
+def use_async() -> bool:
+    return LLM_TRANSPORT == "async"
+
+async def aclose():
+    """Закрыть пулы соединений (при остановке)."""
+    c = _async.pop(id(asyncio.get_running_loop()), None)
+    if c is not None:
+        await c.close()
+    c = _sync.pop("cerebras", None)
+    if c is not None:
+        c.close()
+
+def stats() -> dict:
+    return {"transport": LLM_TRANSPORT, "clients_created": dict(_created)}
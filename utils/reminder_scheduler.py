@@ -0,0 +1,265 @@
+# utils/reminder_scheduler.py
+"""
+Событийный планировщик напоминаний (вместо опроса list_due раз в 60 с).
+
+- при старте грузим snooze_until всех отложенных заметок в min-heap;
+- спим ровно до ближайшего срока;
+- notes_store.snooze/set_done/keep_open/delete сообщают об изменениях,
+  и планировщик пере-взводится без похода в БД;
+- наступившую заметку в аренде другой реплики взводим заново на конец аренды:
+  если та реплика упала, заметку заберём сразу по истечении (notes.claim_due);
+- редкий resync подхватывает изменения, сделанные другими процессами;
+- гистограмма опозданий (факт отправки − snooze_until) для /debug/stats;
+- LeaseKeeper продлевает аренду, пока пачка ещё отправляется: лимит 1 msg/s
+  на чат и ретраи 429 легко растягивают рассылку дольше REMINDER_LEASE_SEC,
+  и без продления другая реплика забрала бы те же заметки повторно.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from config import REMINDER_LEASE_SEC, REMINDER_RESYNC_SEC
+from utils.notes import notes_store
+
+log = logging.getLogger("reminders")
+
+_LOAD_LIMIT = 10000
+_BATCH_LIMIT = 200
+# границы корзин гистограммы опозданий, секунды
+_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300)
+
+def _ts(s: str) -> float:
+    """snooze_until хранится в UTC как 'YYYY-MM-DD HH:MM:SS'."""
+    return datetime.strptime(s, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+class LeaseKeeper:
+    """
+    Держит аренду заметок, взятых claim_due, до ack_sent:
+
+        async with LeaseKeeper() as lease:
+            due = list(lease.track(notes_store.claim_due(limit=...)))
+            ...отправка...
+            lease.ack([it["id"] for it in due])
+
+    Каждые lease_sec/3 продлевает аренду всех взятых и ещё не подтверждённых.
+    """
+    def __init__(self, lease_sec: float = REMINDER_LEASE_SEC):
+        self.lease_sec = lease_sec
+        self._ids: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.renewals = 0
+
+    def track(self, items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for it in items:
+            self._ids.add(it["id"])
+            yield it
+
+    def ack(self, note_ids: List[int]):
+        """ack_sent + больше не продлевать."""
+        try:
+            notes_store.ack_sent(note_ids)
+        finally:
+            self._ids.difference_update(note_ids)
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_sec / 3)
+            if not self._ids:
+                continue
+            try:
+                notes_store.renew_lease(list(self._ids), lease_sec=self.lease_sec)
+                self.renewals += 1
+            except Exception as e:
+                log.exception("[reminders] renew_lease failed: %s", e)
+
+    async def __aenter__(self) -> "LeaseKeeper":
+        self._task = asyncio.create_task(self._renew_loop())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._ids.clear()
+
+class LatenessHistogram:
+    def __init__(self, buckets=_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, late: float):
+        late = max(0.0, late)
+        for i, b in enumerate(self.buckets):
+            if late <= b:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += late
+        self.max = max(self.max, late)
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b}s" for b in self.buckets] + ["+inf"]
+        return {
+            "count": self.count,
+            "avg_s": round(self.sum / self.count, 3) if self.count else None,
+            "max_s": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+class ReminderScheduler:
+    def __init__(self, send: Callable[[dict], Awaitable[None]]):
+        self._send = send
+        self._heap: List[Tuple[float, int]] = []
+        self._due_at: Dict[int, float] = {}  # note_id -> актуальный срок; устаревшие записи кучи пропускаем
+        self._wake = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_resync = 0.0
+        self.lateness = LatenessHistogram()
+        self.sent = 0
+        self.failed = 0
+
+    # ---------- уведомления от notes_store (из любого потока) ----------
+    def _on_change(self, note_id: int, snooze_until: Optional[str]):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._apply, note_id, snooze_until)
+
+    def _apply(self, note_id: int, snooze_until: Optional[str]):
+        if snooze_until is None:
+            self._due_at.pop(note_id, None)
+        else:
+            ts = _ts(snooze_until)
+            self._due_at[note_id] = ts
+            heapq.heappush(self._heap, (ts, note_id))
+        self._wake.set()
+
+    # ---------- загрузка из БД ----------
+    def _load(self):
+        rows = notes_store.list_upcoming(limit=_LOAD_LIMIT)
+        self._due_at = {r["id"]: _ts(r["snooze_until"]) for r in rows}
+        self._heap = [(ts, nid) for nid, ts in self._due_at.items()]
+        heapq.heapify(self._heap)
+        self._next_resync = time.time() + REMINDER_RESYNC_SEC
+        if len(rows) >= _LOAD_LIMIT:
+            # загрузили не всё — дочитаем, когда дойдём до последнего загруженного
+            self._next_resync = min(self._next_resync, _ts(rows[-1]["snooze_until"]))
+        log.info("[reminders] loaded %d snoozed notes", len(rows))
+
+    def _peek(self) -> Optional[float]:
+        """Ближайший актуальный срок; попутно выкидываем устаревшие записи."""
+        while self._heap:
+            ts, nid = self._heap[0]
+            if self._due_at.get(nid) == ts:
+                return ts
+            heapq.heappop(self._heap)
+        return None
+
+    # ---------- основной цикл ----------
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        notes_store.subscribe(self._on_change)
+        try:
+            self._load()
+            while True:
+                now = time.time()
+                nxt = self._peek()
+                if nxt is not None and nxt <= now:
+                    await self._fire(now)
+                    continue
+                if now >= self._next_resync:
+                    self._load()
+                    continue
+                wait = self._next_resync - now
+                if nxt is not None:
+                    wait = min(wait, nxt - now)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, wait))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            notes_store.unsubscribe(self._on_change)
+            self._loop = None
+
+    async def _fire(self, now: float):
+        # снимаем с кучи всё, что уже наступило; источник истины — БД
+        fired: Set[int] = set()
+        while True:
+            nxt = self._peek()
+            if nxt is None or nxt > now:
+                break
+            _, nid = heapq.heappop(self._heap)
+            self._due_at.pop(nid, None)
+            fired.add(nid)
+        claimed: Set[int] = set()
+        try:
+            await self._claim_and_send(claimed)
+        finally:
+            self._rearm(fired - claimed, now)
+
+    def _rearm(self, note_ids: Set[int], now: float):
+        """Наступившие, но не взятые нами (в аренде другой реплики) — взводим на конец аренды."""
+        if not note_ids:
+            return
+        try:
+            rows = notes_store.due_of(list(note_ids))
+        except Exception as e:
+            log.exception("[reminders] due_of failed (resync will pick them up): %s", e)
+            return
+        for r in rows:
+            # аренда могла истечь, пока слали свою пачку, — повтор через секунду, не в цикле
+            self._apply(r["id"], max(r["snooze_until"], _fmt(now + 1)))
+
+    async def _claim_and_send(self, claimed: Set[int]):
+        async with LeaseKeeper() as lease:
+            while True:
+                try:
+                    # claim_due арендует заметки за этим воркером — другие реплики их не возьмут
+                    due = list(lease.track(notes_store.claim_due(limit=_BATCH_LIMIT)))
+                    claimed.update(it["id"] for it in due)
+                except Exception as e:
+                    log.exception("[reminders] claim_due failed: %s", e)
+                    await asyncio.sleep(1)
+                    return
+                # отправляем пачку параллельно; лимиты Telegram соблюдает send (OutboundSender),
+                # аренду пока продлевает lease
+                await asyncio.gather(*(self._deliver(it) for it in due))
+                # закрываем аренду одним UPDATE (и для неудачных отправок — как раньше keep_open)
+                try:
+                    lease.ack([it["id"] for it in due])
+                except Exception as e:
+                    log.exception("[reminders] ack_sent failed (lease will expire): %s", e)
+                if len(due) < _BATCH_LIMIT:
+                    break
+
+    async def _deliver(self, it: dict):
+        try:
+            await self._send(it)
+            self.sent += 1
+            self.lateness.observe(time.time() - _ts(it["snooze_until"]))
+        except Exception as e:
+            self.failed += 1
+            log.exception("[reminders] send failed chat=%s note=%s: %s", it["chat_id"], it["id"], e)
+
+    def stats(self) -> dict:
+        nxt = self._peek()
+        return {
+            "scheduled": len(self._due_at),
+            "next_in_s": round(nxt - time.time(), 1) if nxt is not None else None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "lateness": self.lateness.snapshot(),
+        }
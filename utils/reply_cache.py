@@ -0,0 +1,163 @@
+# utils/reply_cache.py
+"""
+Кэш ответов ИИ перед вызовом движка (handlers/messages.any_text).
+
+Ключ — движок + allow_long + нормализованные последние REPLY_CACHE_TURNS
+сообщений истории («Привет!» и «привет» совпадают). L1 — LRU в памяти с TTL,
+L2 — таблица reply_cache в SQLite (переживает рестарт, общая для реплик).
+
+Не кэшируем (bypass), если в истории есть личный контекст: краткое
+содержание прошлого диалога (system), местоимения первого лица, e-mail,
+@упоминания, длинные числа — ответ на такое не подходит другому чату.
+И если вопрос про «сейчас» (дата, время, курс, погода, новости) — ответ
+устаревает быстрее любого TTL.
+"""
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import DB_PATH, REPLY_CACHE_ENABLED, REPLY_CACHE_SIZE, REPLY_CACHE_TTL, REPLY_CACHE_TURNS
+from utils.db import get_con
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reply_cache (
+  key        TEXT PRIMARY KEY,
+  engine     TEXT NOT NULL,
+  reply      TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  hits       INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_PURGE_EVERY = 200  # раз в столько записей чистим просроченное из L2
+
+_PERSONAL_RE = re.compile(
+    r"\b(я|мне|меня|мной|мой|моя|моё|мое|мои|моих|мы|нас|нам|наш|наша|наше|наши|"
+    r"мені|мене|мій|моє|ми|нас|наші|"
+    r"i|me|my|mine|we|our|us)\b"
+    r"|@|\d{3,}",
+    re.I,
+)
+
+_VOLATILE_RE = re.compile(
+    r"\b(сегодня|завтра|вчера|сейчас|текущ\w*|актуальн\w*|последн\w*|свеж\w*|"
+    r"дата|дату|числ[оа]|время|который час|сколько времени|курс\w*|погод\w*|новост\w*|цен[аыу]|"
+    r"сьогодні|вчора|зараз|новин\w*|"
+    r"today|tomorrow|yesterday|now|current|latest|date|time|weather|news|price|rate)\b",
+    re.I,
+)
+
+def is_personal(text: str) -> bool:
+    return bool(_PERSONAL_RE.search(text or ""))
+
+def is_volatile(text: str) -> bool:
+    """Вопрос про «сейчас»: вчерашний ответ на него неверен."""
+    return bool(_VOLATILE_RE.search(text or ""))
+
+def normalize(text: str) -> str:
+    s = (text or "").lower().replace("ё", "е")
+    s = re.sub(r"[^\w\s]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+class ReplyCache:
+    def __init__(self, path: str = DB_PATH, size: int = REPLY_CACHE_SIZE,
+                 ttl: float = REPLY_CACHE_TTL, turns: int = REPLY_CACHE_TURNS):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.turns = turns
+        self._l1: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (reply, created_at)
+        self._latency: Dict[str, float] = {}  # engine -> EWMA времени ответа движка, с
+        self._puts = 0
+        self._stats = {"lookups": 0, "hits_l1": 0, "hits_l2": 0, "misses": 0, "bypass": 0, "saved_s": 0.0}
+        with get_con(self.path) as con:
+            con.executescript(_SCHEMA)
+
+    # ---------- ключ ----------
+    def key(self, engine: str, history: List[dict], allow_long: bool) -> Optional[str]:
+        """None — в кэш не ходим (личный контекст)."""
+        recent = history[-self.turns:]
+        if not recent or any(m.get("role") == "system" for m in history):
+            return None
+        norm = []
+        for m in recent:
+            content = m.get("content") or ""
+            if m.get("role") == "user" and (is_personal(content) or is_volatile(content)):
+                return None
+            norm.append((m.get("role"), normalize(content)))
+        raw = json.dumps([engine, bool(allow_long), norm], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    # ---------- API ----------
+    def get(self, engine: str, key: Optional[str]) -> Optional[str]:
+        self._stats["lookups"] += 1
+        if key is None:
+            self._stats["bypass"] += 1
+            return None
+        now = time.time()
+        ent = self._l1.get(key)
+        if ent is not None and now - ent[1] < self.ttl:
+            self._l1.move_to_end(key)
+            self._hit("hits_l1", engine)
+            return ent[0]
+        with get_con(self.path) as con:
+            row = con.execute(
+                "SELECT reply, created_at FROM reply_cache WHERE key=? AND created_at>?", (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                con.execute("UPDATE reply_cache SET hits=hits+1 WHERE key=?", (key,))
+        if row is None:
+            self._l1.pop(key, None)
+            self._stats["misses"] += 1
+            return None
+        self._remember(key, row[0], row[1])
+        self._hit("hits_l2", engine)
+        return row[0]
+
+    def put(self, engine: str, key: Optional[str], reply: str, latency: float):
+        """latency — сколько ждали движок; из него считаем сэкономленное время на попаданиях."""
+        prev = self._latency.get(engine)
+        self._latency[engine] = latency if prev is None else prev * 0.8 + latency * 0.2
+        if key is None or not reply:
+            return
+        now = time.time()
+        self._remember(key, reply, now)
+        self._puts += 1
+        with get_con(self.path) as con:
+            con.execute(
+                """
+                INSERT INTO reply_cache(key, engine, reply, created_at) VALUES(?,?,?,?)
+                ON CONFLICT(key) DO UPDATE SET reply=excluded.reply, created_at=excluded.created_at
+                """,
+                (key, engine, reply, now),
+            )
+            if self._puts % _PURGE_EVERY == 0:
+                con.execute("DELETE FROM reply_cache WHERE created_at<=?", (now - self.ttl,))
+
+    def _remember(self, key: str, reply: str, created_at: float):
+        self._l1[key] = (reply, created_at)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.size:
+            self._l1.popitem(last=False)
+
+    def _hit(self, kind: str, engine: str):
+        self._stats[kind] += 1
+        self._stats["saved_s"] += self._latency.get(engine, 0.0)
+
+    def stats(self) -> dict:
+        st = self._stats
+        hits = st["hits_l1"] + st["hits_l2"]
+        cacheable = hits + st["misses"]
+        return dict(
+            st,
+            saved_s=round(st["saved_s"], 2),
+            size_l1=len(self._l1),
+            hit_rate=round(hits / cacheable, 3) if cacheable else None,
+            avg_latency_s={k: round(v, 3) for k, v in self._latency.items()},
+            enabled=REPLY_CACHE_ENABLED,
+        )
+
+reply_cache = ReplyCache()
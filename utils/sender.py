@@ -0,0 +1,162 @@
+# utils/sender.py
+"""
+Общий исходящий отправитель с учётом лимитов Telegram.
+
+- глобальный token bucket (~30 msg/s на бота);
+- token bucket на каждый чат (~1 msg/s);
+- ограниченная конкуренция (asyncio.Semaphore);
+- 429 -> ждём retry_after и повторяем;
+- счётчики и пропускная способность для /debug/stats.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import SEND_CHAT_RPS, SEND_CONCURRENCY, SEND_GLOBAL_RPS, SEND_MAX_RETRIES
+
+log = logging.getLogger("sender")
+
+_MAX_CHAT_BUCKETS = 10000
+_RATE_WINDOW = 60.0  # окно для расчёта msg/s
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self) -> float:
+        """Берёт токен (можно «в долг»); возвращает, сколько секунд подождать."""
+        self._refill(time.monotonic())
+        self.tokens -= 1.0
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class OutboundSender:
+    def __init__(self, bot: Bot,
+                 global_rps: float = SEND_GLOBAL_RPS,
+                 chat_rps: float = SEND_CHAT_RPS,
+                 concurrency: int = SEND_CONCURRENCY,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.bot = bot
+        self.chat_rps = chat_rps
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rps)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._sem = asyncio.Semaphore(concurrency)
+        self._stamps: Deque[float] = deque()
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                # полные вёдра ничем не отличаются от новых — их можно выбросить
+                for cid in [c for c, x in self._chats.items() if x.idle()]:
+                    del self._chats[cid]
+            b = self._chats[chat_id] = TokenBucket(self.chat_rps, 1)
+        return b
+
+    def _mark_sent(self):
+        now = time.monotonic()
+        self.sent += 1
+        self._stamps.append(now)
+        while self._stamps and now - self._stamps[0] > _RATE_WINDOW:
+            self._stamps.popleft()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        """bot.send_message с соблюдением лимитов; после max_retries 429 пробрасывает ошибку."""
+        for attempt in range(self.max_retries + 1):
+            # чатовый лимит ждём вне семафора, чтобы один «шумный» чат не занимал слоты
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            async with self._sem:
+                delay = self._global.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                self.in_flight += 1
+                try:
+                    msg = await self.bot.send_message(chat_id, text, **kwargs)
+                    self._mark_sent()
+                    return msg
+                except TelegramRetryAfter as e:
+                    if attempt >= self.max_retries:
+                        self.failed += 1
+                        raise
+                    self.retried += 1
+                    log.warning("[sender] 429 chat=%s retry_after=%ss (attempt %d)", chat_id, e.retry_after, attempt + 1)
+                    retry_after = e.retry_after
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.in_flight -= 1
+            await asyncio.sleep(retry_after)
+
+    async def send_many(self, items: Iterable[Any],
+                        render: Callable[[Any], Tuple[int, str, dict]],
+                        chunk: int = 100,
+                        on_chunk: Optional[Callable[[List[Any]], None]] = None) -> int:
+        """
+        Параллельная рассылка. items может быть генератором — читаем кусками
+        по chunk, чтобы не держать весь хвост в памяти. on_chunk(items) вызывается
+        после каждого куска. Возвращает число отправленных.
+        """
+        ok = 0
+        batch: List[Any] = []
+
+        async def _one(it) -> bool:
+            chat_id, text, kwargs = render(it)
+            try:
+                await self.send_message(chat_id, text, **kwargs)
+                return True
+            except Exception as e:
+                log.exception("[sender] send_message failed chat=%s: %s", chat_id, e)
+                return False
+
+        async def _flush():
+            nonlocal ok
+            res = await asyncio.gather(*(_one(it) for it in batch))
+            ok += sum(res)
+            if on_chunk:
+                on_chunk(list(batch))
+            batch.clear()
+
+        for it in items:
+            batch.append(it)
+            if len(batch) >= chunk:
+                await _flush()
+        if batch:
+            await _flush()
+        return ok
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        recent = sum(1 for t in self._stamps if now - t <= _RATE_WINDOW)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried_429": self.retried,
+            "in_flight": self.in_flight,
+            "msg_per_s_1m": round(recent / _RATE_WINDOW, 2),
+            "chat_buckets": len(self._chats),
+        }
@@ -0,0 +1,101 @@
+# utils/summarizer.py
+"""
+Сжатие старых ходов диалога (rolling summary).
+
+Когда история чата в _Mem переросла SUMMARY_TRIGGER_CHARS (или подходит к
+max_msgs), старые ходы, кроме последних SUMMARY_KEEP_MSGS, в фоне сворачиваются
+дешёвым движком (SUMMARY_ENGINE) в краткое содержание. Оно хранится в памяти
+чата (и пишется в SQLite вместе с историей), а memory.get() отдаёт его первым
+system-сообщением — в промпт уходит summary + свежие ходы.
+
+Ответ пользователю сжатие не задерживает: schedule() только ставит задачу.
+"""
+import asyncio
+import logging
+from typing import List, Set, Tuple
+
+from config import (
+    SUMMARY_ENABLED, SUMMARY_ENGINE, SUMMARY_KEEP_MSGS, SUMMARY_MAX_CHARS, SUMMARY_TRIGGER_CHARS,
+)
+
+log = logging.getLogger("summarizer")
+
+_SUMMARY_TIMEOUT = 30
+
+_running: Set[Tuple[int, int]] = set()  # (id(mem), chat_id) — не больше одной задачи на чат
+_tasks: Set[asyncio.Task] = set()
+_stats = {"runs": 0, "applied": 0, "failed": 0, "skipped": 0, "chars_in": 0, "chars_out": 0}
+
+def _prompt(prev: str, old: List[dict]) -> List[dict]:
+    lines = []
+    if prev:
+        lines.append(f"[прежнее краткое содержание] {prev}")
+    for m in old:
+        content = (m.get("content") or "").strip()
+        if content:
+            lines.append(f"[{m.get('role')}] {content}")
+    return [{
+        "role": "user",
+        "content": (
+            "Сожми фрагмент переписки в краткое содержание для продолжения диалога. "
+            "Сохрани факты о пользователе, договорённости, имена, числа и открытые вопросы; "
+            f"без вступлений, не длиннее {SUMMARY_MAX_CHARS} символов, на языке переписки.\n\n"
+            + "\n".join(lines)
+        ),
+    }]
+
+async def _ask(history: List[dict]) -> str:
+    if SUMMARY_ENGINE == "gemini":
+        from utils.gemini import ask_gemini
+        return await ask_gemini(history=history, allow_long=False, max_len=SUMMARY_MAX_CHARS)
+    from utils.llm import ask_cerebras
+    return await ask_cerebras(history=history, allow_long=False, max_len=SUMMARY_MAX_CHARS)
+
+def _is_error(text: str) -> bool:
+    # ask_* возвращают текст ошибки (исключение — только executors.Overloaded)
+    return not text or text.startswith(("⚠️", "❗"))
+
+async def _compact(mem, chat_id: int, ticket, prev: str, old: List[dict]):
+    _stats["runs"] += 1
+    try:
+        summary = await asyncio.wait_for(_ask(_prompt(prev, old)), timeout=_SUMMARY_TIMEOUT)
+        summary = (summary or "").strip()
+        if _is_error(summary):
+            _stats["failed"] += 1
+            log.warning("[summarizer] chat=%s engine=%s: %s", chat_id, SUMMARY_ENGINE, summary[:200])
+            return
+        if mem.apply_summary(chat_id, ticket, summary):
+            _stats["applied"] += 1
+            _stats["chars_in"] += len(prev) + sum(len(m["content"]) for m in old)
+            _stats["chars_out"] += len(summary)
+        else:
+            _stats["skipped"] += 1
+    except Exception as e:
+        _stats["failed"] += 1
+        log.warning("[summarizer] chat=%s failed: %s", chat_id, e)
+
+def schedule(mem, chat_id: int):
+    """Вызывать после add(); если пора — запускает сжатие в фоне."""
+    if not SUMMARY_ENABLED:
+        return
+    key = (id(mem), chat_id)
+    if key in _running:
+        return
+    cand = mem.compaction_candidate(chat_id, keep=SUMMARY_KEEP_MSGS, trigger_chars=SUMMARY_TRIGGER_CHARS)
+    if cand is None:
+        return
+    ticket, prev, old = cand
+    _running.add(key)
+    task = asyncio.create_task(_compact(mem, chat_id, ticket, prev, old))
+    _tasks.add(task)
+
+    def _done(t: asyncio.Task):
+        _tasks.discard(t)
+        _running.discard(key)
+    task.add_done_callback(_done)
+
+def stats() -> dict:
+    out = dict(_stats, enabled=SUMMARY_ENABLED, engine=SUMMARY_ENGINE, in_flight=len(_tasks))
+    if out["chars_in"]:
+        out["compression"] = round(out["chars_out"] / out["chars_in"], 3)
+    return out
@@ -0,0 +1,141 @@
+# utils/tg_stream.py
+"""
+Потоковый вывод ответа ИИ в Telegram.
+
+Сразу отправляем заглушку, затем редактируем её накопленным текстом не чаще
+раза в STREAM_EDIT_SEC (лимиты на edit_message_text; 429 сдвигает следующую
+правку на retry_after), в конце — финальная правка уже обрезанным текстом.
+Метрика — время до первого видимого текста (TTFT), в stats().
+stop_at — как только текста хватает на обрезку до stop_at символов, стрим
+закрывается (провайдер перестаёт генерировать).
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import STREAM_EDIT_SEC, STREAM_TIMEOUT
+from utils import budget, deadlines
+from utils.reminder_scheduler import LatenessHistogram
+
+log = logging.getLogger("tg_stream")
+
+TG_LIMIT = 4096
+_CURSOR = " ▍"
+_PLACEHOLDER = "…"
+
+_ttft = LatenessHistogram(buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 25))
+_stats = {"streams": 0, "edits": 0, "retry_after": 0, "errors": 0, "timeouts": 0}
+
+def _split(text: str, limit: int = TG_LIMIT):
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+class _Editor:
+    def __init__(self, msg: types.Message, interval: float):
+        self.msg = msg
+        self.interval = interval
+        self.next_at = 0.0
+        self.shown = ""
+
+    async def edit(self, text: str, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not text or text == self.shown or (not force and now < self.next_at):
+            return False
+        try:
+            await self.msg.edit_text(text)
+            self.shown = text
+            _stats["edits"] += 1
+            self.next_at = time.monotonic() + self.interval
+            return True
+        except TelegramRetryAfter as e:
+            _stats["retry_after"] += 1
+            self.next_at = time.monotonic() + e.retry_after
+            if force:  # финальную правку не теряем
+                await asyncio.sleep(e.retry_after)
+                return await self.edit(text, force=True)
+            return False
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                self.shown = text
+                return False
+            raise
+
+async def stream_reply(message: types.Message, deltas: AsyncIterator[str],
+                       finish: Callable[[str], str] = str.strip,
+                       timeout: float = STREAM_TIMEOUT,
+                       interval: float = STREAM_EDIT_SEC,
+                       timeout_text: Optional[str] = None,
+                       stop_at: Optional[int] = None,
+                       provider: Optional[str] = None, max_tokens: int = 0) -> Tuple[str, bool]:
+    """
+    Показывает стрим deltas в одном сообщении; возвращает (итоговый текст, ok).
+    Текст — finish(накопленное), при ошибке/таймауте без текста — сообщение
+    об ошибке; ok=False, если ответ оборван или его нет.
+    """
+    _stats["streams"] += 1
+    t0 = time.monotonic()
+    ed = _Editor(await message.answer(_PLACEHOLDER), interval)
+    text = ""
+    first = True
+    early = False
+    failed: Optional[str] = None
+    try:
+        async with asyncio.timeout(timeout):
+            async for d in deltas:
+                text += d
+                if not text.strip():
+                    continue
+                if await ed.edit(text[:TG_LIMIT - len(_CURSOR)] + _CURSOR) and first:
+                    first = False
+                    _ttft.observe(time.monotonic() - t0)
+                if budget.enough(text, stop_at):
+                    early = True
+                    break
+    except TimeoutError:
+        _stats["timeouts"] += 1
+        if provider:
+            deadlines.expired(f"{provider}.stream")
+        failed = timeout_text or f"⚠️ Превышено время ответа ИИ ({int(timeout)}с). Попробуй ещё раз или переключи модель."
+    except Exception as e:
+        _stats["errors"] += 1
+        log.warning("[tg_stream] stream failed: %s", e)
+        failed = f"⚠️ Ошибка ИИ: {e}"
+    finally:
+        aclose = getattr(deltas, "aclose", None)
+        if aclose:
+            try:
+                await aclose()
+            except Exception:
+                pass
+
+    if provider and text:
+        budget.record(provider, max_tokens, None, text, early)
+    final = finish(text) if text.strip() else ""
+    if not final:
+        final = failed or "(пустой ответ)"
+    elif failed:
+        final = final.rstrip() + " …"  # показываем, что ответ оборван
+    parts = _split(final)
+    try:
+        await ed.edit(parts[0], force=True)
+        for part in parts[1:]:
+            await message.answer(part)
+    except Exception as e:
+        log.warning("[tg_stream] finalize failed: %s", e)
+    return final, failed is None and bool(text.strip())
+
+def stats() -> dict:
+    return dict(_stats, ttft=_ttft.snapshot())